@@ -0,0 +1,225 @@
+"""
+Compares the capture latency profiles of cameras.py on stand-in sources.
+
+Frames from a v4l2loopback device fed by a player, or from videotestsrc
+standing in for the camera source, go through the compiled default graph
+the camera of a protocol runs and an encoder into a sink. The latency of
+every frame is measured from the moment the source pushes it to the
+moment it reaches the sink, which is what glass-to-glass latency adds on
+top of the sensor exposure and the network.
+
+Run from the repository root:
+
+    python benchmarks/capture_latency.py --protocol mjpeg --output results.json
+    python benchmarks/capture_latency.py --device /dev/video10 --protocol raw
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import threading
+import time
+from typing import Dict, List
+
+import gi
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from config import ElementConfig, LatencyProfile  # noqa: E402
+from latency import configure_encoder, configure_sink  # noqa: E402
+from pipeline_graph import DEFAULT_GRAPHS, compile_graph  # noqa: E402
+
+gi.require_version("Gst", "1.0")
+from gi.repository import Gst  # noqa: E402
+
+Gst.init(None)
+
+
+def make(factory, **properties):
+    element = Gst.ElementFactory.make(factory, None)
+    if element is None:
+        raise RuntimeError(f"GStreamer element {factory} is not available")
+
+    for name, value in properties.items():
+        element.set_property(name.replace("_", "-"), value)
+
+    return element
+
+
+def make_caps(caps):
+    return make("capsfilter", caps=Gst.Caps.from_string(caps))
+
+
+def get_graph_name(arguments) -> str:
+    """Mirrors get_graph_name of the camera classes"""
+    if arguments.protocol != "mjpeg":
+        return arguments.protocol
+
+    name = "mjpeg_decimated" if arguments.capture_framerate > arguments.framerate else "mjpeg"
+    return name + "_scaled" if arguments.decode_scale > 1 else name
+
+
+def get_graph_parameters(arguments) -> dict:
+    """Mirrors get_graph_parameters of the camera classes"""
+    parameters = {
+        "device": arguments.device,
+        "width": arguments.width,
+        "height": arguments.height,
+        "framerate": arguments.framerate,
+    }
+
+    if arguments.protocol == "mjpeg":
+        parameters.update(
+            capture_width=arguments.width * arguments.decode_scale,
+            capture_height=arguments.height * arguments.decode_scale,
+            capture_framerate=max(arguments.capture_framerate, arguments.framerate),
+            lowres=arguments.decode_scale.bit_length() - 1,
+        )
+
+    return parameters
+
+
+def get_stand_in(arguments) -> List[dict]:
+    """Replaces the camera source, produces what the camera would"""
+    source = {"factory": "videotestsrc", "name": "test-source",
+              "properties": {"is-live": True, "pattern": "ball"}}
+    if arguments.protocol == "raw":
+        return [source]
+
+    mode = "width=${capture_width}, height=${capture_height}, framerate=${capture_framerate}/1" \
+        if arguments.protocol == "mjpeg" else "width=${width}, height=${height}, framerate=${framerate}/1"
+    encoder = {"factory": "jpegenc", "name": "test-encoder"}
+    if arguments.protocol == "h264":
+        encoder = {"factory": "x264enc", "name": "test-encoder",
+                   "properties": {"tune": "zerolatency", "key-int-max": arguments.framerate}}
+
+    return [source,
+            {"factory": "capsfilter", "name": "test-filter",
+             "properties": {"caps": "video/x-raw, format=I420, " + mode}},
+            encoder]
+
+
+def create_chain(arguments, profile: LatencyProfile) -> List[Gst.Element]:
+    """
+    Source and decode elements of the compiled camera graph, then the
+    encoder of webrtcsink
+    """
+    graph = DEFAULT_GRAPHS[get_graph_name(arguments)]
+    if arguments.device is None:
+        stand_in = [ElementConfig(**config) for config in get_stand_in(arguments)]
+        graph = graph.model_copy(update={"source": stand_in + graph.source[1:]})
+
+    chain = compile_graph(graph, get_graph_parameters(arguments), profile).instantiate().chain
+
+    # webrtcsink defaults for x264enc
+    encoder = make("x264enc", bitrate=arguments.bitrate, threads=4)
+    Gst.util_set_object_arg(encoder, "tune", "zerolatency")
+    Gst.util_set_object_arg(encoder, "speed-preset", "ultrafast")
+    configure_encoder(encoder, profile)
+
+    return chain + [make("videoconvert"), make_caps("video/x-raw, format=I420"), encoder]
+
+
+def measure(arguments, profile: LatencyProfile) -> dict:
+    pipeline = Gst.Pipeline.new(f"latency-{profile.value}")
+
+    sink = make("fakesink", sync=True)
+    configure_sink(sink, profile)
+    elements = create_chain(arguments, profile) + [sink]
+
+    for element in elements:
+        pipeline.add(element)
+    for upstream, downstream in zip(elements, elements[1:]):
+        if not upstream.link(downstream):
+            raise RuntimeError(f"Cannot link {upstream.get_name()} to {downstream.get_name()}")
+
+    pushed: Dict[int, int] = {}
+    latencies = []
+    lock = threading.Lock()
+    measuring = threading.Event()
+
+    def on_pushed(pad, info):
+        buffer = info.get_buffer()
+        if measuring.is_set() and buffer.pts != Gst.CLOCK_TIME_NONE:
+            with lock:
+                pushed[buffer.pts] = time.monotonic_ns()
+        return Gst.PadProbeReturn.OK
+
+    def on_received(pad, info):
+        buffer = info.get_buffer()
+        now = time.monotonic_ns()
+        with lock:
+            started = pushed.pop(buffer.pts, None)
+        if started is not None:
+            latencies.append((now - started) / 1e6)
+        return Gst.PadProbeReturn.OK
+
+    elements[0].get_static_pad("src").add_probe(Gst.PadProbeType.BUFFER, on_pushed)
+    sink.get_static_pad("sink").add_probe(Gst.PadProbeType.BUFFER, on_received)
+
+    pipeline.set_state(Gst.State.PLAYING)
+    time.sleep(arguments.warmup)
+    measuring.set()
+    time.sleep(arguments.duration)
+    measuring.clear()
+    pipeline.set_state(Gst.State.NULL)
+
+    timings = np.array(latencies) if latencies else np.array([np.nan])
+    frames = len(latencies) + len(pushed)
+
+    return {
+        "frames": frames,
+        "dropped": len(pushed),
+        "mean_ms": float(np.mean(timings)),
+        "p50_ms": float(np.percentile(timings, 50)),
+        "p90_ms": float(np.percentile(timings, 90)),
+        "p99_ms": float(np.percentile(timings, 99)),
+        "max_ms": float(np.max(timings)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--protocol", choices=["h264", "mjpeg", "raw"], default="mjpeg")
+    parser.add_argument("--device", help="v4l2loopback device to capture instead of videotestsrc")
+    parser.add_argument("--width", type=int, default=1280)
+    parser.add_argument("--height", type=int, default=720)
+    parser.add_argument("--framerate", type=int, default=30)
+    parser.add_argument("--capture-framerate", type=int, default=0,
+                        help="mjpeg capture rate, frames are dropped down to --framerate")
+    parser.add_argument("--decode-scale", type=int, choices=[1, 2, 4], default=1,
+                        help="mjpeg decoding at 1/2 or 1/4 of the capture size")
+    parser.add_argument("--bitrate", type=int, default=2048, help="encoder bitrate in kbit/s")
+    parser.add_argument("--warmup", type=float, default=2.0, help="seconds")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds")
+    parser.add_argument("--output", help="file to store the results in")
+    arguments = parser.parse_args()
+
+    results = {}
+    for profile in LatencyProfile:
+        results[profile.value] = measure(arguments, profile)
+        stats = results[profile.value]
+        print(f"{profile.value}: p50 {stats['p50_ms']:.1f} ms, p99 {stats['p99_ms']:.1f} ms,"
+              f" {stats['dropped']}/{stats['frames']} frames dropped")
+
+    if arguments.output is not None:
+        with open(arguments.output, "w") as handle:
+            json.dump({
+                "meta": {
+                    "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                    "python": platform.python_version(),
+                    "gstreamer": Gst.version_string(),
+                    "machine": platform.machine(),
+                    "protocol": arguments.protocol,
+                    "graph": get_graph_name(arguments),
+                    "device": arguments.device,
+                    "mode": f"{arguments.width}x{arguments.height}@{arguments.framerate}",
+                },
+                "results": results,
+            }, handle, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,243 @@
+"""
+Benchmarks the stages of color_ir_camera.PipelineBuilder and common full
+chains on synthetic or recorded 16-bit thermal frames.
+
+Run from the repository root:
+
+    python benchmarks/color_ir_pipeline.py --output results.json
+    python benchmarks/color_ir_pipeline.py --compare results.json
+
+Results are stored as JSON, a later run can be compared against them and
+exits with a non-zero code when any p50 latency regressed by more than the
+threshold.
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+from typing import Callable, Dict, List, Tuple
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from color_ir_camera import PipelineBuilder  # noqa: E402
+
+
+RESOLUTIONS = [(160, 120), (256, 192), (384, 288), (640, 512)]
+
+# Name -> (input kind, builder setup)
+STAGES: Dict[str, Tuple[str, Callable[[PipelineBuilder], PipelineBuilder]]] = {
+    "temporal_denoise": ("raw", lambda builder: builder.add_temporal_denoise(0.25, 200)),
+    "normalization": ("raw", lambda builder: builder.add_normalization(0, 255, cv2.NORM_MINMAX)),
+    "clahe": ("gray", lambda builder: builder.add_clahe(2.0, (16, 16))),
+    "clahe_8x8": ("gray", lambda builder: builder.add_clahe(2.0, (8, 8))),
+    "histogram_equalization": ("gray", lambda builder: builder.add_histogram_equalization()),
+    "gaussian_blur": ("gray", lambda builder: builder.add_gaussian_blur((3, 3))),
+    "median_blur": ("gray", lambda builder: builder.add_median_blur(3)),
+    "bilateral_blur": ("gray", lambda builder: builder.add_bilateral_blur(3, 30, 30)),
+    "color_map": ("gray", lambda builder: builder.add_color_map(cv2.COLORMAP_INFERNO)),
+    "mark_min_max": ("raw", lambda builder: builder.add_mark_min_temperature().add_mark_max_temperature((0, 0, 0))),
+}
+
+CHAINS: Dict[str, Callable[[PipelineBuilder], PipelineBuilder]] = {
+    "default": lambda builder: builder
+        .add_normalization(0, 255, cv2.NORM_MINMAX)
+        .add_clahe(2.0, (16, 16))
+        .add_bilateral_blur(3, 30, 30)
+        .add_color_map(cv2.COLORMAP_INFERNO)
+        .add_mark_min_temperature()
+        .add_mark_max_temperature((0, 0, 0)),
+    "temporal": lambda builder: builder
+        .add_temporal_denoise(0.25, 200)
+        .add_normalization(0, 255, cv2.NORM_MINMAX)
+        .add_clahe(2.0, (16, 16))
+        .add_color_map(cv2.COLORMAP_INFERNO)
+        .add_mark_min_temperature()
+        .add_mark_max_temperature((0, 0, 0)),
+    "median": lambda builder: builder
+        .add_normalization(0, 255, cv2.NORM_MINMAX)
+        .add_clahe(2.0, (16, 16))
+        .add_median_blur(3)
+        .add_color_map(cv2.COLORMAP_INFERNO),
+    "equalization": lambda builder: builder
+        .add_normalization(0, 255, cv2.NORM_MINMAX)
+        .add_histogram_equalization()
+        .add_gaussian_blur((3, 3))
+        .add_color_map(cv2.COLORMAP_INFERNO),
+}
+
+
+def synthetic_frames(width: int, height: int, count: int) -> List[np.ndarray]:
+    """Room temperature background with noise and a moving hot spot"""
+    rng = np.random.default_rng(0)
+    y, x = np.mgrid[0:height, 0:width]
+    frames = []
+
+    for index in range(count):
+        center_x = width * (0.5 + 0.3 * np.sin(index / 10))
+        center_y = height * (0.5 + 0.3 * np.cos(index / 10))
+        spot = 1500 * np.exp(-((x - center_x) ** 2 + (y - center_y) ** 2) / (2 * (width / 10) ** 2))
+        noise = rng.normal(0, 20, (height, width))
+        frames.append((29315 + spot + noise).astype("<u2"))
+
+    return frames
+
+
+def recorded_frames(path: str) -> List[np.ndarray]:
+    """Frames recorded as a (count, height, width) array in a .npy file"""
+    recording = np.load(path)
+    if recording.ndim != 3:
+        raise ValueError("Recording should have (count, height, width) shape")
+
+    return [np.ascontiguousarray(frame, dtype="<u2") for frame in recording]
+
+
+def prepare_inputs(frames: List[np.ndarray], kind: str) -> List[np.ndarray]:
+    if kind == "raw":
+        return frames
+
+    return [
+        cv2.normalize(frame, None, 0, 255, cv2.NORM_MINMAX, dtype=cv2.CV_8U)
+        for frame in frames
+    ]
+
+
+def measure(pipeline, inputs: List[np.ndarray], warmup: int) -> dict:
+    for frame in inputs[:warmup]:
+        pipeline.apply(frame.copy())
+
+    # Inputs are copied up front, markers are drawn into the frame in place
+    copies = [frame.copy() for frame in inputs]
+    timings = np.empty(len(copies))
+
+    for index, frame in enumerate(copies):
+        started = time.perf_counter_ns()
+        pipeline.apply(frame)
+        timings[index] = (time.perf_counter_ns() - started) / 1000
+
+    copies = [frame.copy() for frame in inputs]
+    allocated = 0
+
+    tracemalloc.start()
+    for frame in copies:
+        tracemalloc.reset_peak()
+        before, _ = tracemalloc.get_traced_memory()
+        pipeline.apply(frame)
+        _, peak = tracemalloc.get_traced_memory()
+        allocated += peak - before
+    tracemalloc.stop()
+
+    return {
+        "frames": len(timings),
+        "mean_us": float(np.mean(timings)),
+        "p50_us": float(np.percentile(timings, 50)),
+        "p90_us": float(np.percentile(timings, 90)),
+        "p99_us": float(np.percentile(timings, 99)),
+        "max_us": float(np.max(timings)),
+        "allocated_bytes_per_frame": allocated / len(copies),
+    }
+
+
+def run(resolutions, frames_count: int, warmup: int, recording: str = None) -> dict:
+    results = {}
+
+    if recording is not None:
+        frames = recorded_frames(recording)
+        resolutions = [(frames[0].shape[1], frames[0].shape[0])]
+
+    for width, height in resolutions:
+        if recording is None:
+            frames = synthetic_frames(width, height, frames_count)
+
+        key = f"{width}x{height}"
+        results[key] = {"stages": {}, "chains": {}}
+
+        for name, (kind, setup) in STAGES.items():
+            pipeline = setup(PipelineBuilder(width, height)).build()
+            results[key]["stages"][name] = measure(
+                pipeline, prepare_inputs(frames, kind), warmup)
+            print(f"{key} stage {name}: {results[key]['stages'][name]['p50_us']:.1f} us")
+
+        for name, setup in CHAINS.items():
+            pipeline = setup(PipelineBuilder(width, height)).build()
+            results[key]["chains"][name] = measure(pipeline, frames, warmup)
+            print(f"{key} chain {name}: {results[key]['chains'][name]['p50_us']:.1f} us")
+
+    return {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "opencv": cv2.__version__,
+            "machine": platform.machine(),
+            "processor": platform.processor(),
+            "recording": recording,
+        },
+        "results": results,
+    }
+
+
+def compare(baseline: dict, current: dict, threshold: float) -> List[str]:
+    regressions = []
+
+    for resolution, groups in current["results"].items():
+        for group, entries in groups.items():
+            for name, stats in entries.items():
+                reference = baseline["results"].get(resolution, {}).get(group, {}).get(name)
+                if reference is None:
+                    continue
+
+                ratio = stats["p50_us"] / reference["p50_us"]
+                line = f"{resolution} {group} {name}: p50 {reference['p50_us']:.1f} -> {stats['p50_us']:.1f} us ({(ratio - 1) * 100:+.1f}%)"
+                print(line)
+
+                if ratio > 1 + threshold:
+                    regressions.append(line)
+
+    return regressions
+
+
+def parse_resolution(value: str) -> Tuple[int, int]:
+    width, height = value.lower().split("x")
+    return int(width), int(height)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--resolution", type=parse_resolution, action="append",
+                        help="sensor resolution as WIDTHxHEIGHT, can be repeated")
+    parser.add_argument("--frames", type=int, default=300)
+    parser.add_argument("--warmup", type=int, default=30)
+    parser.add_argument("--recording", help=".npy file with recorded 16-bit frames")
+    parser.add_argument("--output", help="file to store the results in")
+    parser.add_argument("--compare", help="results file to compare against")
+    parser.add_argument("--threshold", type=float, default=0.1,
+                        help="relative p50 regression considered a failure")
+    arguments = parser.parse_args()
+
+    current = run(arguments.resolution or RESOLUTIONS, arguments.frames,
+                  arguments.warmup, arguments.recording)
+
+    if arguments.output is not None:
+        with open(arguments.output, "w") as handle:
+            json.dump(current, handle, indent=2)
+
+    if arguments.compare is not None:
+        with open(arguments.compare, "r") as handle:
+            baseline = json.load(handle)
+
+        regressions = compare(baseline, current, arguments.threshold)
+        if regressions:
+            print(f"{len(regressions)} regressions above {arguments.threshold * 100:.0f}%:")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
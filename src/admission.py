@@ -0,0 +1,249 @@
+import json
+import math
+import os
+import threading
+import time
+from logging import Logger
+from typing import Callable, Dict, Optional, Tuple
+
+import psutil
+
+from config import AdmissionConfig, AdmissionPolicy, CameraAdmissionConfig
+
+
+ADMITTED = "admitted"
+DEGRADED = "degraded"
+REJECTED = "rejected"
+
+
+def decide_admission(limits: Optional[tuple], consumers: int, degraded: int) -> str:
+    """
+    Decides on a new consumer of a camera with the given consumers, of
+    which `degraded` are degraded, under the limits of AdmissionController
+    """
+    if limits is None:
+        return ADMITTED
+
+    max_full, max_total, _ = limits
+
+    if max_total is not None and consumers >= max_total:
+        return REJECTED
+
+    if max_full is not None and consumers - degraded >= max_full:
+        return DEGRADED
+
+    return ADMITTED
+
+
+def count_fitting(remaining: float, cost: float) -> Optional[int]:
+    """Consumers of the given cost fitting in the budget, None if unlimited"""
+    if math.isinf(remaining) or cost <= 0:
+        return None
+    return max(0, int(remaining // cost))
+
+
+def min_limit(first: Optional[int], second: Optional[int]) -> Optional[int]:
+    if first is None:
+        return second
+    if second is None:
+        return first
+    return min(first, second)
+
+
+class AdmissionController:
+    """
+    Keeps the encoding load within budget. webrtcsink encodes once per
+    consumer, so every consumer of a camera costs its pixel rate.
+
+    Cameras decide on new consumers themselves, with limits pushed from
+    here after every change, so that a decision never waits for another
+    process. Consumers beyond the full quality limit are degraded to a
+    fraction of the frames, or rejected, depending on the policy.
+    """
+
+    def __init__(self, config: AdmissionConfig, logger: Logger):
+        self.config = config
+        self.logger = logger
+
+        # camera -> (full quality, degraded, rejected) consumers
+        self.consumers: Dict[object, Tuple[int, int, int]] = {}
+        self.limits: Dict[object, tuple] = {}
+        self.cpu = 0.0
+        self.camera_cpu: Dict[str, float] = {}
+        self.lock = threading.Lock()
+
+        # Per process camera stats, only available with the supervisor
+        self.get_stats: Optional[Callable[[], Dict[str, dict]]] = None
+        # Udev event to stream live latency per camera ID_PATH
+        self.get_event_latency: Optional[Callable[[], Dict[str, dict]]] = None
+
+    def start(self):
+        thread = threading.Thread(target=self.run, name="admission",
+                                  daemon=True)
+        thread.start()
+
+    def run(self):
+        last_report = time.monotonic()
+        psutil.cpu_percent(interval=None)
+
+        while True:
+            time.sleep(self.config.update_interval)
+
+            self.cpu = psutil.cpu_percent(interval=None)
+            if self.get_stats is not None:
+                self.camera_cpu = {
+                    name: stats.get("cpu", 0.0)
+                    for name, stats in self.get_stats().items()
+                }
+
+            self.update()
+
+            if time.monotonic() - last_report >= self.config.report_interval:
+                last_report = time.monotonic()
+                self.report()
+
+    def get_cost(self, camera) -> float:
+        """Encoded megapixels per second of a full quality consumer"""
+        if getattr(camera, "passthrough", False):
+            return 0.0
+        return camera.width * camera.height * camera.framerate / 1e6
+
+    def get_load(self, camera, full: int, degraded: int) -> float:
+        return self.get_cost(camera) * (full + degraded / self.config.degrade_divisor)
+
+    def register(self, camera):
+        camera.on_consumers_changed = self.on_consumers_changed
+
+        with self.lock:
+            self.consumers[camera] = (0, 0, 0)
+
+        self.update()
+
+    def unregister(self, camera):
+        camera.on_consumers_changed = None
+
+        with self.lock:
+            self.consumers.pop(camera, None)
+            self.limits.pop(camera, None)
+
+        self.update()
+
+    def on_consumers_changed(self, camera, full: int, degraded: int,
+                             rejected: int):
+        with self.lock:
+            if camera not in self.consumers:
+                return
+            self.consumers[camera] = (full, degraded, rejected)
+
+        self.update()
+
+    def get_limits(self, camera, full: int, degraded: int,
+                   remaining: float) -> tuple:
+        camera_config = self.config.cameras.get(camera.name,
+                                                CameraAdmissionConfig())
+        max_consumers = camera_config.max_consumers
+        if max_consumers is None:
+            max_consumers = self.config.max_consumers
+
+        overloaded = (
+            self.config.max_cpu is not None and self.cpu > self.config.max_cpu
+        ) or (
+            camera_config.max_cpu is not None
+            and self.camera_cpu.get(camera.name, 0.0) > camera_config.max_cpu
+        )
+
+        cost = self.get_cost(camera)
+        extra_full = 0 if overloaded else count_fitting(remaining, cost)
+        if self.config.policy == AdmissionPolicy.Degrade:
+            extra = count_fitting(remaining,
+                                  cost / self.config.degrade_divisor)
+        else:
+            extra = extra_full
+
+        max_total = None if extra is None else full + degraded + extra
+        max_total = min_limit(max_total, max_consumers)
+        max_full = None if extra_full is None else full + extra_full
+        max_full = min_limit(max_full, max_total)
+
+        return max_full, max_total, self.config.degrade_divisor
+
+    def update(self):
+        with self.lock:
+            load = sum(self.get_load(camera, full, degraded)
+                       for camera, (full, degraded, _) in self.consumers.items())
+
+            remaining = math.inf
+            if self.config.max_encode_rate is not None:
+                remaining = self.config.max_encode_rate - load
+
+            changed = []
+            for camera, (full, degraded, _) in self.consumers.items():
+                limits = self.get_limits(camera, full, degraded, remaining)
+                if self.limits.get(camera) != limits:
+                    self.limits[camera] = limits
+                    changed.append((camera, limits))
+
+        for camera, limits in changed:
+            camera.set_admission_limits(*limits)
+
+    def get_utilization(self) -> dict:
+        with self.lock:
+            consumers = dict(self.consumers)
+            limits = dict(self.limits)
+
+        cameras = {}
+        for camera, (full, degraded, rejected) in consumers.items():
+            max_full, max_total, _ = limits.get(camera, (None, None, None))
+            cameras[camera.name] = {
+                "full": full,
+                "degraded": degraded,
+                "rejected": rejected,
+                "max_full": max_full,
+                "max_consumers": max_total,
+                "encode_rate": self.get_load(camera, full, degraded),
+                "cpu": self.camera_cpu.get(camera.name),
+            }
+
+        load = sum(camera["encode_rate"] for camera in cameras.values())
+        utilization = None
+        if self.config.max_encode_rate:
+            utilization = load / self.config.max_encode_rate
+
+        return {
+            "timestamp": time.time(),
+            "encode_rate": load,
+            "max_encode_rate": self.config.max_encode_rate,
+            "utilization": utilization,
+            "cpu": self.cpu,
+            "max_cpu": self.config.max_cpu,
+            "cameras": cameras,
+            "event_latency": self.get_event_latency()
+            if self.get_event_latency is not None else None,
+        }
+
+    def report(self):
+        utilization = self.get_utilization()
+
+        summary = f"Encoding {utilization['encode_rate']:.1f}"
+        if utilization["max_encode_rate"] is not None:
+            summary += f"/{utilization['max_encode_rate']:.1f}"
+        summary += f" MP/s, cpu {utilization['cpu']:.0f}%"
+        self.logger.info(summary)
+
+        for name, camera in utilization["cameras"].items():
+            self.logger.info(
+                f"[{name}]: {camera['full']} full, {camera['degraded']}"
+                f" degraded, {camera['rejected']} rejected consumers,"
+                f" {camera['encode_rate']:.1f} MP/s")
+
+        if self.config.status_path is None:
+            return
+
+        # Replaced atomically, monitoring never reads a partial file
+        temporary = f"{self.config.status_path}.tmp"
+        try:
+            with open(temporary, "w") as handle:
+                json.dump(utilization, handle)
+            os.replace(temporary, self.config.status_path)
+        except OSError as e:
+            self.logger.warning(f"Cannot write admission status: {e}")
@@ -0,0 +1,157 @@
+import re
+from typing import Dict, List, Optional, Tuple
+
+
+Mode = Tuple[int, int, int]
+
+# Estimated bytes per pixel transferred over USB, per capture protocol.
+# Compressed formats are estimated conservatively, as many UVC cameras
+# reserve isochronous bandwidth for their worst case frame size.
+BYTES_PER_PIXEL = {
+    "raw": 2.0,
+    "mjpeg": 0.5,
+    "h264": 0.15,
+}
+DEFAULT_BYTES_PER_PIXEL = 2.0
+
+MEGABYTE = 1000 * 1000
+
+# udev names the bus usb, usbv2 or usbv3 depending on its version
+USB_BUS = re.compile(r"-usb(v\d+)?-")
+
+
+def get_controller(id_path: Optional[str]) -> Optional[str]:
+    """
+    Returns the USB host controller part of the udev ID_PATH, for example
+    'pci-0000:04:00.4' for 'pci-0000:04:00.4-usb-0:1.3:1.0' or
+    'pci-0000:04:00.4-usbv3-0:1.3:1.0'. Returns None for devices not
+    attached over USB.
+    """
+    if id_path is None:
+        return None
+
+    match = USB_BUS.search(id_path)
+    if match is None:
+        return None
+
+    return id_path[:match.start()]
+
+
+def estimate_bandwidth(protocol: str, mode: Mode) -> float:
+    """Estimated isochronous bandwidth in MB/s"""
+    width, height, framerate = mode
+    bytes_per_pixel = BYTES_PER_PIXEL.get(protocol, DEFAULT_BYTES_PER_PIXEL)
+
+    return width * height * framerate * bytes_per_pixel / MEGABYTE
+
+
+class BandwidthRequest:
+    def __init__(self, id_path: str, protocol: str, modes: List[Mode],
+                 priority: int = 0, bandwidth: Optional[float] = None,
+                 capture_framerate: Optional[int] = None):
+        """
+        :param modes: capture modes in order of preference, the first one
+            is the configured mode and the following ones are degradations
+        :param bandwidth: measured bandwidth of the preferred mode in MB/s,
+            overrides the estimate and scales the degraded modes
+        :param capture_framerate: rate the camera is opened at when frames
+            are dropped down to the framerate of the mode after capture
+        """
+        self.id_path = id_path
+        self.protocol = protocol
+        self.modes = modes
+        self.priority = priority
+        self.bandwidth = bandwidth
+        self.capture_framerate = capture_framerate
+
+    def get_capture_mode(self, index: int) -> Mode:
+        width, height, framerate = self.modes[index]
+        if self.capture_framerate is not None:
+            framerate = max(framerate, self.capture_framerate)
+        return width, height, framerate
+
+    def get_bandwidth(self, index: int) -> float:
+        estimate = estimate_bandwidth(self.protocol, self.get_capture_mode(index))
+
+        if self.bandwidth is None:
+            return estimate
+
+        preferred = estimate_bandwidth(self.protocol, self.get_capture_mode(0))
+        return self.bandwidth * estimate / preferred
+
+
+def plan_bandwidth(requests: List[BandwidthRequest],
+                   budget: Optional[float]) -> Dict[str, Optional[Mode]]:
+    """
+    Assigns a capture mode to every camera sharing one host controller, so
+    that the total bandwidth stays within the budget. Cameras with the lowest
+    priority are degraded first, and rejected (None) only when they cannot be
+    degraded any further. Rejected cameras are then admitted again in
+    priority order, at their cheapest mode, where it fits into what is left
+    of the budget. Without a budget every camera gets its preferred mode.
+    """
+    if budget is None:
+        return {request.id_path: request.modes[0] for request in requests}
+
+    selected: Dict[str, Optional[int]] = {
+        request.id_path: 0 for request in requests
+    }
+
+    def total():
+        return sum(
+            request.get_bandwidth(selected[request.id_path])
+            for request in requests
+            if selected[request.id_path] is not None
+        )
+
+    while total() > budget:
+        admitted = [
+            request for request in requests
+            if selected[request.id_path] is not None
+        ]
+        if not admitted:
+            break
+
+        lowest_priority = min(request.priority for request in admitted)
+        candidates = [
+            request for request in admitted
+            if request.priority == lowest_priority
+        ]
+
+        degradable = [
+            request for request in candidates
+            if selected[request.id_path] < len(request.modes) - 1
+        ]
+        if degradable:
+            victim = max(
+                degradable,
+                key=lambda request: request.get_bandwidth(
+                    selected[request.id_path])
+            )
+            selected[victim.id_path] += 1
+        else:
+            victim = max(
+                candidates,
+                key=lambda request: request.get_bandwidth(
+                    selected[request.id_path])
+            )
+            selected[victim.id_path] = None
+
+    # Rejecting a higher priority camera may have freed enough for ones
+    # rejected before it
+    rejected = [
+        request for request in requests
+        if selected[request.id_path] is None
+    ]
+    for request in sorted(rejected, key=lambda request: -request.priority):
+        cheapest = len(request.modes) - 1
+        if total() + request.get_bandwidth(cheapest) <= budget:
+            selected[request.id_path] = cheapest
+
+    return {
+        request.id_path: (
+            request.modes[selected[request.id_path]]
+            if selected[request.id_path] is not None else None
+        )
+        for request in requests
+    }
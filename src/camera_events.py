@@ -0,0 +1,143 @@
+import queue
+import statistics
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, Optional
+
+
+EventHandler = Callable[[str, object, float], None]
+
+# Re-plan of a camera after another one on its controller changed, never
+# replaces an add or remove
+RECONFIGURE = "reconfigure"
+
+
+class CameraEvent:
+    def __init__(self, action: str, device, timestamp: float):
+        self.action = action
+        self.device = device
+        self.timestamp = timestamp
+
+
+class LatencyMetrics:
+    """Event-to-stream-live latency samples, kept per camera"""
+
+    def __init__(self, history: int = 100):
+        self._history = history
+        self._samples: Dict[str, deque] = {}
+        # Every sample ever recorded, the history only keeps the last ones
+        self._totals: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def record(self, id_path: str, latency: float):
+        with self._lock:
+            if id_path not in self._samples:
+                self._samples[id_path] = deque(maxlen=self._history)
+            self._samples[id_path].append(latency)
+            self._totals[id_path] = self._totals.get(id_path, 0) + 1
+
+    def summary(self) -> Dict[str, dict]:
+        with self._lock:
+            samples = {key: list(value) for key, value in self._samples.items()}
+            totals = dict(self._totals)
+
+        result = {}
+        for id_path, values in samples.items():
+            ordered = sorted(values)
+            result[id_path] = {
+                "count": len(ordered),
+                "total": totals[id_path],
+                "last": values[-1],
+                "median": statistics.median(ordered),
+                "p95": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+                "max": ordered[-1],
+            }
+
+        return result
+
+
+class CameraWorker(threading.Thread):
+    """
+    Serializes udev events of a single camera. Events arriving within the
+    debounce window of each other are coalesced and only the last add or
+    remove is handled, with the timestamp of the first one in the burst.
+    A reconfigure in the burst is handled after it.
+    """
+
+    def __init__(self, id_path: str, debounce: float, handler: EventHandler,
+                 logger):
+        super().__init__(name=f"camera-worker-{id_path}", daemon=True)
+        self._id_path = id_path
+        self._debounce = debounce
+        self._handler = handler
+        self._logger = logger
+        self._events = queue.Queue()
+
+    def push(self, event: CameraEvent):
+        self._events.put(event)
+
+    def run(self):
+        while True:
+            event = self._events.get()
+            first_timestamp = event.timestamp
+            coalesced = 0
+            last = None
+            reconfigure = None
+
+            while True:
+                if event.action == RECONFIGURE:
+                    reconfigure = event
+                else:
+                    last = event
+
+                try:
+                    event = self._events.get(timeout=self._debounce)
+                    coalesced += 1
+                except queue.Empty:
+                    break
+
+            if coalesced > 0:
+                actions = [e.action for e in (last, reconfigure) if e is not None]
+                self._logger.debug(
+                    f"[{self._id_path}]: coalesced {coalesced + 1} events into '{', '.join(actions)}'")
+
+            if last is not None:
+                self.handle(last, first_timestamp)
+            if reconfigure is not None:
+                self.handle(reconfigure, reconfigure.timestamp)
+
+    def handle(self, event: CameraEvent, timestamp: float):
+        try:
+            self._handler(event.action, event.device, timestamp)
+        except Exception as e:
+            self._logger.exception(
+                f"[{self._id_path}]: failed to handle '{event.action}' event: {e}")
+
+
+class CameraEventQueue:
+    """
+    Routes udev events to per-camera workers, so that the observer thread
+    never blocks and unrelated cameras never wait on each other
+    """
+
+    def __init__(self, debounce: float, handler: EventHandler, logger):
+        self._debounce = debounce
+        self._handler = handler
+        self._logger = logger
+        self._workers: Dict[Optional[str], CameraWorker] = {}
+        self._lock = threading.Lock()
+
+    def push(self, action: str, device):
+        id_path = device.get("ID_PATH")
+        event = CameraEvent(action, device, time.monotonic())
+
+        with self._lock:
+            worker = self._workers.get(id_path)
+            if worker is None:
+                worker = CameraWorker(id_path, self._debounce, self._handler,
+                                      self._logger)
+                self._workers[id_path] = worker
+                worker.start()
+
+        worker.push(event)
@@ -1,24 +1,68 @@
+import itertools
+import statistics
 import threading
-from typing import Optional
+import time
+from collections import deque
+from typing import Dict, Optional
 
 import gi
+import numpy as np
 import pyudev
 import yaml
 
-from config import PipelinesConfig, SignallerConfig, CameraMode
+from admission import DEGRADED, REJECTED, decide_admission
+from bandwidth import BandwidthRequest, get_controller, plan_bandwidth
+from camera_events import CameraEventQueue, LatencyMetrics, RECONFIGURE
+from config import PipelinesConfig, SignallerConfig, CameraMode, \
+    Camera as CameraConfig, FusionConfig, LatencyProfile, get_capture_modes
+from fusion import Fusion, ThermalReceiver
+from latency import configure_encoder, configure_sink, force_keyframe
+from pipeline_graph import DEFAULT_GRAPHS, compile_graph
+from supervisor import Supervisor
+from tone_mapping import ToneMapper, get_colormap
 from utils import create_logger
 
 gi.require_version("Gst", "1.0")
-from gi.repository import Gst
+gi.require_version("GstWebRTC", "1.0")
+gi.require_version("GLib", "2.0")
+from gi.repository import GLib, Gst, GstWebRTC
 
 Gst.init(None)
 
+VERBOSE_MESSAGES = (
+    Gst.MessageType.QOS,
+    Gst.MessageType.STATE_CHANGED,
+    Gst.MessageType.LATENCY,
+    Gst.MessageType.STREAM_STATUS,
+    Gst.MessageType.ASYNC_DONE,
+    Gst.MessageType.NEW_CLOCK,
+    Gst.MessageType.ELEMENT,
+    Gst.MessageType.TAG,
+)
+
+# Time-to-first-frame samples needed before their median is checked
+TTFF_MIN_SAMPLES = 5
+
 
 # region Camera
 
+class ConsumerSession:
+    """Time-to-first-frame tracking of a WebRTC consumer"""
+
+    def __init__(self, consumer_id):
+        self.id = consumer_id
+        self.added_at = time.monotonic()
+        self.connected = False
+        self.encoder = None
+        self.watching = False
+
+
 class Camera:
     def __init__(self, logger, config_signaller, turn_settings, path, id, name,
-                 width, height, framerate):
+                 width, height, framerate, on_demand=False, grace_period=5.0,
+                 first_frame_target=1.0, shm_taps=(),
+                 latency_profile=LatencyProfile.Default, ttff_target=0.5,
+                 graph=None, tap_consumers=()):
         self.logger = logger
         self.config_signaller = config_signaller
         self.turn_settings = turn_settings
@@ -31,9 +75,54 @@ class Camera:
         self.height = height
         self.framerate = framerate
 
+        self.on_demand = on_demand
+        self.grace_period = grace_period
+        self.first_frame_target = first_frame_target
+        self.first_frame_latencies = deque(maxlen=100)
+        self.latency_profile = latency_profile
+
+        self.ttff_target = ttff_target
+        self.ttff_latencies = deque(maxlen=100)
+        self.sessions: Dict[str, ConsumerSession] = {}
+        # Pad upstream of the sink to request keyframes from, when
+        # webrtcsink does not encode itself
+        self.keyframe_pad = None
+
+        # (socket path, width, height, framerate) of BGR copies of the
+        # stream shared with other processes, one per fusion camera
+        self.shm_taps = list(shm_taps)
+        # Fusion cameras with consumers, on-demand capture runs for them
+        # as for consumers of this camera
+        self.tap_consumers = set(tap_consumers)
+
         self.log(f"Camera created")
 
+        # Replaces the default graph of the class, see pipeline_graph
+        self.graph = graph
+        # Elements created from the graph by name
+        self.elements = {}
+        self.graph_sink = []
+
         self.pipeline = None
+        self.sink = None
+        # Chains not linked to the source, e.g. ending in an appsink, added
+        # to the same pipeline as the source
+        self.source_branches = []
+        self.capture_pipeline = None
+        self.capture_lock = threading.Lock()
+        self.capture_running = False
+        self.capture_started_at = None
+        self.consumers = set()
+        self.grace_timer = None
+
+        # (max full quality consumers, max consumers, frame divisor of
+        # degraded consumers) set by the admission controller, None values
+        # are unlimited
+        self.admission_limits = None
+        self.degraded_consumers = set()
+        self.rejected_consumers = 0
+        self.on_consumers_changed = None
+
         self.create_pipeline()
         self.start_pipeline()
 
@@ -46,9 +135,191 @@ class Camera:
     def error(self, message):
         self.logger.error(f"[{self.path}]: {message}")
 
-    def create_pipeline(self):
+    def get_graph_name(self):
+        """Name of the default graph in pipeline_graph.DEFAULT_GRAPHS"""
         raise NotImplementedError()
 
+    def get_graph_parameters(self):
+        return {
+            "device": self.path,
+            "width": self.width,
+            "height": self.height,
+            "framerate": self.framerate,
+        }
+
+    def get_element(self, name):
+        element = self.elements.get(name)
+        if element is None:
+            raise ValueError(f"Pipeline graph has no element {name}")
+        return element
+
+    def create_source(self):
+        """Returns the chain of elements producing raw frames for the sink"""
+        graph = self.graph if self.graph is not None \
+            else DEFAULT_GRAPHS[self.get_graph_name()]
+        plan = compile_graph(graph, self.get_graph_parameters(),
+                             self.latency_profile)
+
+        instance = plan.instantiate()
+        self.elements = instance.elements
+        self.source_branches.extend(instance.branches)
+        self.graph_sink = instance.sink
+
+        return instance.chain
+
+    def create_pipeline(self):
+        self.pipeline = self.new_pipeline("pipeline", self.on_message)
+        sink = self.create_webrtc_sink()
+        source = self.create_source()
+        self.sink = sink
+
+        tee = None
+        if self.shm_taps:
+            tee = Gst.ElementFactory.make("tee", "tap-tee")
+            source = source + [tee]
+
+        if not self.on_demand:
+            self.add_chain(self.pipeline, source + [sink])
+            self.add_branches(self.pipeline)
+            if tee is not None:
+                self.add_taps(self.pipeline, tee)
+            return
+
+        # Capture runs in its own pipeline, so it can be stopped while the
+        # sink stays registered with the signaller as a producer
+        channel = f"camera-{self.name}"
+        caps = f"video/x-raw, format=I420, width={self.width}, height={self.height}, framerate={self.framerate}/1"
+
+        self.capture_pipeline = self.new_pipeline("capture",
+                                                  self.on_capture_message)
+        convert = Gst.ElementFactory.make("videoconvert", "capture-convert")
+        capture_caps = Gst.ElementFactory.make("capsfilter", "capture-caps")
+        capture_caps.set_property("caps", Gst.Caps.from_string(caps))
+        intersink = Gst.ElementFactory.make("intervideosink", "capture-sink")
+        intersink.set_property("channel", channel)
+        configure_sink(intersink, self.latency_profile)
+        self.add_chain(self.capture_pipeline,
+                       source + [convert, capture_caps, intersink])
+        self.add_branches(self.capture_pipeline)
+        if tee is not None:
+            self.add_taps(self.capture_pipeline, tee)
+
+        intersink.get_static_pad("sink").add_probe(
+            Gst.PadProbeType.BUFFER, self.on_capture_buffer)
+
+        intersrc = Gst.ElementFactory.make("intervideosrc", "capture-source")
+        intersrc.set_property("channel", channel)
+        capsfilter = Gst.ElementFactory.make("capsfilter", "sink-caps")
+        capsfilter.set_property("caps", Gst.Caps.from_string(caps))
+        self.add_chain(self.pipeline, [intersrc, capsfilter, sink])
+
+    def add_taps(self, pipeline, tee):
+        for index, tap in enumerate(self.shm_taps):
+            self.add_tap(pipeline, tee, index, *tap)
+
+    def add_tap(self, pipeline, tee, index, socket_path, width, height,
+                framerate):
+        queue = Gst.ElementFactory.make("queue", f"tap-queue-{index}")
+        queue.set_property("leaky", 2)
+        queue.set_property("max-size-buffers", 1)
+        rate = Gst.ElementFactory.make("videorate", f"tap-rate-{index}")
+        rate.set_property("drop-only", True)
+        scale = Gst.ElementFactory.make("videoscale", f"tap-scale-{index}")
+        convert = Gst.ElementFactory.make("videoconvert", f"tap-convert-{index}")
+        capsfilter = Gst.ElementFactory.make("capsfilter", f"tap-caps-{index}")
+        capsfilter.set_property(
+            "caps",
+            Gst.Caps.from_string(
+                f"video/x-raw, format=BGR, width={width}, height={height}, framerate={framerate}/1"
+            ),
+        )
+        sink = Gst.ElementFactory.make("shmsink", f"tap-sink-{index}")
+        sink.set_property("socket-path", socket_path)
+        sink.set_property("shm-size", width * height * 3 * 4)
+        sink.set_property("wait-for-connection", False)
+        sink.set_property("sync", False)
+
+        self.add_chain(pipeline, [queue, rate, scale, convert, capsfilter, sink])
+        tee.link(queue)
+
+    def add_branches(self, pipeline):
+        for branch in self.source_branches:
+            self.add_chain(pipeline, branch)
+
+    def new_pipeline(self, name, on_message):
+        pipeline = Gst.Pipeline.new(name)
+        bus = pipeline.get_bus()
+        bus.add_signal_watch()
+        bus.connect("message", on_message)
+        return pipeline
+
+    def add_chain(self, pipeline, elements):
+        for element in elements:
+            pipeline.add(element)
+
+        for upstream, downstream in zip(elements, elements[1:]):
+            upstream.link(downstream)
+
+    def create_webrtc_sink(self):
+        sink = Gst.ElementFactory.make("webrtcsink", "webrtc")
+
+        sink_config = Gst.Structure.new_empty("meta")
+        sink_config.set_value("name", self.name)
+        sink.set_property("meta", sink_config)
+
+        if self.turn_settings is not None:
+            self.debug(f"Adding TURN-SERVERS to camera {self.turn_settings}")
+            sink.set_property("turn-servers",
+                              Gst.ValueArray(tuple(self.turn_settings)))
+
+        host = self.config_signaller.host
+        if host == "0.0.0.0":
+            host = "localhost"
+
+        protocol = "wss" if self.config_signaller.secure == True else "ws"
+        uri = f"{protocol}://{host}:{self.config_signaller.port}"
+
+        sink.connect("consumer-added", self.on_consumer_added)
+        sink.connect("consumer-removed", self.on_consumer_removed)
+        sink.connect("encoder-setup", self.on_encoder_setup)
+
+        signaller = sink.get_property("signaller")
+        signaller.set_property("uri", uri)
+
+        if self.config_signaller.certificateCA is not None:
+            signaller.set_property("cafile",
+                                   self.config_signaller.certificateCA)
+
+        return sink
+
+    def on_encoder_setup(self, sink, consumer_id, pad_name, encoder):
+        if self.latency_profile == LatencyProfile.Low:
+            self.debug(f"Tuning encoder {encoder.get_name()} of consumer {consumer_id} for low latency")
+            configure_encoder(encoder, self.latency_profile)
+
+        limits = self.admission_limits
+        if limits is not None and consumer_id in self.degraded_consumers:
+            self.decimate(encoder, limits[2])
+
+        session = self.sessions.get(consumer_id)
+        if session is not None and pad_name.startswith("video"):
+            session.encoder = encoder
+            if session.connected:
+                self.on_session_connected(session)
+
+        # Let webrtcsink apply its own settings as well
+        return False
+
+    def update_turn_settings(self, turn_settings):
+        self.turn_settings = turn_settings
+
+        if self.sink is None or turn_settings is None:
+            return
+
+        self.debug(f"Updating TURN-SERVERS of camera {turn_settings}")
+        self.sink.set_property("turn-servers",
+                               Gst.ValueArray(tuple(turn_settings)))
+
     def start_pipeline(self):
         self.log("Stream started")
 
@@ -60,244 +331,459 @@ class Camera:
         self.debug("Set pipeline state to PLAYING")
         self.pipeline.get_state(Gst.CLOCK_TIME_NONE)
 
+        with self.capture_lock:
+            if self.tap_consumers:
+                self.start_capture()
+
     def stop_pipeline(self):
         self.log("Stream stopped")
 
         if self.pipeline is None:
-            self.info("Stream pipeline is Null")
+            self.log("Stream pipeline is Null")
             return
 
+        with self.capture_lock:
+            self.cancel_grace_timer()
+            self.stop_capture()
+            # Sessions end with the pipeline, without consumer-removed
+            self.consumers.clear()
+            self.degraded_consumers.clear()
+            self.sessions.clear()
+
         self.pipeline.set_state(Gst.State.NULL)
         self.debug("Set pipeline state to NULL")
         self.pipeline.get_state(Gst.CLOCK_TIME_NONE)
 
+        self.report_consumers()
+
     def restart_pipeline(self):
         self.log("Stream Restarted")
 
         self.stop_pipeline()
         self.start_pipeline()
 
-    def on_message(self, bus, message):
-        self.log(message)
+    # region Consumers
 
-        message_type = message.type
+    def set_admission_limits(self, max_full, max_total, divisor):
+        self.admission_limits = (max_full, max_total, divisor)
 
-        if message_type == Gst.MessageType.EOS:
-            self.log("Stream Ended")
-            self.restart_pipeline()
-        elif message_type == Gst.MessageType.ERROR:
-            self.player.set_state(Gst.State.NULL)
-            err, debug = message.parse_error()
-            self.log(f"Stream error {err}: {debug}")
-            self.restart_pipeline()
+    def admit_consumer(self, consumer_id):
+        """Decides on a new consumer, capture_lock must be held"""
+        admission = decide_admission(self.admission_limits,
+                                     len(self.consumers),
+                                     len(self.degraded_consumers))
 
-    def __del__(self):
-        self.stop_pipeline()
-        self.log(f"Camera Destroyed")
+        if admission == REJECTED:
+            self.rejected_consumers += 1
+        elif admission == DEGRADED:
+            self.degraded_consumers.add(consumer_id)
 
+        return admission
 
-class H264Camera(Camera):
-    def create_pipeline(self):
-        self.pipeline = Gst.Pipeline.new("pipeline")
-        bus = self.pipeline.get_bus()
-        bus.add_signal_watch()
-        bus.connect("message", self.on_message)
+    def reject_consumer(self, sink, consumer_id):
+        # Not from within the signal handler, webrtcsink is still setting
+        # the session up. The signaller emits session-ended itself once the
+        # session is torn down
+        def end_session():
+            sink.get_property("signaller").emit("end-session", consumer_id)
+            return False
 
-        source = Gst.ElementFactory.make("v4l2src", "camera-source")
-        capsfilter = Gst.ElementFactory.make("capsfilter", "filter")
-        h264parse = Gst.ElementFactory.make("h264parse", "parse")
-        avdec_h264 = Gst.ElementFactory.make("avdec_h264", "decode")
-        sink = Gst.ElementFactory.make("webrtcsink", "webrtc")
+        GLib.idle_add(end_session)
 
-        self.pipeline.add(source)
-        self.pipeline.add(capsfilter)
-        self.pipeline.add(h264parse)
-        self.pipeline.add(avdec_h264)
-        self.pipeline.add(sink)
+    def decimate(self, encoder, divisor):
+        """Encodes only every divisor-th frame for a degraded consumer"""
+        self.debug(f"Encoding 1/{divisor} of frames with {encoder.get_name()}")
+        frames = itertools.count()
 
-        source.set_property("device", self.path)
-        capsfilter.set_property(
-            "caps",
-            Gst.Caps.from_string(
-                f"video/x-h264, width=${self.width}, height=${self.height}, framerate=${self.framerate}/1"
-            ),
-        )
+        def on_buffer(pad, info):
+            if next(frames) % divisor == 0:
+                return Gst.PadProbeReturn.OK
+            return Gst.PadProbeReturn.DROP
 
-        sink_config = Gst.Structure.new_empty("meta")
-        sink_config.set_value("name", self.name)
-        sink.set_property("meta", sink_config)
+        encoder.get_static_pad("sink").add_probe(Gst.PadProbeType.BUFFER,
+                                                 on_buffer)
 
-        if self.turn_settings is not None:
-            self.debug(f"Adding TURN-SERVERS to camera {self.turn_settings}")
-            sink.set_property("turn-servers",
-                              Gst.ValueArray(tuple(self.turn_settings)))
+    def report_consumers(self):
+        if self.on_consumers_changed is None:
+            return
 
-        host = self.config_signaller.host
-        if host == "0.0.0.0":
-            host = "localhost"
+        with self.capture_lock:
+            degraded = len(self.degraded_consumers)
+            full = len(self.consumers) - degraded
+            rejected = self.rejected_consumers
+
+        self.on_consumers_changed(self, full, degraded, rejected)
+
+    def on_consumer_added(self, sink, consumer_id, webrtcbin):
+        with self.capture_lock:
+            admission = self.admit_consumer(consumer_id)
+            if admission != REJECTED:
+                self.consumers.add(consumer_id)
+                self.cancel_grace_timer()
+                self.start_capture()
+
+        if admission == REJECTED:
+            self.log(f"Consumer {consumer_id} rejected, limit of"
+                     f" {self.admission_limits[1]} consumers reached")
+            self.reject_consumer(sink, consumer_id)
+        else:
+            self.debug(f"Consumer {consumer_id} {admission}")
+            self.sessions[consumer_id] = ConsumerSession(consumer_id)
+            webrtcbin.connect("notify::connection-state",
+                              self.on_connection_state, consumer_id)
 
-        protocol = "wss" if self.config_signaller.secure == True else "ws"
-        uri = f"{protocol}://{host}:{self.config_signaller.port}"
+        self.report_consumers()
 
-        signaller = sink.get_property("signaller")
-        signaller.set_property("uri", uri)
+    def on_consumer_removed(self, sink, consumer_id, webrtcbin):
+        self.debug(f"Consumer {consumer_id} removed")
 
-        if self.config_signaller.certificateCA is not None:
-            signaller.set_property("cafile",
-                                   self.config_signaller.certificateCA)
+        self.sessions.pop(consumer_id, None)
 
-        source.link(capsfilter)
-        capsfilter.link(h264parse)
-        h264parse.link(avdec_h264)
-        avdec_h264.link(sink)
+        with self.capture_lock:
+            self.consumers.discard(consumer_id)
+            self.degraded_consumers.discard(consumer_id)
+            self.schedule_capture_stop()
 
+        self.report_consumers()
 
-class MJPEGCamera(Camera):
-    def create_pipeline(self):
-        self.pipeline = Gst.Pipeline.new("pipeline")
-        bus = self.pipeline.get_bus()
-        bus.add_signal_watch()
-        bus.connect("message", self.on_message)
+    def set_tap_consumer(self, name, active):
+        """A fusion camera reading a tap of this camera got or lost consumers"""
+        with self.capture_lock:
+            if active:
+                self.tap_consumers.add(name)
+                self.cancel_grace_timer()
+                self.start_capture()
+            else:
+                self.tap_consumers.discard(name)
+                self.schedule_capture_stop()
 
-        source = Gst.ElementFactory.make("v4l2src", "camera-source")
-        capsfilter = Gst.ElementFactory.make("capsfilter", "filter")
-        jpegdec = Gst.ElementFactory.make("jpegdec", "decode")
-        sink = Gst.ElementFactory.make("webrtcsink", "webrtc")
+    def has_consumers(self):
+        """Consumers or fusion cameras need capture, capture_lock must be held"""
+        return bool(self.consumers or self.tap_consumers)
 
-        self.pipeline.add(source)
-        self.pipeline.add(capsfilter)
-        self.pipeline.add(jpegdec)
-        self.pipeline.add(sink)
+    # endregion
 
-        source.set_property("device", self.path)
-        capsfilter.set_property(
-            "caps",
-            Gst.Caps.from_string(
-                f"image/jpeg, width=${self.width}, height=${self.height}, framerate=${self.framerate}/1"
-            ),
-        )
+    # region Time-to-first-frame
 
-        sink_config = Gst.Structure.new_empty("meta")
-        sink_config.set_value("name", self.name)
-        sink.set_property("meta", sink_config)
+    def on_connection_state(self, webrtcbin, pspec, consumer_id):
+        state = webrtcbin.get_property("connection-state")
+        session = self.sessions.get(consumer_id)
 
-        if self.turn_settings is not None:
-            self.debug(f"Adding TURN-SERVERS to camera {self.turn_settings}")
-            sink.set_property("turn-servers",
-                              Gst.ValueArray(tuple(self.turn_settings)))
+        if session is None or session.connected \
+                or state != GstWebRTC.WebRTCPeerConnectionState.CONNECTED:
+            return
 
-        host = self.config_signaller.host
-        if host == "0.0.0.0":
-            host = "localhost"
+        session.connected = True
+        self.on_session_connected(session)
 
-        protocol = "wss" if self.config_signaller.secure == True else "ws"
-        uri = f"{protocol}://{host}:{self.config_signaller.port}"
+    def on_session_connected(self, session):
+        """
+        Frames encoded before the connection was established never reach
+        the consumer, it would wait for the next keyframe otherwise
+        """
+        if session.encoder is not None:
+            pad = session.encoder.get_static_pad("src")
+        else:
+            pad = self.keyframe_pad
 
-        signaller = sink.get_property("signaller")
-        signaller.set_property("uri", uri)
+        if pad is None or session.watching:
+            return
 
-        if self.config_signaller.certificateCA is not None:
-            signaller.set_property("cafile",
-                                   self.config_signaller.certificateCA)
+        session.watching = True
+        pad.add_probe(Gst.PadProbeType.BUFFER, self.on_session_buffer,
+                      session)
 
-        source.link(capsfilter)
-        capsfilter.link(jpegdec)
-        jpegdec.link(sink)
+        if not force_keyframe(pad):
+            self.debug(f"Keyframe request for consumer {session.id} not handled")
 
+    def on_session_buffer(self, pad, info, session):
+        buffer = info.get_buffer()
+        if buffer.has_flags(Gst.BufferFlags.DELTA_UNIT):
+            return Gst.PadProbeReturn.OK
 
-class RawCamera(Camera):
-    def create_pipeline(self):
-        self.pipeline = Gst.Pipeline.new("pipeline")
-        bus = self.pipeline.get_bus()
-        bus.add_signal_watch()
-        bus.connect("message", self.on_message)
+        if self.sessions.get(session.id) is session:
+            self.record_ttff(session, time.monotonic() - session.added_at)
 
-        source = Gst.ElementFactory.make("v4l2src", "camera-source")
-        capsfilter = Gst.ElementFactory.make("capsfilter", "filter")
-        convert = Gst.ElementFactory.make("videoconvert", "convert")
-        queue = Gst.ElementFactory.make("queue", "queue")
-        sink = Gst.ElementFactory.make("webrtcsink", "webrtc")
+        return Gst.PadProbeReturn.REMOVE
 
-        self.pipeline.add(source)
-        self.pipeline.add(capsfilter)
-        self.pipeline.add(convert)
-        self.pipeline.add(queue)
-        self.pipeline.add(sink)
+    def record_ttff(self, session, latency):
+        self.ttff_latencies.append(latency)
+        self.debug(f"First keyframe for consumer {session.id}"
+                   f" {latency * 1000:.0f} ms after it was added")
 
-        source.set_property("device", self.path)
-        capsfilter.set_property(
-            "caps",
-            Gst.Caps.from_string(
-                f"video/x-raw, format=GRAY16_LE, width=${self.width}, height=${self.height}, framerate=${self.framerate}/1"
-            ),
-        )
+        if len(self.ttff_latencies) < TTFF_MIN_SAMPLES:
+            return
 
-        sink_config = Gst.Structure.new_empty("meta")
-        sink_config.set_value("name", self.name)
-        sink.set_property("meta", sink_config)
+        median = statistics.median(self.ttff_latencies)
+        if median > self.ttff_target:
+            self.logger.warning(
+                f"[{self.path}]: median time-to-first-frame"
+                f" {median * 1000:.0f} ms, target is"
+                f" {self.ttff_target * 1000:.0f} ms",
+                extra={"rate_limit_key": (self.path, "ttff")})
 
-        if self.turn_settings is not None:
-            self.debug(f"Adding TURN-SERVERS to camera {self.turn_settings}")
-            sink.set_property("turn-servers",
-                              Gst.ValueArray(tuple(self.turn_settings)))
+    # endregion
 
-        host = self.config_signaller.host
-        if host == "0.0.0.0":
-            host = "localhost"
+    # region On-demand capture
 
-        protocol = "wss" if self.config_signaller.secure == True else "ws"
-        uri = f"{protocol}://{host}:{self.config_signaller.port}"
+    def start_capture(self):
+        if self.capture_pipeline is None or self.capture_running:
+            return
 
-        signaller = sink.get_property("signaller")
-        signaller.set_property("uri", uri)
+        self.log("Capture started")
+        self.capture_started_at = time.monotonic()
+        self.capture_running = True
+        self.capture_pipeline.set_state(Gst.State.PLAYING)
 
-        if self.config_signaller.certificateCA is not None:
-            signaller.set_property("cafile",
-                                   self.config_signaller.certificateCA)
+    def stop_capture(self):
+        if self.capture_pipeline is None or not self.capture_running:
+            return
 
-        source.link(capsfilter)
-        capsfilter.link(convert)
-        convert.link(queue)
-        queue.link(sink)
+        self.log("Capture stopped")
+        self.capture_started_at = None
+        self.capture_running = False
+        self.capture_pipeline.set_state(Gst.State.NULL)
+        self.capture_pipeline.get_state(Gst.CLOCK_TIME_NONE)
+
+    def cancel_grace_timer(self):
+        if self.grace_timer is not None:
+            self.grace_timer.cancel()
+            self.grace_timer = None
+
+    def schedule_capture_stop(self):
+        """Stops capture after the grace period, capture_lock must be held"""
+        if self.has_consumers() or self.grace_timer is not None \
+                or self.capture_pipeline is None:
+            return
 
-class UDPOutCamera(Camera):
+        self.grace_timer = threading.Timer(
+            self.grace_period, self.on_grace_period_elapsed)
+        self.grace_timer.daemon = True
+        self.grace_timer.start()
 
-    def __init__(self, logger, path, id, name, width, height, framerate, host, port):
+    def on_grace_period_elapsed(self):
+        with self.capture_lock:
+            self.grace_timer = None
+            if not self.has_consumers():
+                self.stop_capture()
 
-        self.host = host
-        self.port = port
-        super().__init__(logger, None, None, path, id, name, width, height, framerate)
+    def on_capture_buffer(self, pad, info):
+        started_at = self.capture_started_at
+        if started_at is not None:
+            self.capture_started_at = None
+            latency = time.monotonic() - started_at
+            self.first_frame_latencies.append(latency)
 
-    def create_pipeline(self):
-        self.pipeline = Gst.Pipeline.new("pipeline")
-        bus = self.pipeline.get_bus()
-        bus.add_signal_watch()
-        bus.connect("message", self.on_message)
+            message = f"First frame {latency * 1000:.0f} ms after capture start"
+            if latency > self.first_frame_target:
+                self.logger.warning(f"[{self.path}]: {message}, target is"
+                                    f" {self.first_frame_target * 1000:.0f} ms")
+            else:
+                self.debug(message)
 
-        source = Gst.ElementFactory.make("v4l2src", "camera-source")
-        capsfilter = Gst.ElementFactory.make("capsfilter", "filter")
-        convert = Gst.ElementFactory.make("videoconvert", "convert")
-        sink = Gst.ElementFactory.make("udpsink", "udpsink")
+        return Gst.PadProbeReturn.OK
 
-        self.pipeline.add(source)
-        self.pipeline.add(capsfilter)
-        self.pipeline.add(convert)
-        self.pipeline.add(sink)
+    def on_capture_message(self, bus, message):
+        self.log_message(message)
 
-        source.set_property("device", self.path)
-        capsfilter.set_property(
-            "caps",
-            Gst.Caps.from_string(
-                f"video/x-raw, width=${self.width}, height=${self.height}, framerate=${self.framerate}/1"
-            ),
+        message_type = message.type
+
+        if message_type == Gst.MessageType.STATE_CHANGED \
+                and message.src == self.capture_pipeline:
+            _, state, _ = message.parse_state_changed()
+            # Cameras with their own encoder resume mid GOP otherwise
+            if state == Gst.State.PLAYING:
+                for sink in self.capture_pipeline.iterate_sinks():
+                    force_keyframe(sink.get_static_pad("sink"))
+        elif message_type == Gst.MessageType.EOS \
+                or message_type == Gst.MessageType.ERROR:
+            self.log(f"Capture interrupted: {message_type}")
+            with self.capture_lock:
+                self.stop_capture()
+                if self.has_consumers():
+                    self.start_capture()
+
+    # endregion
+
+    def log_message(self, message):
+        message_type = message.type
+        source = message.src.get_name() if message.src is not None else None
+        text = f"[{self.path}]: {Gst.MessageType.get_name(message_type)} from {source}"
+
+        # Bus messages are rate limited per camera and type, the frequent
+        # ones are only interesting when debugging
+        extra = {"rate_limit_key": (self.path, message_type)}
+        if message_type in VERBOSE_MESSAGES:
+            self.logger.debug(text, extra=extra)
+        else:
+            self.logger.info(text, extra=extra)
+
+    def on_message(self, bus, message):
+        self.log_message(message)
+
+        message_type = message.type
+
+        if message_type == Gst.MessageType.EOS:
+            self.log("Stream Ended")
+            self.restart_pipeline()
+        elif message_type == Gst.MessageType.ERROR:
+            self.pipeline.set_state(Gst.State.NULL)
+            err, debug = message.parse_error()
+            self.error(f"Stream error {err}: {debug}")
+            self.restart_pipeline()
+
+    def __del__(self):
+        self.stop_pipeline()
+        self.log(f"Camera Destroyed")
+
+
+class H264Camera(Camera):
+
+    def __init__(self, *args, passthrough=False, **kwargs):
+        self.passthrough = passthrough
+        super().__init__(*args, **kwargs)
+
+    def get_graph_name(self):
+        return "h264_passthrough" if self.passthrough else "h264"
+
+    def create_source(self):
+        if self.passthrough and (self.on_demand or self.shm_taps):
+            self.logger.warning(f"[{self.path}]: H264 passthrough needs decoded"
+                                f" frames for on-demand capture and fusion, decoding")
+            self.passthrough = False
+
+        elements = super().create_source()
+        if self.passthrough:
+            self.keyframe_pad = elements[-1].get_static_pad("src")
+
+        return elements
+
+
+class MJPEGCamera(Camera):
+
+    def __init__(self, *args, capture_framerate=None, decode_scale=1, **kwargs):
+        # width and height are the decoded size, the camera is captured at
+        # decode_scale times it
+        self.capture_framerate = capture_framerate
+        self.decode_scale = decode_scale
+        super().__init__(*args, **kwargs)
+
+    @property
+    def decimated(self):
+        return self.capture_framerate is not None \
+            and self.capture_framerate > self.framerate
+
+    def get_graph_name(self):
+        name = "mjpeg_decimated" if self.decimated else "mjpeg"
+        return name + "_scaled" if self.decode_scale > 1 else name
+
+    def get_graph_parameters(self):
+        parameters = super().get_graph_parameters()
+        parameters.update(
+            capture_width=self.width * self.decode_scale,
+            capture_height=self.height * self.decode_scale,
+            capture_framerate=self.capture_framerate if self.decimated else self.framerate,
+            # 1 for half, 2 for a quarter of the size
+            lowres=self.decode_scale.bit_length() - 1,
         )
+        return parameters
 
-        sink.set_property("host", self.host)
-        sink.set_property("port", self.port)
 
-        source.link(capsfilter)
-        capsfilter.link(convert)
-        convert.link(sink)
+class RawCamera(Camera):
+
+    def __init__(self, *args, tone_mapping=None, **kwargs):
+        self.tone_mapper = None
+        if tone_mapping is not None:
+            self.tone_mapper = ToneMapper(
+                tone_mapping.low_percentile, tone_mapping.high_percentile,
+                tone_mapping.smoothing, tone_mapping.min_range,
+                get_colormap(tone_mapping.colormap))
+        super().__init__(*args, **kwargs)
+
+    def get_graph_name(self):
+        return "raw" if self.tone_mapper is None else "raw_tone_mapped"
+
+    def get_graph_parameters(self):
+        parameters = super().get_graph_parameters()
+        if self.tone_mapper is not None:
+            channels = self.tone_mapper.channels
+            parameters["output_format"] = "GRAY8" if channels == 1 else "BGR"
+        return parameters
+
+    def create_source(self):
+        elements = super().create_source()
+        if self.tone_mapper is None:
+            return elements
+
+        channels = self.tone_mapper.channels
+        self.input_stride = (self.width * 2 + 3) // 4 * 4
+        self.output_stride = (self.width * channels + 3) // 4 * 4
+
+        self.get_element("raw-sink").connect("new-sample", self.on_raw_sample)
+        self.appsrc = self.get_element("tone-mapped-source")
+
+        return elements
+
+    def on_raw_sample(self, appsink):
+        sample = appsink.emit("pull-sample")
+        if sample is None:
+            return Gst.FlowReturn.ERROR
+
+        buffer = sample.get_buffer()
+        output = Gst.Buffer.new_allocate(None, self.output_stride * self.height, None)
+        output.pts = buffer.pts
+        output.duration = buffer.duration
+
+        success, raw_info = buffer.map(Gst.MapFlags.READ)
+        if not success:
+            return Gst.FlowReturn.ERROR
+
+        success, output_info = output.map(Gst.MapFlags.WRITE)
+        if not success:
+            buffer.unmap(raw_info)
+            return Gst.FlowReturn.ERROR
+
+        try:
+            frame = np.ndarray((self.height, self.width), dtype="<u2",
+                               buffer=raw_info.data,
+                               strides=(self.input_stride, 2))
+            if self.tone_mapper.channels == 1:
+                mapped = np.ndarray((self.height, self.width), dtype=np.uint8,
+                                    buffer=output_info.data,
+                                    strides=(self.output_stride, 1))
+            else:
+                mapped = np.ndarray((self.height, self.width, 3), dtype=np.uint8,
+                                    buffer=output_info.data,
+                                    strides=(self.output_stride, 3, 1))
+            self.tone_mapper.apply(frame, mapped)
+        finally:
+            output.unmap(output_info)
+            buffer.unmap(raw_info)
+
+        return self.appsrc.emit("push-buffer", output)
+
+class UDPOutCamera(Camera):
+
+    def __init__(self, logger, path, id, name, width, height, framerate, host, port,
+                 latency_profile=LatencyProfile.Default, graph=None):
+
+        self.host = host
+        self.port = port
+        super().__init__(logger, None, None, path, id, name, width, height, framerate,
+                         latency_profile=latency_profile, graph=graph)
+
+    def get_graph_name(self):
+        return "udp_out"
+
+    def get_graph_parameters(self):
+        parameters = super().get_graph_parameters()
+        parameters.update(host=self.host, port=self.port)
+        return parameters
+
+    def create_pipeline(self):
+        self.pipeline = self.new_pipeline("pipeline", self.on_message)
+        source = self.create_source()
+        self.add_chain(self.pipeline, source + self.graph_sink)
 
 class UDPCamera(Camera):
 
@@ -308,56 +794,97 @@ class UDPCamera(Camera):
         self.port = port
         super().__init__(logger, config_signaller, turn_settings, f"UDP {port}", None, name, width, height, framerate)
 
-    def create_pipeline(self):
-        self.pipeline = Gst.Pipeline.new("pipeline")
-        bus = self.pipeline.get_bus()
-        bus.add_signal_watch()
-        bus.connect("message", self.on_message)
+    def get_graph_name(self):
+        return "udp"
 
-        source = Gst.ElementFactory.make("udpsrc", "udp-source")
-        capsfilter = Gst.ElementFactory.make("capsfilter", "filter")
-        convert = Gst.ElementFactory.make("videoconvert", "convert")
-        queue = Gst.ElementFactory.make("queue", "queue")
-        sink = Gst.ElementFactory.make("webrtcsink", "webrtc")
+    def get_graph_parameters(self):
+        parameters = super().get_graph_parameters()
+        parameters.update(port=self.port, format=self.format)
+        return parameters
 
-        self.pipeline.add(source)
-        self.pipeline.add(capsfilter)
-        self.pipeline.add(convert)
-        self.pipeline.add(queue)
-        self.pipeline.add(sink)
+def get_fusion_socket(name, fusion: FusionConfig):
+    if fusion.tap_path is not None:
+        return fusion.tap_path
+    return f"/tmp/fusion-{name}"
 
-        source.set_property("port", self.port)
-        caps = Gst.Caps.from_string(f"video/x-raw, format={self.format}, width={self.width}, height={self.height}, framerate={self.framerate}/1")
+
+class FusionCamera(Camera):
+
+    def __init__(self, logger, config_signaller, turn_settings, name, width,
+                 height, framerate, socket_path, thermal_port, thermal_width,
+                 thermal_height, homography, alpha, overlay, max_skew):
+
+        self.socket_path = socket_path
+        self.receiver = ThermalReceiver("0.0.0.0", thermal_port,
+                                        thermal_width, thermal_height)
+        self.fusion = Fusion(self.receiver, homography,
+                             (thermal_width, thermal_height), (width, height),
+                             alpha, overlay, max_skew)
+        self.stride = (width * 3 + 3) // 4 * 4
+        self.receiver.start()
+        super().__init__(logger, config_signaller, turn_settings, f"fusion {name}", None, name, width, height, framerate)
+
+    def create_pipeline(self):
+        self.pipeline = self.new_pipeline("pipeline", self.on_message)
+        self.sink = self.create_webrtc_sink()
+
+        caps = Gst.Caps.from_string(
+            f"video/x-raw, format=BGR, width={self.width}, height={self.height}, framerate={self.framerate}/1"
+        )
+
+        source = Gst.ElementFactory.make("shmsrc", "color-source")
+        source.set_property("socket-path", self.socket_path)
+        source.set_property("is-live", True)
+        source.set_property("do-timestamp", True)
+        capsfilter = Gst.ElementFactory.make("capsfilter", "color-caps")
         capsfilter.set_property("caps", caps)
+        appsink = Gst.ElementFactory.make("appsink", "color-sink")
+        appsink.set_property("emit-signals", True)
+        appsink.set_property("max-buffers", 1)
+        appsink.set_property("drop", True)
+        appsink.set_property("sync", False)
+        appsink.connect("new-sample", self.on_color_sample)
+        self.add_chain(self.pipeline, [source, capsfilter, appsink])
+
+        self.appsrc = Gst.ElementFactory.make("appsrc", "fusion-source")
+        self.appsrc.set_property("caps", caps)
+        self.appsrc.set_property("format", Gst.Format.TIME)
+        self.appsrc.set_property("is-live", True)
+        self.appsrc.set_property("do-timestamp", True)
+        convert = Gst.ElementFactory.make("videoconvert", "convert")
+        queue = Gst.ElementFactory.make("queue", "queue")
+        self.add_chain(self.pipeline, [self.appsrc, convert, queue, self.sink])
 
-        sink_config = Gst.Structure.new_empty("meta")
-        sink_config.set_value("name", self.name)
-        sink.set_property("meta", sink_config)
+    def frame_view(self, data):
+        return np.ndarray((self.height, self.width, 3), dtype=np.uint8,
+                          buffer=data, strides=(self.stride, 3, 1))
 
-        if self.turn_settings is not None:
-            self.debug(f"Adding TURN-SERVERS to camera {self.turn_settings}")
-            sink.set_property("turn-servers",
-                              Gst.ValueArray(tuple(self.turn_settings)))
+    def on_color_sample(self, appsink):
+        sample = appsink.emit("pull-sample")
+        if sample is None:
+            return Gst.FlowReturn.ERROR
 
-        host = self.config_signaller.host
-        if host == "0.0.0.0":
-            host = "localhost"
+        timestamp = time.monotonic_ns()
+        buffer = sample.get_buffer()
+        output = Gst.Buffer.new_allocate(None, self.stride * self.height, None)
 
-        protocol = "wss" if self.config_signaller.secure == True else "ws"
-        uri = f"{protocol}://{host}:{self.config_signaller.port}"
+        success, color_info = buffer.map(Gst.MapFlags.READ)
+        if not success:
+            return Gst.FlowReturn.ERROR
 
-        signaller = sink.get_property("signaller")
-        signaller.set_property("uri", uri)
+        success, output_info = output.map(Gst.MapFlags.WRITE)
+        if not success:
+            buffer.unmap(color_info)
+            return Gst.FlowReturn.ERROR
 
-        if self.config_signaller.certificateCA is not None:
-            signaller.set_property("cafile",
-                                   self.config_signaller.certificateCA)
-        
+        try:
+            self.fusion.apply(self.frame_view(color_info.data),
+                              self.frame_view(output_info.data), timestamp)
+        finally:
+            output.unmap(output_info)
+            buffer.unmap(color_info)
 
-        source.link(capsfilter)
-        capsfilter.link(convert)
-        convert.link(queue)
-        queue.link(sink)
+        return self.appsrc.emit("push-buffer", output)
 
 # endregion
 
@@ -366,147 +893,496 @@ class CamerasManager:
 
     def __init__(self, config: PipelinesConfig,
                  config_signaller: SignallerConfig,
-                 turn_settings: Optional[list]):
+                 turn_settings: Optional[list], admission=None):
         self.config = config
         self.config_signaller = config_signaller
         self.turn_settings = turn_settings
 
+        # Notified of every started and stopped camera, see
+        # admission.AdmissionController
+        self.admission = admission
+
         self.cameras = {}
         self.udp_cameras = {}
+        self.fusion_cameras = {}
+        self.devices = {}
+        self.planned_modes = {}
+        self.camera_modes = {}
         self.lock = threading.Lock()
         self.udev_context = pyudev.Context()
 
         self.logger = create_logger("Cameras")
 
+        self.supervisor = None
+        if config.supervisor is not None:
+            self.supervisor = Supervisor(config.supervisor)
+
+        self.fusion_configs = self.get_fusion_configs()
+        # Names of fusion cameras with consumers per color camera ID_PATH
+        self.tap_consumers: Dict[str, set] = {}
+
+        self.latency_metrics = LatencyMetrics()
+        self.reported_latency: Dict[str, int] = {}
+        self.event_queue = CameraEventQueue(
+            config.event_debounce, self.handle_event, self.logger)
+
     def detect_cameras(self):
         self.logger.debug("Detecting cameras")
 
-        counter = 0
-        for device in self.udev_context.list_devices(
-                subsystem="video4linux", ID_V4L_CAPABILITIES=":capture:"
-        ):
-            self.add_camera(device)
-            counter += 1
+        devices = list(self.udev_context.list_devices(
+            subsystem="video4linux", ID_V4L_CAPABILITIES=":capture:"
+        ))
 
-        self.logger.debug(f"{counter} cameras detected")
+        # Plan bandwidth for all cameras at once, so that startup does not
+        # depend on the order in which cameras are enumerated
+        controllers = set()
+        for device in devices:
+            if self.register_device(device) is not None:
+                controllers.add(get_controller(device.get("ID_PATH")))
 
-    def add_camera(self, device):
-        self.logger.debug(f"Adding camera: {device}")
+        for controller in controllers:
+            if controller is not None:
+                self.plan_controller(controller)
+
+        for device in devices:
+            self.start_camera(device)
 
+        self.logger.debug(f"{len(devices)} cameras detected")
+
+    def get_camera_config(self, device) -> Optional[CameraConfig]:
         id_path = device.get("ID_PATH")
-        id_sanitized = device.get("ID_PATH_TAG")
         path = device.device_node
-        serial = device.get("ID_SERIAL_SHORT")
-        vendor = device.get("ID_VENDOR")
-        model = device.get("ID_MODEL")
-
-        name = id_sanitized
-        protocol = "mjpeg"
-        width = 1280
-        height = 720
-        framerate = 10
-        mode = CameraMode.WebRTC
-        udp_host = ""
-        udp_port = 0
 
         if id_path in self.config.cameras:
             camera_config = self.config.cameras[id_path]
-            name = camera_config.name
-            protocol = camera_config.protocol
-            width = camera_config.width
-            height = camera_config.height
-            framerate = camera_config.framerate
-            mode = camera_config.mode
-
-            if mode == CameraMode.UDP:
-                udp_host = camera_config.udp.host
-                udp_port = camera_config.udp.port
 
             if camera_config.disable is not None and camera_config.disable:
                 self.logger.info(
-                    f"skipping camera {name} with id={id_path} path={path} - DISABLED")
-                return
+                    f"skipping camera {camera_config.name} with id={id_path} path={path} - DISABLED")
+                return None
 
             self.logger.info(
-                f"adding camera {name} with id={id_path} path={path}")
-        else:
-            self.logger.info(
-                f"adding unknown camera with id={id_path} path={path}")
-            self.logger.info(f"used config:")
-            self.logger.info(
-                yaml.dump(
-                    {
-                        "cameras": {
-                            id_path: {
-                                "name": name,
-                                "protocol": protocol,
-                                "width": width,
-                                "height": height,
-                                "framerate": framerate,
-                            }
+                f"adding camera {camera_config.name} with id={id_path} path={path}")
+            return camera_config
+
+        camera_config = CameraConfig(
+            name=device.get("ID_PATH_TAG"),
+            protocol="mjpeg",
+            width=1280,
+            height=720,
+            framerate=10,
+        )
+
+        self.logger.info(
+            f"adding unknown camera with id={id_path} path={path}")
+        self.logger.info(f"used config:")
+        self.logger.info(
+            yaml.dump(
+                {
+                    "cameras": {
+                        id_path: {
+                            "name": camera_config.name,
+                            "protocol": camera_config.protocol,
+                            "width": camera_config.width,
+                            "height": camera_config.height,
+                            "framerate": camera_config.framerate,
                         }
-                    },
-                    sort_keys=False,
-                )
+                    }
+                },
+                sort_keys=False,
             )
+        )
 
-        self.lock.acquire(blocking=True)
+        return camera_config
 
-        if mode == CameraMode.WebRTC:
-            if protocol == "h264":
-                self.cameras[id_path] = H264Camera(
-                    logger=self.logger, config_signaller=self.config_signaller,
-                    turn_settings=self.turn_settings, path=path, id=id_path,
-                    name=name,
-                    width=width, height=height,
-                    framerate=framerate
+    # region Bandwidth
+
+    def register_device(self, device) -> Optional[CameraConfig]:
+        id_path = device.get("ID_PATH")
+        camera_config = self.get_camera_config(device)
+
+        with self.lock:
+            if camera_config is None:
+                self.devices.pop(id_path, None)
+            else:
+                self.devices[id_path] = (device, camera_config)
+
+        return camera_config
+
+    def unregister_device(self, device):
+        id_path = device.get("ID_PATH")
+
+        with self.lock:
+            self.devices.pop(id_path, None)
+            self.planned_modes.pop(id_path, None)
+
+    def plan_controller(self, controller):
+        """Plans capture modes of cameras on a controller, returns changed ids"""
+        budget = self.config.usb_budgets.get(controller,
+                                             self.config.default_usb_budget)
+
+        with self.lock:
+            requests = [
+                BandwidthRequest(
+                    id_path=id_path,
+                    protocol=camera_config.protocol,
+                    modes=get_capture_modes(camera_config),
+                    priority=camera_config.priority,
+                    bandwidth=camera_config.bandwidth,
+                    capture_framerate=camera_config.capture_framerate,
                 )
+                for id_path, (_, camera_config) in self.devices.items()
+                if get_controller(id_path) == controller
+            ]
+            plan = plan_bandwidth(requests, budget)
+
+            changed = [
+                id_path for id_path, mode in plan.items()
+                if self.planned_modes.get(id_path) != mode
+            ]
+            self.planned_modes.update(plan)
+
+        for request in requests:
+            mode = plan[request.id_path]
+            if mode is None:
+                self.logger.warning(
+                    f"camera with id={request.id_path} rejected, controller"
+                    f" {controller} exceeds budget of {budget} MB/s")
+            elif mode != request.modes[0]:
+                self.logger.warning(
+                    f"camera with id={request.id_path} degraded to"
+                    f" {mode[0]}x{mode[1]}@{mode[2]} on controller {controller}")
+
+        return changed
+
+    def replan(self, id_path):
+        """Replans the controller of a camera and reconfigures the others"""
+        controller = get_controller(id_path)
+        if controller is None:
+            return
+
+        for changed_id in self.plan_controller(controller):
+            if changed_id == id_path:
+                continue
+
+            with self.lock:
+                entry = self.devices.get(changed_id)
+
+            if entry is not None:
+                self.event_queue.push(RECONFIGURE, entry[0])
+
+    def get_planned_mode(self, id_path, camera_config):
+        if get_controller(id_path) is None:
+            return get_capture_modes(camera_config)[0]
+
+        with self.lock:
+            return self.planned_modes.get(id_path)
+
+    # endregion
+
+    def add_camera(self, device):
+        self.logger.debug(f"Adding camera: {device}")
+
+        id_path = device.get("ID_PATH")
+
+        if self.register_device(device) is None:
+            self.stop_camera(id_path)
+            self.replan(id_path)
+            return None
+
+        self.replan(id_path)
+        return self.start_camera(device)
+
+    def start_camera(self, device, force=True):
+        id_path = device.get("ID_PATH")
+        path = device.device_node
+
+        with self.lock:
+            entry = self.devices.get(id_path)
+            camera = self.cameras.get(id_path)
+            current_mode = self.camera_modes.get(id_path)
+
+        if entry is None:
+            self.stop_camera(id_path)
+            return None
+
+        _, camera_config = entry
+        mode = self.get_planned_mode(id_path, camera_config)
+
+        if not force and camera is not None and camera.path == path \
+                and current_mode == mode:
+            return camera
+
+        self.stop_camera(id_path)
+
+        if mode is None:
+            self.logger.warning(
+                f"not starting camera {camera_config.name} with id={id_path}"
+                f" - not enough USB bandwidth")
+            return None
+
+        camera = self.create_camera(device, camera_config, mode)
+        if camera is None:
+            return None
+
+        with self.lock:
+            self.cameras[id_path] = camera
+            self.camera_modes[id_path] = mode
+
+        if self.admission is not None:
+            self.admission.register(camera)
+
+        return camera
+
+    def create_camera(self, device, camera_config: CameraConfig, mode):
+        id_path = device.get("ID_PATH")
+        path = device.device_node
+        name = camera_config.name
+        protocol = camera_config.protocol
+        width, height, framerate = mode
+
+        graph = None
+        if camera_config.graph is not None:
+            graph = self.get_graph(camera_config.graph)
+            if graph is None:
+                self.logger.warning(
+                    f"unknown pipeline graph {camera_config.graph} for camera {name} with id={id_path}")
+                return None
+
+        if camera_config.mode == CameraMode.WebRTC:
+            camera_classes = {
+                "h264": H264Camera,
+                "mjpeg": MJPEGCamera,
+                "raw": RawCamera,
+            }
+
+            extra = {}
+            if protocol == "raw":
+                extra["tone_mapping"] = camera_config.tone_mapping
+            elif protocol == "h264":
+                extra["passthrough"] = camera_config.passthrough
             elif protocol == "mjpeg":
-                self.cameras[id_path] = MJPEGCamera(
-                    logger=self.logger, config_signaller=self.config_signaller,
-                    turn_settings=self.turn_settings, path=path, id=id_path,
-                    name=name,
-                    width=width, height=height,
-                    framerate=framerate
-                )
-            elif protocol == "raw":
-                self.cameras[id_path] = RawCamera(
-                    logger=self.logger, config_signaller=self.config_signaller,
+                scale = camera_config.decode_scale
+                if width % scale or height % scale:
+                    self.logger.warning(
+                        f"{width}x{height} of camera {name} is not divisible"
+                        f" by decode_scale {scale}, decoding at full size")
+                    scale = 1
+
+                width, height = width // scale, height // scale
+                extra["capture_framerate"] = camera_config.capture_framerate
+                extra["decode_scale"] = scale
+
+            if protocol in camera_classes:
+                return self.instantiate(
+                    camera_classes[protocol], path,
+                    config_signaller=self.config_signaller,
                     turn_settings=self.turn_settings, path=path, id=id_path,
                     name=name,
                     width=width, height=height,
-                    framerate=framerate
+                    framerate=framerate,
+                    on_demand=camera_config.on_demand,
+                    grace_period=camera_config.grace_period,
+                    first_frame_target=camera_config.first_frame_target,
+                    shm_taps=self.get_fusion_taps(id_path),
+                    latency_profile=camera_config.latency_profile,
+                    ttff_target=camera_config.ttff_target,
+                    graph=graph,
+                    tap_consumers=self.get_tap_consumers(id_path),
+                    **extra
                 )
-        elif mode == CameraMode.UDP:
-            self.cameras[id_path] = UDPOutCamera(
-                logger=self.logger, path=path, id=id_path, name=name, width=width, height=height, framerate=framerate, host=udp_host, port=udp_port
+        elif camera_config.mode == CameraMode.UDP:
+            return self.instantiate(
+                UDPOutCamera, path, path=path, id=id_path, name=name, width=width, height=height, framerate=framerate,
+                host=camera_config.udp.host, port=camera_config.udp.port,
+                latency_profile=camera_config.latency_profile, graph=graph
             )
-            ...
 
-        self.lock.release()
+        self.logger.warning(
+            f"unsupported protocol {protocol} for camera {name} with id={id_path}")
+        return None
+
+    def get_graph(self, name):
+        """Graphs of the config replace the defaults of the same name"""
+        graph = self.config.graphs.get(name)
+        if graph is None:
+            graph = DEFAULT_GRAPHS.get(name)
+        return graph
+
+    # region Fusion
+
+    def get_fusion_configs(self) -> Dict[str, FusionConfig]:
+        """
+        Fusion cameras of the config, without the ones sharing a thermal
+        port or a color tap with an earlier one, they cannot both bind it
+        """
+        configs = {}
+        ports = set()
+        taps = set()
+
+        for name, fusion in self.config.fusion.items():
+            tap = get_fusion_socket(name, fusion)
+            if fusion.thermal_port in ports or tap in taps:
+                self.logger.warning(
+                    f"skipping fusion camera {name} - thermal port"
+                    f" {fusion.thermal_port} or tap {tap} already used")
+                continue
+
+            ports.add(fusion.thermal_port)
+            taps.add(tap)
+            configs[name] = fusion
+
+        return configs
+
+    def get_fusion_taps(self, id_path):
+        return [
+            (get_fusion_socket(name, fusion), fusion.width, fusion.height,
+             fusion.framerate)
+            for name, fusion in self.fusion_configs.items()
+            if fusion.color == id_path
+        ]
+
+    def get_tap_consumers(self, id_path):
+        with self.lock:
+            return sorted(self.tap_consumers.get(id_path, ()))
+
+    def set_fusion_active(self, name, color, active):
+        """Fusion cameras with consumers keep capture of their color camera running"""
+        with self.lock:
+            names = self.tap_consumers.setdefault(color, set())
+            if active == (name in names):
+                return
 
-    def remove_camera(self, device):
-        id_path = device.get("ID_PATH")
+            if active:
+                names.add(name)
+            else:
+                names.discard(name)
+            camera = self.cameras.get(color)
+
+        if camera is not None:
+            camera.set_tap_consumer(name, active)
+
+    def watch_fusion_consumers(self, name, color, camera):
+        forward = camera.on_consumers_changed
+
+        def on_consumers_changed(camera, full, degraded, rejected):
+            if forward is not None:
+                forward(camera, full, degraded, rejected)
+            self.set_fusion_active(name, color, full + degraded > 0)
+
+        camera.on_consumers_changed = on_consumers_changed
+
+    # endregion
+
+    def instantiate(self, camera_class, path, **kwargs):
+        if self.supervisor is not None:
+            return self.supervisor.spawn(camera_class, path, kwargs)
+
+        try:
+            return camera_class(logger=self.logger, **kwargs)
+        except ValueError as error:
+            self.logger.error(f"[{path}]: cannot create camera: {error}")
+            return None
 
-        self.lock.acquire(blocking=True)
+    def stop_camera(self, id_path):
+        with self.lock:
+            camera = self.cameras.pop(id_path, None)
+            self.camera_modes.pop(id_path, None)
+
+        if camera is None:
+            return
+
+        if self.admission is not None:
+            self.admission.unregister(camera)
 
         self.logger.info(
-            f"removing camera {self.cameras[id_path].name}"
-            f" with id={id_path} path={self.cameras[id_path].path}"
+            f"removing camera {camera.name}"
+            f" with id={id_path} path={camera.path}"
         )
-        self.cameras[id_path].stop_pipeline()
-        del self.cameras[id_path]
+        camera.stop_pipeline()
+
+    def remove_camera(self, device):
+        id_path = device.get("ID_PATH")
 
-        self.lock.release()
+        with self.lock:
+            active = id_path in self.cameras
+
+        if not active:
+            self.logger.debug(
+                f"removed camera with id={id_path} was not active")
+
+        self.unregister_device(device)
+        self.stop_camera(id_path)
+        self.replan(id_path)
+
+    def handle_event(self, action, device, timestamp):
+        id_path = device.get("ID_PATH")
+
+        if action == "add":
+            # The device node may have changed during a flap, always rebuild
+            if self.add_camera(device) is not None:
+                latency = time.monotonic() - timestamp
+                self.latency_metrics.record(id_path, latency)
+                self.logger.info(
+                    f"camera with id={id_path} live {latency * 1000:.0f} ms after udev event")
+        elif action == "remove":
+            self.remove_camera(device)
+        elif action == RECONFIGURE:
+            # The device of the event may be older than a handled add
+            with self.lock:
+                entry = self.devices.get(id_path)
+            if entry is not None:
+                self.start_camera(entry[0], force=False)
+
+    def update_turn_settings(self, turn_settings):
+        self.turn_settings = turn_settings
+
+        with self.lock:
+            cameras = list(self.cameras.values())
+        cameras.extend(self.udp_cameras.values())
+        cameras.extend(self.fusion_cameras.values())
+
+        for camera in cameras:
+            camera.update_turn_settings(turn_settings)
 
     def start_udp_cameras(self):
         for udp in self.config.udp_cameras.values():
-            self.udp_cameras[udp.port] = UDPCamera(
-                logger=self.logger, config_signaller=self.config_signaller,
+            camera = self.instantiate(
+                UDPCamera, f"UDP {udp.port}",
+                config_signaller=self.config_signaller,
                 turn_settings=self.turn_settings, width=udp.width, height=udp.height, framerate=udp.framerate, port=udp.port, v_format=udp.format,
                 name=udp.name
             )
+            if camera is None:
+                continue
+
+            self.udp_cameras[udp.port] = camera
+            if self.admission is not None:
+                self.admission.register(camera)
+
+
+    def start_fusion_cameras(self):
+        for name, fusion in self.fusion_configs.items():
+            camera = self.instantiate(
+                FusionCamera, f"fusion {name}",
+                config_signaller=self.config_signaller,
+                turn_settings=self.turn_settings, name=name,
+                width=fusion.width, height=fusion.height,
+                framerate=fusion.framerate,
+                socket_path=get_fusion_socket(name, fusion),
+                thermal_port=fusion.thermal_port,
+                thermal_width=fusion.thermal_width,
+                thermal_height=fusion.thermal_height,
+                homography=fusion.homography, alpha=fusion.alpha,
+                overlay=fusion.overlay, max_skew=fusion.max_skew
+            )
+            if camera is None:
+                continue
 
+            self.fusion_cameras[name] = camera
+            if self.admission is not None:
+                self.admission.register(camera)
+            self.watch_fusion_consumers(name, fusion.color, camera)
 
     def start_camera_monitoring(self):
         self.logger.debug("Start Camera monitoring")
@@ -516,13 +1392,30 @@ class CamerasManager:
 
         def log_event(action, device):
             if device.get("ID_V4L_CAPABILITIES") == ":capture:":
-                self.logger.info(action, device)
+                self.logger.info(f"udev event {action}: {device}")
 
-                if action == "add":
-                    self.add_camera(device)
-                elif action == "remove":
-                    self.remove_camera(device)
+                if action in ("add", "remove"):
+                    self.event_queue.push(action, device)
 
         observer = pyudev.MonitorObserver(monitor, log_event)
         self.logger.debug("Start observer")
         observer.start()
+
+        GLib.timeout_add_seconds(max(1, round(self.config.event_report_interval)),
+                                 self.report_event_latency)
+
+    def report_event_latency(self):
+        """Logs the latency of cameras which went live since the last report"""
+        for id_path, summary in self.latency_metrics.summary().items():
+            if self.reported_latency.get(id_path) == summary["total"]:
+                continue
+            self.reported_latency[id_path] = summary["total"]
+
+            self.logger.info(
+                f"camera with id={id_path} live after udev events in"
+                f" {summary['median'] * 1000:.0f} ms median,"
+                f" {summary['p95'] * 1000:.0f} ms p95,"
+                f" {summary['max'] * 1000:.0f} ms max"
+                f" over the last {summary['count']}")
+
+        return True
@@ -5,16 +5,98 @@ import time
 import threading
 from typing import Any, Callable, Dict, List, Tuple
 
+from radiometric import TEMPERATURE_OFFSET, TEMPERATURE_SCALE
+
 
 Frame = np.ndarray
-Transformation = Callable[[Frame], Frame]
+Transformation = Callable[[Frame, Frame], Frame]
+FrameSpec = Tuple[Tuple[int, ...], np.dtype]
+
+
+class Stage:
+    """
+    A transformation writing its output into a preallocated buffer
+
+    :param transform: called with the source frame and the destination
+        buffer, returns the destination
+    :param output: returns the output spec of the stage for an input spec,
+        by default the output has the same shape and dtype as the input
+    """
+
+    def __init__(self, transform: Transformation,
+                 output: Callable[[FrameSpec], FrameSpec] = lambda spec: spec):
+        self.transform = transform
+        self.output = output
+
+
+class TemporalDenoiseStage(Stage):
+    """
+    Motion adaptive exponential moving average over raw 16-bit frames. The
+    weight of the new frame grows with its difference from the average,
+    linearly from `alpha` for still pixels to 1 at `motion_threshold`, so
+    noise is averaged out while moving objects do not leave trails.
+
+    All passes are saturating 16-bit OpenCV operations on preallocated
+    buffers. The average is kept in 16 bits, which leaves a dead band of
+    one raw unit.
+    """
+
+    def __init__(self, alpha: float, motion_threshold: int):
+        super().__init__(self._transform, self._output)
+        # Remaining fraction 1 - weight of a difference, in 1/65535 units
+        self._remaining = 65535 * (1.0 - alpha)
+        self._remaining_slope = self._remaining / max(motion_threshold, 1)
+        self._accumulator = None
+        self._difference = None
+        self._remainder = None
+        self._initialized = False
+
+    def _output(self, spec: FrameSpec) -> FrameSpec:
+        shape, dtype = spec
+        if np.dtype(dtype) != np.uint16:
+            raise ValueError("Temporal denoising operates on raw 16-bit frames, add it before normalization")
+
+        self._accumulator = np.empty(shape, dtype=np.uint16)
+        self._difference = np.empty(shape, dtype=np.uint16)
+        self._remainder = np.empty(shape, dtype=np.uint16)
+        self._initialized = False
+
+        return spec
+
+    def _transform(self, frame: Frame, dst: Frame) -> Frame:
+        accumulator = self._accumulator
+        difference = self._difference
+        remainder = self._remainder
+
+        if not self._initialized:
+            np.copyto(accumulator, frame)
+            self._initialized = True
+        else:
+            # Distance r = (1 - weight) * |frame - average| the new average
+            # stays away from the frame, 0 from the motion threshold on
+            cv2.absdiff(frame, accumulator, difference)
+            cv2.addWeighted(difference, -self._remaining_slope, difference, 0.0,
+                            self._remaining, remainder)
+            cv2.multiply(difference, remainder, remainder, 1.0 / 65535)
+
+            # max(frame - r, min(frame + r, average)) is frame - r above the
+            # average and frame + r below it, without a sign mask
+            cv2.add(frame, remainder, difference)
+            cv2.min(difference, accumulator, difference)
+            cv2.subtract(frame, remainder, remainder)
+            cv2.max(difference, remainder, accumulator)
+
+        np.copyto(dst, accumulator)
+
+        return dst
 
 
 class Runner:
     def __init__(self, host: str, receive_port: int, send_port: int, width: int, height: int, pipeline: 'Pipeline'):
         self._host = host
         self._receive_port = receive_port
-        self._send_port = send_port
+        self._destinations = [send_port]
+        self._listeners: List[Callable[[Frame], None]] = []
         self._frame_size = width * height * 2
         self._last_frame = None
         self._socket = None
@@ -45,6 +127,13 @@ class Runner:
         with self._lock:
             self._pipeline = pipeline
 
+    def add_destination(self, port: int):
+        self._destinations.append(port)
+
+    def add_listener(self, listener: Callable[[Frame], None]):
+        """Listeners receive every raw frame and must not block"""
+        self._listeners.append(listener)
+
     def _create_socket(self, host: str, port: int):
         while True:
             try:
@@ -71,8 +160,11 @@ class Runner:
                     frame = np.frombuffer(data, dtype='<u2').reshape((self._height, self._width))
                     frame = frame[:-2, :] # Fix image
                     self.last_frame = frame
+                    for listener in self._listeners:
+                        listener(frame)
                     processed_frame = self.pipeline.apply(frame)
-                    self._socket.sendto(processed_frame.tobytes(), (self._host, self._send_port))
+                    for port in self._destinations:
+                        self._socket.sendto(processed_frame, (self._host, port))
             except Exception as e:
                 print(f"Socket error: {e}, attempting to restart socket.")
                 self._restart_socket()
@@ -85,11 +177,41 @@ class Runner:
 
 class Pipeline:
 
-    def __init__(self, width: int, height: int, transformations: List[Transformation], features: Dict[str, Any]):
+    def __init__(self, width: int, height: int, stages: List[Stage], features: Dict[str, Any]):
         self._width = width
         self._height = height
-        self._transformations = transformations
+        self._stages = stages
         self._features = features
+        self._input_spec = None
+        self._buffers = []
+
+        self._plan(((height, width), np.dtype('<u2')))
+
+    def _plan(self, input_spec: FrameSpec):
+        """
+        Preallocates the output buffer of every stage. Stages with the same
+        output spec alternate between two buffers, so that no stage reads
+        and writes the same one.
+        """
+        pool: Dict[FrameSpec, List[Frame]] = {}
+        buffers = []
+        current = None
+        spec = input_spec
+
+        for stage in self._stages:
+            spec = stage.output(spec)
+            candidates = pool.setdefault((spec[0], np.dtype(spec[1])), [])
+
+            buffer = next((candidate for candidate in candidates if candidate is not current), None)
+            if buffer is None:
+                buffer = np.empty(spec[0], dtype=spec[1])
+                candidates.append(buffer)
+
+            buffers.append(buffer)
+            current = buffer
+
+        self._input_spec = input_spec
+        self._buffers = buffers
 
     def get_temperature_at(self, frame: Frame, x: int, y: int) -> float:
         if y < 0 or y >= self._height:
@@ -115,14 +237,25 @@ class Pipeline:
         return self.get_temperature_at(frame, *position), position
 
     def apply(self, frame: Frame) -> Frame:
+        """
+        Applies all stages to the frame. The returned frame is a buffer owned
+        by the pipeline, it is overwritten by the next call.
+        """
+        if (frame.shape, frame.dtype) != self._input_spec:
+            self._plan((frame.shape, frame.dtype))
+
+        # Markers are found on the last raw frame, after denoising
+        raw = frame
+        for stage, buffer in zip(self._stages, self._buffers):
+            frame = stage.transform(frame, buffer)
+            if frame.dtype == np.uint16:
+                raw = frame
+
         if self._features.get("mark_min_temp", None):
-            _, min_pos = self.get_min_temperature(frame)
+            _, min_pos = self.get_min_temperature(raw)
 
         if self._features.get("mark_max_temp", None):
-            _, max_pos = self.get_max_temperature(frame)
-
-        for transform in self._transformations:
-            frame = transform(frame)
+            _, max_pos = self.get_max_temperature(raw)
 
         if self._features.get("mark_min_temp", None):
             frame = self._mark_position(
@@ -141,7 +274,7 @@ class Pipeline:
         return frame
 
     def _convert_to_temperature(self, value: int) -> float:
-        return (value - 27315) / 100
+        return (value - TEMPERATURE_OFFSET) / TEMPERATURE_SCALE
 
     def _mark_position(self, frame: Frame, position: Tuple[int, int], color: Tuple[int, int, int]) -> Frame:
         return cv2.circle(frame, position, 1, color, -1)
@@ -153,59 +286,67 @@ class PipelineBuilder:
     def __init__(self, width: int, height: int):
         self._width = width
         self._height = height
-        self._transformations = []
+        self._stages = []
         self._features = {}
 
     def add_normalization(self, min: int = 0, max: int = 0, normalization_type: int = cv2.NORM_MINMAX) -> 'PipelineBuilder':
-        self._transformations.append(
-            lambda frame: cv2.normalize(frame, None, min, max, normalization_type)
-        )
-        self._transformations.append(
-            lambda frame: np.uint8(frame)
-        )
+        self._stages.append(Stage(
+            lambda frame, dst: cv2.normalize(frame, dst, min, max, normalization_type, cv2.CV_8U),
+            lambda spec: (spec[0], np.uint8)
+        ))
+
+        return self
+
+    def add_temporal_denoise(self, alpha: float = 0.25, motion_threshold: int = 200) -> 'PipelineBuilder':
+        """
+        Denoises raw frames over time, has to be added before normalization.
+        The motion threshold is in raw units (hundredths of a kelvin).
+        """
+        self._stages.append(TemporalDenoiseStage(alpha, motion_threshold))
 
         return self
 
     def add_clahe(self, clip_limit: float = 2.0, tile_grid_size: Tuple[int, int] = (16, 16)) -> 'PipelineBuilder':
         clahe = cv2.createCLAHE(clipLimit=clip_limit, tileGridSize=tile_grid_size)
-        self._transformations.append(
-            lambda frame: clahe.apply(frame)
-        )
+        self._stages.append(Stage(
+            lambda frame, dst: clahe.apply(frame, dst)
+        ))
 
         return self
 
     def add_histogram_equalization(self) -> 'PipelineBuilder':
-        self._transformations.append(
-            lambda frame: cv2.equalizeHist(frame)
-        )
+        self._stages.append(Stage(
+            lambda frame, dst: cv2.equalizeHist(frame, dst)
+        ))
 
         return self
 
     def add_gaussian_blur(self, kernel_size: Tuple[int, int] = (3, 3), sigma: Tuple[float, float] = (0.0, 0.0)) -> 'PipelineBuilder':
-        self._transformations.append(
-            lambda frame: cv2.GaussianBlur(frame, kernel_size, *sigma)
-        )
+        self._stages.append(Stage(
+            lambda frame, dst: cv2.GaussianBlur(frame, kernel_size, sigma[0], dst, sigma[1])
+        ))
 
         return self
 
     def add_median_blur(self, diameter: int = 3) -> 'PipelineBuilder':
-        self._transformations.append(
-            lambda frame: cv2.medianBlur(frame, diameter)
-        )
+        self._stages.append(Stage(
+            lambda frame, dst: cv2.medianBlur(frame, diameter, dst)
+        ))
 
         return self
 
     def add_bilateral_blur(self, diameter: int = 3, sigma_color: float = 30, sigma_space: float = 30) -> 'PipelineBuilder':
-        self._transformations.append(
-            lambda frame: cv2.bilateralFilter(frame, diameter, sigma_color, sigma_space)
-        )
+        self._stages.append(Stage(
+            lambda frame, dst: cv2.bilateralFilter(frame, diameter, sigma_color, sigma_space, dst)
+        ))
 
         return self
 
     def add_color_map(self, color_map: int) -> 'PipelineBuilder':
-        self._transformations.append(
-            lambda frame: cv2.applyColorMap(frame, color_map)
-        )
+        self._stages.append(Stage(
+            lambda frame, dst: cv2.applyColorMap(frame, color_map, dst),
+            lambda spec: (spec[0][:2] + (3,), np.uint8)
+        ))
 
         return self
 
@@ -219,11 +360,11 @@ class PipelineBuilder:
         self._features["mark_max_temp::color"] = color
         return self
 
-    def build(self) -> Transformation:
+    def build(self) -> Pipeline:
         return Pipeline(
             self._width,
             self._height,
-            self._transformations,
+            self._stages,
             self._features
         )
 
@@ -239,6 +380,15 @@ if __name__ == "__main__":
         .build()
 
     runner = Runner("0.0.0.0", 5123, 5124, 160, 122, pipeline)
+    runner.add_destination(5125)  # Color + IR fusion
+
+    # Needs websockets, which the pipeline classes do not
+    from radiometric import RadiometricServer
+
+    radiometric_server = RadiometricServer("0.0.0.0", 8765, 160, 120, keyframe_interval=30)
+    radiometric_server.start()
+    runner.add_listener(radiometric_server.push)
+
     runner.start()
 
     # In other thread
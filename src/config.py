@@ -1,4 +1,4 @@
-from typing import Optional
+from typing import Any, Literal, Optional
 from enum import Enum
 
 import yaml
@@ -22,6 +22,39 @@ class UDPSettings(BaseModel):
     host: str
     port: int
 
+class LatencyProfile(str, Enum):
+    Default = "default"
+    Low = "low"
+
+class FallbackMode(BaseModel):
+    width: int
+    height: int
+    framerate: int
+
+class ElementConfig(BaseModel):
+    factory: str
+    name: Optional[str] = None
+    # Values may reference graph parameters as ${name}
+    properties: dict[str, Any] = {}
+    # Only part of the graph with this latency profile
+    profile: Optional[LatencyProfile] = None
+
+class PipelineGraph(BaseModel):
+    # Linked in order: capture, then decoding to raw video
+    source: list[ElementConfig]
+    decode: list[ElementConfig] = []
+    # Chains not linked to the source, e.g. ending in an appsink
+    branches: list[list[ElementConfig]] = []
+    # Linked after decode instead of the WebRTC sink
+    sink: list[ElementConfig] = []
+
+class ToneMappingConfig(BaseModel):
+    low_percentile: float = 1.0
+    high_percentile: float = 99.0
+    smoothing: float = 0.1
+    min_range: int = 256
+    colormap: Optional[str] = None
+
 class Camera(BaseModel):
     name: str
     protocol: str
@@ -31,6 +64,21 @@ class Camera(BaseModel):
     disable: Optional[bool] = None
     mode: CameraMode = CameraMode.WebRTC
     udp: Optional[UDPSettings] = None
+    on_demand: bool = False
+    grace_period: float = 5.0
+    first_frame_target: float = 1.0
+    priority: int = 0
+    fallback_modes: list[FallbackMode] = []
+    bandwidth: Optional[float] = None
+    latency_profile: LatencyProfile = LatencyProfile.Default
+    tone_mapping: Optional[ToneMappingConfig] = None
+    passthrough: bool = False
+    ttff_target: float = 0.5
+    graph: Optional[str] = None
+    # MJPEG cameras opened at a higher rate than framerate, frames are
+    # dropped before decoding
+    capture_framerate: Optional[int] = None
+    decode_scale: Literal[1, 2, 4] = 1
 
 class UDPCamera(BaseModel):
     name: str
@@ -41,15 +89,86 @@ class UDPCamera(BaseModel):
     format: str
 
 
+class FusionConfig(BaseModel):
+    color: str
+    width: int = 640
+    height: int = 480
+    framerate: int = 10
+    # Unique per fusion camera, as is the color tap
+    thermal_port: int = 5125
+    tap_path: Optional[str] = None
+    thermal_width: int = 160
+    thermal_height: int = 120
+    homography: list[list[float]]
+    alpha: float = 0.5
+    overlay: bool = False
+    max_skew: float = 0.1
+
+
+class SupervisorConfig(BaseModel):
+    heartbeat_interval: float = 1.0
+    heartbeat_timeout: float = 5.0
+    start_timeout: float = 10.0
+    restart_backoff: float = 1.0
+    restart_backoff_max: float = 60.0
+    report_interval: float = 60.0
+
+
+class AdmissionPolicy(str, Enum):
+    Reject = "reject"
+    Degrade = "degrade"
+
+
+class CameraAdmissionConfig(BaseModel):
+    max_consumers: Optional[int] = None
+    max_cpu: Optional[float] = None
+
+
+class AdmissionConfig(BaseModel):
+    max_encode_rate: Optional[float] = None
+    max_cpu: Optional[float] = None
+    max_consumers: Optional[int] = None
+    policy: AdmissionPolicy = AdmissionPolicy.Degrade
+    degrade_divisor: int = 2
+    cameras: dict[str, CameraAdmissionConfig] = {}
+    update_interval: float = 1.0
+    report_interval: float = 60.0
+    status_path: Optional[str] = None
+
+
 class PipelinesConfig(BaseModel):
     cameras: dict[str, Camera]
     udp_cameras: dict[str, UDPCamera] = {}
+    fusion: dict[str, FusionConfig] = {}
+    event_debounce: float = 0.5
+    event_report_interval: float = 60.0
+    usb_budgets: dict[str, float] = {}
+    # Controllers without a budget are not planned
+    default_usb_budget: Optional[float] = None
+    supervisor: Optional[SupervisorConfig] = None
+    admission: Optional[AdmissionConfig] = None
+    graphs: dict[str, PipelineGraph] = {}
+
+
+def get_capture_modes(camera: Camera) -> list[tuple[int, int, int]]:
+    modes = [(camera.width, camera.height, camera.framerate)]
+    modes.extend(
+        (mode.width, mode.height, mode.framerate)
+        for mode in camera.fallback_modes
+    )
+    return modes
 
 
 class TurnConfig(BaseModel):
     url: str
     apiToken: str
     turnToken: str
+    ttl: int = 86400
+    timeout: float = 10.0
+    refreshRatio: float = 0.5
+    retryDelay: float = 5.0
+    retryDelayMax: float = 300.0
+    cachePath: str = "/configuration/turn_cache.json"
 
 
 def load_signaller_config(filepath: FilePath) -> SignallerConfig:
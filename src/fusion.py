@@ -0,0 +1,165 @@
+import socket
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+import cv2
+import numpy as np
+
+
+Frame = np.ndarray
+Size = Tuple[int, int]
+
+
+class RegistrationMaps:
+    """
+    Precomputed cv2.remap tables warping a thermal frame onto the region of
+    the color frame it covers
+    """
+
+    def __init__(self, homography: np.ndarray, thermal_size: Size, color_size: Size):
+        thermal_width, thermal_height = thermal_size
+        color_width, color_height = color_size
+
+        # Region of the color frame covered by the thermal frame
+        corners = np.float32([
+            [0, 0], [thermal_width, 0],
+            [thermal_width, thermal_height], [0, thermal_height]
+        ]).reshape(-1, 1, 2)
+        projected = cv2.perspectiveTransform(corners, homography).reshape(-1, 2)
+
+        left = int(np.clip(np.floor(projected[:, 0].min()), 0, color_width))
+        right = int(np.clip(np.ceil(projected[:, 0].max()), 0, color_width))
+        top = int(np.clip(np.floor(projected[:, 1].min()), 0, color_height))
+        bottom = int(np.clip(np.ceil(projected[:, 1].max()), 0, color_height))
+        self.roi = (slice(top, bottom), slice(left, right))
+
+        # Every color pixel of the region maps back to a thermal pixel
+        x, y = np.meshgrid(
+            np.arange(left, right, dtype=np.float32),
+            np.arange(top, bottom, dtype=np.float32)
+        )
+        points = np.stack([x, y], axis=-1).reshape(-1, 1, 2)
+        inverse = cv2.perspectiveTransform(points, np.linalg.inv(homography))
+        inverse = inverse.reshape(bottom - top, right - left, 2)
+
+        self.map1, self.map2 = cv2.convertMaps(
+            inverse[..., 0], inverse[..., 1], cv2.CV_16SC2)
+
+    @property
+    def empty(self) -> bool:
+        return self.map1.size == 0
+
+
+_maps_cache: Dict[tuple, RegistrationMaps] = {}
+_maps_lock = threading.Lock()
+
+
+def get_registration_maps(homography, thermal_size: Size, color_size: Size) -> RegistrationMaps:
+    homography = np.asarray(homography, dtype=np.float64).reshape(3, 3)
+    key = (homography.tobytes(), tuple(thermal_size), tuple(color_size))
+
+    with _maps_lock:
+        if key not in _maps_cache:
+            _maps_cache[key] = RegistrationMaps(homography, thermal_size, color_size)
+        return _maps_cache[key]
+
+
+class ThermalReceiver:
+    """
+    Receives colorized thermal frames sent by color_ir_camera.Runner into a
+    ring of preallocated slots. A slot is published by writing its
+    timestamp after the frame, readers never take a lock. Datagrams of any
+    other size than a frame are dropped and counted.
+    """
+
+    def __init__(self, host: str, port: int, width: int, height: int, slots: int = 8):
+        self._address = (host, port)
+        self._frame_size = width * height * 3
+        self._frames = [np.empty((height, width, 3), dtype=np.uint8) for _ in range(slots)]
+        self._timestamps = [0] * slots
+        self._index = 0
+        self.dropped = 0
+
+    def start(self):
+        thread = threading.Thread(target=self.run, name="thermal-receiver", daemon=True)
+        thread.start()
+
+    def run(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind(self._address)
+
+        while True:
+            self.receive(sock)
+
+    def receive(self, sock) -> bool:
+        """Receives one datagram into the next slot, False if it is dropped"""
+        index = (self._index + 1) % len(self._frames)
+        self._timestamps[index] = 0
+
+        # recv_into silently cuts larger datagrams to the buffer size, only
+        # the truncation flag tells them apart from a full frame
+        received, _, flags, _ = sock.recvmsg_into([self._frames[index].data])
+        if received != self._frame_size or flags & socket.MSG_TRUNC:
+            self.dropped += 1
+            return False
+
+        self._timestamps[index] = time.monotonic_ns()
+        self._index = index
+        return True
+
+    def get_nearest(self, timestamp: int, max_skew: int) -> Optional[Frame]:
+        """Returns the frame received closest to the timestamp, if any"""
+        best = None
+        best_skew = max_skew
+
+        for index, received_at in enumerate(self._timestamps):
+            if received_at == 0:
+                continue
+
+            skew = abs(received_at - timestamp)
+            if skew <= best_skew:
+                best, best_skew = index, skew
+
+        return self._frames[best] if best is not None else None
+
+
+class Fusion:
+    """Blends registered thermal frames onto color frames"""
+
+    def __init__(self, receiver: ThermalReceiver, homography, thermal_size: Size,
+                 color_size: Size, alpha: float = 0.5, overlay: bool = False,
+                 max_skew: float = 0.1):
+        self._receiver = receiver
+        self._maps = get_registration_maps(homography, thermal_size, color_size)
+        self._alpha = alpha
+        self._overlay = overlay
+        self._max_skew = int(max_skew * 1e9)
+
+        rows, columns = self._maps.roi
+        self._warped = np.empty(
+            (rows.stop - rows.start, columns.stop - columns.start, 3), dtype=np.uint8)
+
+    def apply(self, color: Frame, dst: Frame, timestamp: int) -> Frame:
+        """Writes the fused frame into dst, color is left untouched"""
+        np.copyto(dst, color)
+
+        thermal = self._receiver.get_nearest(timestamp, self._max_skew)
+        if thermal is None or self._maps.empty:
+            return dst
+
+        region = dst[self._maps.roi]
+
+        if self._overlay:
+            cv2.remap(thermal, self._maps.map1, self._maps.map2, cv2.INTER_LINEAR,
+                      region, cv2.BORDER_TRANSPARENT)
+            return dst
+
+        # Pixels outside of the thermal frame keep the color value, so they
+        # are unchanged by the blend
+        np.copyto(self._warped, region)
+        cv2.remap(thermal, self._maps.map1, self._maps.map2, cv2.INTER_LINEAR,
+                  self._warped, cv2.BORDER_TRANSPARENT)
+        cv2.addWeighted(region, 1.0 - self._alpha, self._warped, self._alpha, 0.0, region)
+
+        return dst
@@ -0,0 +1,170 @@
+import gi
+
+from config import LatencyProfile
+
+gi.require_version("Gst", "1.0")
+gi.require_version("GstVideo", "1.0")
+from gi.repository import Gst, GstVideo
+
+
+# v4l2src io-mode values. Memory mapped driver buffers are handed downstream
+# without a copy, the automatic mode may fall back to read() on some drivers
+IO_MODE_MMAP = 2
+
+# queue leaky values
+LEAKY_DOWNSTREAM = 2
+
+# Set on top of the webrtcsink defaults, keyed by encoder factory name.
+# Missing properties are skipped, they differ between plugin versions.
+LOW_LATENCY_ENCODER_PROPERTIES = {
+    "x264enc": {
+        "tune": "zerolatency",
+        "speed-preset": "ultrafast",
+        "bframes": 0,
+        "rc-lookahead": 0,
+        "sync-lookahead": 0,
+        "sliced-threads": True,
+    },
+    "vp8enc": {"deadline": 1, "lag-in-frames": 0},
+    "vp9enc": {"deadline": 1, "lag-in-frames": 0, "row-mt": True},
+    "nvh264enc": {"zerolatency": True, "rc-lookahead": 0, "bframes": 0},
+    "nvv4l2h264enc": {"maxperf-enable": True},
+    "vaapih264enc": {"max-bframes": 0},
+}
+
+# Encoders webrtcsink may pick
+WEBRTC_ENCODERS = (
+    "x264enc", "vp8enc", "vp9enc", "nvh264enc", "nvv4l2h264enc",
+    "vaapih264enc",
+)
+
+# Safe to initialize before camera workers are forked
+SOFTWARE_ENCODERS = ("x264enc", "vp8enc", "vp9enc")
+
+PREWARM_TIMEOUT = 5 * Gst.SECOND
+
+LOW_LATENCY_DECODER_PROPERTIES = {
+    # Frame threading holds back one frame per thread
+    "avdec_h264": {"thread-type": "slice"},
+}
+
+# A single frame, the older one is dropped when full
+LOW_LATENCY_QUEUE_PROPERTIES = {
+    "leaky": LEAKY_DOWNSTREAM,
+    "max-size-buffers": 1,
+    "max-size-bytes": 0,
+    "max-size-time": 0,
+}
+
+
+def set_property_if_exists(element, name, value) -> bool:
+    if element.find_property(name) is None:
+        return False
+
+    if isinstance(value, str):
+        # Parses enum and flags nicks, e.g. "zerolatency"
+        Gst.util_set_object_arg(element, name, value)
+    else:
+        element.set_property(name, value)
+
+    return True
+
+
+def get_factory_name(element) -> str:
+    factory = element.get_factory()
+    return factory.get_name() if factory is not None else ""
+
+
+def get_profile_properties(factory, profile: LatencyProfile) -> dict:
+    """
+    Properties the profile sets on elements of the factory, for building
+    elements from a compiled graph
+    """
+    if profile != LatencyProfile.Low:
+        return {}
+
+    name = factory.get_name()
+    if name == "v4l2src":
+        return {"io-mode": IO_MODE_MMAP}
+    if name == "queue":
+        return dict(LOW_LATENCY_QUEUE_PROPERTIES)
+    if name in LOW_LATENCY_DECODER_PROPERTIES:
+        return dict(LOW_LATENCY_DECODER_PROPERTIES[name])
+    if name in LOW_LATENCY_ENCODER_PROPERTIES:
+        return dict(LOW_LATENCY_ENCODER_PROPERTIES[name])
+
+    klass = factory.get_metadata(Gst.ELEMENT_METADATA_KLASS) or ""
+    if "Sink" in klass.split("/"):
+        return {"sync": False}
+
+    return {}
+
+
+def configure_encoder(encoder, profile: LatencyProfile):
+    if profile != LatencyProfile.Low:
+        return
+
+    properties = LOW_LATENCY_ENCODER_PROPERTIES.get(get_factory_name(encoder), {})
+    for name, value in properties.items():
+        set_property_if_exists(encoder, name, value)
+
+
+def configure_sink(sink, profile: LatencyProfile):
+    """Frames are rendered as soon as they arrive instead of at their timestamp"""
+    if profile == LatencyProfile.Low:
+        set_property_if_exists(sink, "sync", False)
+
+
+def negotiate_encoder(factory):
+    """Encodes a single test frame, which negotiates caps with the encoder"""
+    pipeline = Gst.Pipeline.new(None)
+    source = Gst.ElementFactory.make("videotestsrc", None)
+    convert = Gst.ElementFactory.make("videoconvert", None)
+    encoder = factory.create(None)
+    sink = Gst.ElementFactory.make("fakesink", None)
+
+    elements = [source, convert, encoder, sink]
+    if any(element is None for element in elements):
+        return
+
+    source.set_property("num-buffers", 1)
+    for element in elements:
+        pipeline.add(element)
+    for upstream, downstream in zip(elements, elements[1:]):
+        upstream.link(downstream)
+
+    pipeline.set_state(Gst.State.PLAYING)
+    pipeline.get_bus().timed_pop_filtered(
+        PREWARM_TIMEOUT, Gst.MessageType.EOS | Gst.MessageType.ERROR)
+    pipeline.set_state(Gst.State.NULL)
+
+
+def prewarm_encoders():
+    """
+    Loads the encoder plugins up front. Software encoders also encode a
+    frame, as their libraries initialize on caps negotiation rather than
+    on a state change, otherwise the first consumer of every process pays
+    for it. Hardware encoders are only loaded, their device contexts would
+    not survive the fork into camera workers.
+    """
+    for name in WEBRTC_ENCODERS:
+        factory = Gst.ElementFactory.find(name)
+        if factory is None:
+            continue
+
+        if name in SOFTWARE_ENCODERS:
+            negotiate_encoder(factory)
+        else:
+            factory.load()
+
+
+def force_keyframe(pad) -> bool:
+    """Requests a keyframe with parameter sets from upstream of the pad"""
+    event = GstVideo.video_event_new_upstream_force_key_unit(
+        Gst.CLOCK_TIME_NONE, True, 0)
+
+    # A source pad handles upstream events itself, a sink pad passes them
+    # to its peer
+    if pad.get_direction() == Gst.PadDirection.SINK:
+        return pad.push_event(event)
+    return pad.send_event(event)
@@ -0,0 +1,304 @@
+import itertools
+import threading
+from string import Template
+from typing import Dict, List, Optional, Tuple
+
+import gi
+
+from config import ElementConfig, LatencyProfile, PipelineGraph
+from latency import get_profile_properties
+
+gi.require_version("Gst", "1.0")
+from gi.repository import GObject, Gst
+
+
+MODE = "width=${width}, height=${height}, framerate=${framerate}/1"
+CAPTURE_MODE = "width=${capture_width}, height=${capture_height}, framerate=${capture_framerate}/1"
+
+V4L2_SOURCE = {"factory": "v4l2src", "name": "camera-source",
+               "properties": {"device": "${device}"}}
+CONVERT = {"factory": "videoconvert", "name": "convert"}
+QUEUE = {"factory": "queue", "name": "queue"}
+LOW_LATENCY_QUEUE = {"factory": "queue", "name": "queue",
+                     "profile": LatencyProfile.Low}
+
+
+def _caps(caps, name="filter"):
+    return {"factory": "capsfilter", "name": name, "properties": {"caps": caps}}
+
+
+# Every JPEG is a keyframe, stale ones are dropped before decoding
+MJPEG_CAPTURE = [V4L2_SOURCE, _caps("image/jpeg, " + CAPTURE_MODE), LOW_LATENCY_QUEUE]
+
+# JPEGs are dropped down to the output rate before decoding, evenly spaced
+# by their timestamps, videorate holds back one captured frame to pick them
+MJPEG_DECIMATED_CAPTURE = [
+    V4L2_SOURCE, _caps("image/jpeg, " + CAPTURE_MODE),
+    {"factory": "videorate", "name": "rate", "properties": {"drop-only": True}},
+    _caps("image/jpeg, framerate=${framerate}/1", "rate-filter"),
+    LOW_LATENCY_QUEUE,
+]
+
+JPEG_DECODER = {"factory": "jpegdec", "name": "decode"}
+
+# Decodes only the low frequency coefficients, at 1/2 or 1/4 of the size,
+# jpegdec has no such option
+SCALED_JPEG_DECODER = {"factory": "avdec_mjpeg", "name": "decode",
+                       "properties": {"lowres": "${lowres}"}}
+
+
+# Graphs of the camera classes, the Python code of a camera finds the
+# elements it connects to by name
+DEFAULT_GRAPHS: Dict[str, PipelineGraph] = {
+    "h264": PipelineGraph(
+        source=[V4L2_SOURCE, _caps("video/x-h264, " + MODE),
+                {"factory": "h264parse", "name": "parse"}],
+        # Compressed frames depend on each other, only decoded ones may be
+        # dropped
+        decode=[{"factory": "avdec_h264", "name": "decode"}, LOW_LATENCY_QUEUE],
+    ),
+    # Parameter sets with every IDR, a consumer can start decoding at any
+    # keyframe
+    "h264_passthrough": PipelineGraph(
+        source=[V4L2_SOURCE, _caps("video/x-h264, " + MODE),
+                {"factory": "h264parse", "name": "parse",
+                 "properties": {"config-interval": -1}}],
+    ),
+    "mjpeg": PipelineGraph(source=MJPEG_CAPTURE, decode=[JPEG_DECODER]),
+    "mjpeg_decimated": PipelineGraph(source=MJPEG_DECIMATED_CAPTURE,
+                                     decode=[JPEG_DECODER]),
+    "mjpeg_scaled": PipelineGraph(source=MJPEG_CAPTURE,
+                                  decode=[SCALED_JPEG_DECODER]),
+    "mjpeg_decimated_scaled": PipelineGraph(source=MJPEG_DECIMATED_CAPTURE,
+                                            decode=[SCALED_JPEG_DECODER]),
+    "raw": PipelineGraph(
+        source=[V4L2_SOURCE, _caps("video/x-raw, format=GRAY16_LE, " + MODE)],
+        decode=[CONVERT, QUEUE],
+    ),
+    # Tone mapped in Python from raw-sink to tone-mapped-source, videoconvert
+    # alone truncates to the top 8 bits without any gain
+    "raw_tone_mapped": PipelineGraph(
+        source=[{"factory": "appsrc", "name": "tone-mapped-source",
+                 "properties": {
+                     "caps": "video/x-raw, format=${output_format}, " + MODE,
+                     "format": "time",
+                     "is-live": True,
+                 }}],
+        decode=[CONVERT, QUEUE],
+        branches=[[
+            V4L2_SOURCE, _caps("video/x-raw, format=GRAY16_LE, " + MODE),
+            {"factory": "appsink", "name": "raw-sink", "properties": {
+                "emit-signals": True,
+                "max-buffers": 1,
+                "drop": True,
+                "sync": False,
+            }},
+        ]],
+    ),
+    "udp": PipelineGraph(
+        source=[{"factory": "udpsrc", "name": "udp-source",
+                 "properties": {"port": "${port}"}},
+                _caps("video/x-raw, format=${format}, " + MODE)],
+        decode=[CONVERT, QUEUE],
+    ),
+    "udp_out": PipelineGraph(
+        source=[V4L2_SOURCE, _caps("video/x-raw, " + MODE)],
+        decode=[CONVERT, LOW_LATENCY_QUEUE],
+        sink=[{"factory": "udpsink", "name": "udpsink",
+               "properties": {"host": "${host}", "port": "${port}"}}],
+    ),
+}
+
+_factories: Dict[str, Gst.ElementFactory] = {}
+_prototypes: Dict[str, Gst.Element] = {}
+_template_caps: Dict[Tuple[str, Gst.PadDirection], List[Gst.Caps]] = {}
+_plans: Dict[tuple, 'BuildPlan'] = {}
+_lock = threading.RLock()
+
+
+def find_factory(name: str) -> Gst.ElementFactory:
+    """Looked up in the registry once per process"""
+    with _lock:
+        factory = _factories.get(name)
+        if factory is None:
+            factory = Gst.ElementFactory.find(name)
+            if factory is None:
+                raise ValueError(f"GStreamer element {name} is not available")
+            _factories[name] = factory
+        return factory
+
+
+def get_prototype(factory: Gst.ElementFactory) -> Gst.Element:
+    """Element which is never used, its properties are looked up and parsed"""
+    with _lock:
+        name = factory.get_name()
+        prototype = _prototypes.get(name)
+        if prototype is None:
+            prototype = factory.create(None)
+            if prototype is None:
+                raise ValueError(f"GStreamer element {name} cannot be created")
+            _prototypes[name] = prototype
+        return prototype
+
+
+def get_template_caps(factory: Gst.ElementFactory, direction: Gst.PadDirection) -> List[Gst.Caps]:
+    with _lock:
+        key = (factory.get_name(), direction)
+        if key not in _template_caps:
+            _template_caps[key] = [
+                template.get_caps()
+                for template in factory.get_static_pad_templates()
+                if template.direction == direction
+            ]
+        return _template_caps[key]
+
+
+def substitute(value, parameters: dict):
+    if not isinstance(value, str):
+        return value
+
+    try:
+        return Template(value).substitute(parameters)
+    except KeyError as error:
+        raise ValueError(f"Unknown graph parameter {error} in {value}")
+
+
+def convert_value(prototype: Gst.Element, pspec, value):
+    """Parses strings for properties of other types, as gst-launch does"""
+    if not isinstance(value, str) or pspec.value_type == GObject.TYPE_STRING:
+        return value
+
+    if pspec.value_type == Gst.Caps.__gtype__:
+        caps = Gst.Caps.from_string(value)
+        if caps is None or caps.is_empty():
+            raise ValueError(f"Invalid caps {value}")
+        return caps
+
+    # Enum and flags nicks, numbers and booleans
+    Gst.util_set_object_arg(prototype, pspec.name, value)
+    return prototype.get_property(pspec.name)
+
+
+class ElementPlan:
+    """Resolved factory and converted properties of an element"""
+
+    def __init__(self, config: ElementConfig, parameters: dict, profile: LatencyProfile):
+        self.factory = find_factory(config.factory)
+        self.name = config.name
+        prototype = get_prototype(self.factory)
+
+        # Set by the graph are applied over the ones of the profile
+        properties = {
+            name: value
+            for name, value in get_profile_properties(self.factory, profile).items()
+            if prototype.find_property(name) is not None
+        }
+        properties.update(config.properties)
+
+        self.properties = []
+        self.caps: Optional[Gst.Caps] = None
+        for name, value in properties.items():
+            pspec = prototype.find_property(name)
+            if pspec is None:
+                raise ValueError(f"{self.describe()} has no property {name}")
+
+            value = convert_value(prototype, pspec, substitute(value, parameters))
+            self.properties.append((name, value))
+            if name == "caps" and isinstance(value, Gst.Caps):
+                self.caps = value
+
+        if config.factory == "appsrc" and self.caps is not None and not self.caps.is_fixed():
+            raise ValueError(f"Caps of {self.describe()} are not fixed: {self.caps.to_string()}")
+
+    def describe(self) -> str:
+        factory = self.factory.get_name()
+        return f"{factory} {self.name}" if self.name is not None else factory
+
+    def get_caps(self, direction: Gst.PadDirection) -> List[Gst.Caps]:
+        """Caps the element may produce or accept, its caps property included"""
+        templates = get_template_caps(self.factory, direction)
+        if self.caps is not None and templates:
+            return [self.caps]
+        return templates
+
+    def create(self) -> Gst.Element:
+        element = self.factory.create(self.name)
+        for name, value in self.properties:
+            element.set_property(name, value)
+        return element
+
+
+class GraphInstance:
+    """Elements of a plan, not yet added to a pipeline nor linked"""
+
+    def __init__(self, chain: List[Gst.Element], branches: List[List[Gst.Element]],
+                 sink: List[Gst.Element]):
+        self.chain = chain
+        self.branches = branches
+        self.sink = sink
+        self.elements = {
+            element.get_name(): element
+            for element in itertools.chain(chain, sink, *branches)
+        }
+
+
+class BuildPlan:
+    """
+    A validated graph with its parameters substituted, factories resolved,
+    property values parsed and caps checked against the pad templates of
+    the neighbouring elements. Creating the elements of a plan does no
+    lookups or parsing.
+    """
+
+    def __init__(self, graph: PipelineGraph, parameters: dict,
+                 profile: LatencyProfile = LatencyProfile.Default):
+        def compile_chain(configs):
+            return [ElementPlan(config, parameters, profile) for config in configs
+                    if config.profile is None or config.profile == profile]
+
+        self.chain = compile_chain(graph.source + graph.decode)
+        self.branches = [compile_chain(branch) for branch in graph.branches]
+        self.sink = compile_chain(graph.sink)
+
+        if not self.chain:
+            raise ValueError("Pipeline graph has no source")
+
+        names = [plan.name for plan in self.get_plans() if plan.name is not None]
+        duplicates = {name for name in names if names.count(name) > 1}
+        if duplicates:
+            raise ValueError(f"Duplicate element names {', '.join(sorted(duplicates))}")
+
+        self.check_links(self.chain + self.sink)
+        for branch in self.branches:
+            self.check_links(branch)
+
+    def get_plans(self):
+        return itertools.chain(self.chain, self.sink, *self.branches)
+
+    @staticmethod
+    def check_links(chain: List[ElementPlan]):
+        for upstream, downstream in zip(chain, chain[1:]):
+            produced = upstream.get_caps(Gst.PadDirection.SRC)
+            accepted = downstream.get_caps(Gst.PadDirection.SINK)
+            if not any(src.can_intersect(sink) for src in produced for sink in accepted):
+                raise ValueError(f"{upstream.describe()} cannot be linked to {downstream.describe()}")
+
+    def instantiate(self) -> GraphInstance:
+        return GraphInstance(
+            [plan.create() for plan in self.chain],
+            [[plan.create() for plan in branch] for branch in self.branches],
+            [plan.create() for plan in self.sink],
+        )
+
+
+def compile_graph(graph: PipelineGraph, parameters: dict,
+                  profile: LatencyProfile = LatencyProfile.Default) -> BuildPlan:
+    """Compiled once per process for the same graph, parameters and profile"""
+    key = (repr(graph), tuple(sorted(parameters.items())), profile)
+
+    with _lock:
+        plan = _plans.get(key)
+        if plan is None:
+            plan = BuildPlan(graph, parameters, profile)
+            _plans[key] = plan
+        return plan
@@ -2,74 +2,37 @@ import time
 from logging import Logger
 from typing import Optional
 
-import httpx
+import gi
 import psutil
 
+from admission import AdmissionController
 from config import load_signaller_config, load_pipelines_config, \
     load_turn_config, PipelinesConfig, SignallerConfig, TurnConfig
 from cameras import CamerasManager
+from latency import prewarm_encoders
+from turn import TurnCredentials
 from utils import create_logger
 
+gi.require_version("GLib", "2.0")
+from gi.repository import GLib
+
 logger: Logger = None
 config: PipelinesConfig = None
 config_signaller: SignallerConfig = None
 config_turn: TurnConfig = None
+manager: CamerasManager = None
 
 
 # region TURN
 
-def get_turn_settings() -> Optional[dict]:
-    logger.debug("Requesting TURN credentials")
-
-    headers = {
-        "Authorization": f"Bearer {config_turn.apiToken}",
-        "Content-Type": "application/json"
-    }
-    payload = {"ttl": 86400 * 90}
-
-    try:
-        with httpx.Client() as client:
-            response = client.post(
-                config_turn.url.format(
-                    TURN_TOKEN=config_turn.turnToken
-                ),
-                headers=headers,
-                json=payload
-            )
-            response.raise_for_status()
-            return response.json().get("iceServers", {})
-    except httpx.HTTPStatusError as e:
-        logger.warning("Cannot get TURN credentials: " + str(e))
-        return None
-    except httpx.RequestError as e:
-        logger.warning("Cannot get TURN credentials: " + str(e))
-        return None
-
-
-def parse_turn_settings(settings):
-    servers = []
-
-    if settings is None:
-        return None
-
-    username = settings.get("username", "")
-    credential = settings.get("credential", "")
-
-    for url in settings.get("urls", []):
-        if not url.startswith("turn:") and not url.startswith("turns:"):
-            continue
-
-        protocol = url[:url.index(":")]
-        host = url[url.index(":") + 1:]
-
-        servers.append(f"{protocol}://{username}:{credential}@{host}")
-
-    logger.debug(f"Parsed TURN settings. Available servers: {servers}")
-    return servers
+def on_turn_settings_updated(turn_settings: Optional[list]):
+    if manager is not None:
+        manager.update_turn_settings(turn_settings)
 
 
 # endregion
 
+
 # region Signaller
 
 def wait_for_signaller():
@@ -93,7 +56,7 @@ def wait_for_signaller():
 # endregion
 
 def main():
-    global logger, config, config_signaller, config_turn
+    global logger, config, config_signaller, config_turn, manager
 
     logger = create_logger("pipelines")
 
@@ -112,8 +75,10 @@ def main():
     # endregion
 
     # region Turn
-    turn_credentials = get_turn_settings()
-    turn_settings = parse_turn_settings(turn_credentials)
+    turn_credentials = None
+    if config_turn is not None:
+        turn_credentials = TurnCredentials(config_turn, logger)
+        turn_credentials.start(on_turn_settings_updated)
     # endregion
 
     # region Signaller
@@ -121,15 +86,37 @@ def main():
     # endregion
 
     # region Cameras
-    manager = CamerasManager(config, config_signaller, turn_settings)
+    turn_settings = None
+    if turn_credentials is not None:
+        turn_settings = turn_credentials.get_settings()
+
+    # Supervised cameras prewarm in their own worker processes
+    if config.supervisor is None:
+        prewarm_encoders()
+
+    admission = None
+    if config.admission is not None:
+        admission = AdmissionController(config.admission, logger)
+
+    manager = CamerasManager(config, config_signaller, turn_settings,
+                             admission)
+
+    if admission is not None:
+        if manager.supervisor is not None:
+            admission.get_stats = manager.supervisor.get_stats
+        admission.get_event_latency = manager.latency_metrics.summary
+        admission.start()
+
     manager.detect_cameras()
     manager.start_udp_cameras()
+    manager.start_fusion_cameras()
     manager.start_camera_monitoring()
     # endregion
 
-    # region Active waiting loop
-    while True:
-        time.sleep(1)
+    # region Main loop
+    # Dispatches bus watches and deferred calls of cameras running in this
+    # process
+    GLib.MainLoop().run()
     # endregion
 
 
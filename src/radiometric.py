@@ -0,0 +1,232 @@
+import asyncio
+import struct
+import threading
+import time
+import zlib
+from typing import Optional, Set, Tuple
+
+import numpy as np
+
+
+Frame = np.ndarray
+
+# Raw values are hundredths of a kelvin
+TEMPERATURE_OFFSET = 27315
+TEMPERATURE_SCALE = 100
+
+VERSION = 1
+FLAG_KEYFRAME = 1
+
+# magic, version, flags, width, height, sequence, timestamp,
+# temperature offset, temperature scale
+HEADER = struct.Struct("<4sBBHHIdHH")
+MAGIC = b"RADF"
+
+
+class RadiometricEncoder:
+    """
+    Encodes raw 16-bit frames as a zigzag delta from the previous frame with
+    low and high bytes split into separate planes, compressed with zlib.
+    Every `keyframe_interval` frames, or on request, the frame is encoded
+    as a delta from the left neighbour instead, which needs no history.
+
+    Sensor noise leaves few repeated strings for deflate to find, run length
+    matching compresses the delta planes better than the default strategy
+    in half the time.
+    """
+
+    def __init__(self, width: int, height: int, keyframe_interval: int = 30,
+                 level: int = 1):
+        self._width = width
+        self._height = height
+        self._keyframe_interval = keyframe_interval
+        self._level = level
+        self._sequence = 0
+        self._since_keyframe = 0
+        self._force_keyframe = True
+
+        self._previous = np.zeros((height, width), dtype=np.uint16)
+        self._delta = np.empty((height, width), dtype=np.uint16)
+        self._sign = np.empty((height, width), dtype=np.uint16)
+        self._planes = np.empty((2, height * width), dtype=np.uint8)
+
+    def force_keyframe(self):
+        self._force_keyframe = True
+
+    def encode(self, frame: Frame, timestamp: Optional[float] = None) -> Tuple[bytes, bool]:
+        keyframe = self._force_keyframe or self._since_keyframe >= self._keyframe_interval
+
+        if keyframe:
+            self._delta[:, 0] = frame[:, 0]
+            np.subtract(frame[:, 1:], frame[:, :-1], out=self._delta[:, 1:])
+            self._since_keyframe = 0
+            self._force_keyframe = False
+        else:
+            np.subtract(frame, self._previous, out=self._delta)
+
+        # Wrapping difference reinterpreted as int16, then zigzag encoded so
+        # that small negative deltas have a zero high byte as well
+        signed = self._delta.view(np.int16)
+        np.right_shift(signed, 15, out=self._sign.view(np.int16))
+        np.left_shift(self._delta, 1, out=self._delta)
+        np.bitwise_xor(self._delta, self._sign, out=self._delta)
+
+        np.copyto(self._previous, frame)
+        self._since_keyframe += 1
+
+        np.copyto(self._planes, self._delta.view(np.uint8).reshape(-1, 2).T)
+        compressor = zlib.compressobj(self._level, zlib.DEFLATED, 15, 9, zlib.Z_RLE)
+        payload = compressor.compress(self._planes) + compressor.flush()
+
+        header = HEADER.pack(
+            MAGIC, VERSION, FLAG_KEYFRAME if keyframe else 0,
+            self._width, self._height, self._sequence,
+            time.time() if timestamp is None else timestamp,
+            TEMPERATURE_OFFSET, TEMPERATURE_SCALE
+        )
+        self._sequence = (self._sequence + 1) & 0xFFFFFFFF
+
+        return header + payload, keyframe
+
+
+class RadiometricDecoder:
+    """Reference decoder of RadiometricEncoder messages"""
+
+    def __init__(self):
+        self._previous = None
+        self._sequence = None
+
+    def decode(self, message: bytes) -> Optional[Tuple[Frame, dict]]:
+        """Returns the raw frame and its header, None until a keyframe"""
+        magic, version, flags, width, height, sequence, timestamp, offset, scale = \
+            HEADER.unpack_from(message)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("Not a radiometric frame")
+
+        keyframe = bool(flags & FLAG_KEYFRAME)
+        if not keyframe and (self._previous is None or sequence != (self._sequence + 1) & 0xFFFFFFFF):
+            self._previous = None
+            return None
+
+        planes = np.frombuffer(zlib.decompress(message[HEADER.size:]), dtype=np.uint8)
+        values = planes.reshape(2, -1).T.copy().view(np.uint16).reshape(height, width)
+
+        delta = (values >> 1) ^ (0 - (values & 1)).astype(np.uint16)
+
+        if keyframe:
+            frame = np.cumsum(delta, axis=1, dtype=np.uint16)
+        else:
+            frame = self._previous + delta
+
+        self._previous = frame
+        self._sequence = sequence
+
+        return frame, {
+            "sequence": sequence,
+            "timestamp": timestamp,
+            "keyframe": keyframe,
+            "offset": offset,
+            "scale": scale,
+        }
+
+
+def to_temperature(frame: Frame, offset: int = TEMPERATURE_OFFSET,
+                   scale: int = TEMPERATURE_SCALE) -> np.ndarray:
+    """Converts raw values to degrees Celsius"""
+    return (frame.astype(np.float32) - offset) / scale
+
+
+class RadiometricServer:
+    """
+    Streams encoded raw frames to WebSocket clients. Frames are encoded once
+    for all clients, a client which falls behind drops frames and resumes
+    from the next keyframe, which is forced for it.
+
+    websockets is only imported when the server runs, the codec and the
+    constants of this module need numpy alone.
+    """
+
+    def __init__(self, host: str, port: int, width: int, height: int,
+                 keyframe_interval: int = 30, queue_size: int = 2):
+        self._host = host
+        self._port = port
+        self._queue_size = queue_size
+        self._encoder = RadiometricEncoder(width, height, keyframe_interval)
+        self._clients: Set['_Client'] = set()
+        self._loop = None
+
+    def start(self):
+        thread = threading.Thread(target=self.run, name="radiometric-server", daemon=True)
+        thread.start()
+
+    def run(self):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_until_complete(self._serve())
+
+    async def _serve(self):
+        import websockets
+
+        async with websockets.serve(self._handle, self._host, self._port):
+            await asyncio.Future()
+
+    def push(self, frame: Frame):
+        """Called from the capture thread, never blocks"""
+        if self._loop is not None and self._clients:
+            self._loop.call_soon_threadsafe(self._broadcast, frame, time.time())
+
+    def _broadcast(self, frame: Frame, timestamp: float):
+        if not self._clients:
+            return
+
+        if any(client.needs_keyframe for client in self._clients):
+            self._encoder.force_keyframe()
+
+        message, keyframe = self._encoder.encode(frame, timestamp)
+
+        for client in list(self._clients):
+            client.offer(message, keyframe)
+
+    async def _handle(self, websocket, *args):
+        import websockets
+
+        client = _Client(websocket, self._queue_size)
+        self._clients.add(client)
+
+        sender = asyncio.ensure_future(client.run())
+        try:
+            async for request in websocket:
+                if request == "keyframe":
+                    client.needs_keyframe = True
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            self._clients.discard(client)
+            sender.cancel()
+
+
+class _Client:
+
+    def __init__(self, websocket, queue_size: int):
+        self.websocket = websocket
+        self.queue = asyncio.Queue(queue_size)
+        self.needs_keyframe = True
+
+    def offer(self, message: bytes, keyframe: bool):
+        if self.needs_keyframe and not keyframe:
+            return
+
+        if self.queue.full():
+            # Deltas cannot be skipped, resync on the next keyframe
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.needs_keyframe = True
+            return
+
+        self.needs_keyframe = False
+        self.queue.put_nowait(message)
+
+    async def run(self):
+        while True:
+            message = await self.queue.get()
+            await self.websocket.send(message)
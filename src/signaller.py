@@ -1,8 +1,15 @@
 import os
 import signal
 import subprocess
+import threading
 
 from config import load_signaller_config, SignallerConfig
+from utils import create_logger
+
+
+def forward_output(stream, logger):
+    for line in stream:
+        logger.info(line.rstrip())
 
 
 def create_signaller(config: SignallerConfig):
@@ -27,14 +34,19 @@ def create_signaller(config: SignallerConfig):
             "--cert-password", config.certificatePassword
         ])
 
-    with open("signaller.log", "w") as handle:
-        process = subprocess.Popen(
-            [str(elem) for elem in command], 
-            env=env,
-            text=True,
-            stdout=handle,
-            stderr=handle
-        )
+    # Output goes through the size-rotated, non-blocking log instead of an
+    # unbounded file
+    logger = create_logger("signaller", console=False)
+
+    process = subprocess.Popen(
+        [str(elem) for elem in command],
+        env=env,
+        text=True,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT
+    )
+    threading.Thread(target=forward_output, args=(process.stdout, logger),
+                     daemon=True).start()
 
     try:
         process.wait()
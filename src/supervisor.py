@@ -0,0 +1,336 @@
+import multiprocessing
+import re
+import threading
+import time
+from typing import Dict, List, Optional
+
+import gi
+import psutil
+
+from config import SupervisorConfig
+from latency import prewarm_encoders
+from utils import create_logger
+
+gi.require_version("GLib", "2.0")
+from gi.repository import GLib
+
+
+# Workers are forked from a server which already imported GStreamer and the
+# camera classes, so spawning one does not pay for the imports again
+_context = multiprocessing.get_context("forkserver")
+_context.set_forkserver_preload(["cameras"])
+
+
+def get_log_file_name(kwargs: dict) -> str:
+    """Every worker writes and rotates its own log file, named after its camera"""
+    camera = str(kwargs.get("name") or kwargs.get("path"))
+    return "Cameras." + re.sub(r"[^\w.-]+", "_", camera)
+
+
+def run_camera(camera_class, kwargs: dict, connection, heartbeat_interval):
+    """Entry point of a worker process, runs a single camera pipeline"""
+    logger = create_logger("Cameras", file_name=get_log_file_name(kwargs))
+
+    # After the fork, the forkserver itself never runs a pipeline. In the
+    # background, heartbeats must not wait for it
+    threading.Thread(target=prewarm_encoders, name="prewarm",
+                     daemon=True).start()
+
+    camera = camera_class(logger=logger, **kwargs)
+    loop = GLib.MainLoop()
+
+    # Consumer changes are reported from streaming threads
+    send_lock = threading.Lock()
+
+    def send(message, *arguments):
+        with send_lock:
+            connection.send((message, time.time()) + arguments)
+
+    def heartbeat():
+        send("heartbeat")
+        return True
+
+    camera.on_consumers_changed = \
+        lambda camera, *counts: send("consumers", *counts)
+
+    def on_command(*args):
+        command, arguments = connection.recv()
+
+        if command == "stop":
+            camera.stop_pipeline()
+            loop.quit()
+            return False
+
+        handler = getattr(camera, command, None)
+        if handler is None:
+            logger.warning(f"[{camera.path}]: unknown command {command}")
+        else:
+            handler(*arguments)
+
+        return True
+
+    # Heartbeats are sent from the main loop, so they also stop when the
+    # loop is blocked by a deadlocked pipeline
+    GLib.timeout_add(int(heartbeat_interval * 1000), heartbeat)
+    GLib.io_add_watch(connection.fileno(), GLib.PRIORITY_DEFAULT,
+                      GLib.IO_IN, on_command)
+
+    send("live")
+    loop.run()
+
+
+class CameraProcess:
+    """Proxy of a camera running in its own worker process"""
+
+    def __init__(self, supervisor: 'Supervisor', camera_class, path: str,
+                 kwargs: dict):
+        self.supervisor = supervisor
+        self.camera_class = camera_class
+        self.kwargs = kwargs
+
+        self.path = path
+        self.id = kwargs.get("id")
+        self.name = kwargs["name"]
+        self.width = kwargs["width"]
+        self.height = kwargs["height"]
+        self.framerate = kwargs["framerate"]
+        self.passthrough = kwargs.get("passthrough", False)
+
+        self.process = None
+        self.handle = None
+        self.connection = None
+        self.send_lock = threading.Lock()
+        self.stopping = False
+        self.last_heartbeat = 0.0
+        self.started_at = 0.0
+        self.failures = 0
+        self.restart_at: Optional[float] = None
+        self.stats = {}
+
+        self.admission_limits = None
+        self.on_consumers_changed = None
+
+    def start(self):
+        connection, child_connection = _context.Pipe()
+
+        self.connection = connection
+        self.process = _context.Process(
+            target=run_camera,
+            args=(self.camera_class, self.kwargs, child_connection,
+                  self.supervisor.config.heartbeat_interval),
+            name=f"camera-{self.name}",
+            daemon=True,
+        )
+        self.process.start()
+        child_connection.close()
+
+        self.started_at = time.monotonic()
+        self.last_heartbeat = self.started_at
+        self.restart_at = None
+
+        # A restarted worker starts without consumers and limits
+        if self.admission_limits is not None:
+            self.send("set_admission_limits", *self.admission_limits)
+        if self.on_consumers_changed is not None:
+            self.on_consumers_changed(self, 0, 0, 0)
+
+    def send(self, command: str, *arguments):
+        try:
+            with self.send_lock:
+                self.connection.send((command, arguments))
+        except (OSError, ValueError) as e:
+            self.supervisor.logger.warning(
+                f"[{self.path}]: cannot send {command} to worker: {e}")
+
+    def receive(self, timeout: float = 0.0) -> Optional[str]:
+        """Consumes pending messages, returns the type of the last one"""
+        message = None
+
+        try:
+            while self.connection.poll(timeout):
+                message, timestamp, *arguments = self.connection.recv()
+                self.last_heartbeat = time.monotonic()
+                timeout = 0.0
+
+                if message == "consumers" \
+                        and self.on_consumers_changed is not None:
+                    self.on_consumers_changed(self, *arguments)
+        except (EOFError, OSError):
+            pass
+
+        return message
+
+    def wait_live(self, timeout: float) -> bool:
+        deadline = time.monotonic() + timeout
+
+        while time.monotonic() < deadline:
+            if self.receive(deadline - time.monotonic()) == "live":
+                return True
+            if not self.process.is_alive():
+                return False
+
+        return False
+
+    def update_turn_settings(self, turn_settings):
+        self.kwargs["turn_settings"] = turn_settings
+        if self.process is not None:
+            self.send("update_turn_settings", turn_settings)
+
+    def set_admission_limits(self, max_full, max_total, divisor):
+        self.admission_limits = (max_full, max_total, divisor)
+        if self.process is not None:
+            self.send("set_admission_limits", max_full, max_total, divisor)
+
+    def set_tap_consumer(self, name, active):
+        # A restarted worker starts with the current ones
+        tap_consumers = set(self.kwargs.get("tap_consumers", ()))
+        if active:
+            tap_consumers.add(name)
+        else:
+            tap_consumers.discard(name)
+        self.kwargs["tap_consumers"] = sorted(tap_consumers)
+
+        if self.process is not None:
+            self.send("set_tap_consumer", name, active)
+
+    def kill(self):
+        process, self.process = self.process, None
+        if process is None:
+            return
+
+        process.kill()
+        process.join()
+        self.connection.close()
+
+    def stop_pipeline(self):
+        self.stopping = True
+        self.supervisor.unregister(self)
+
+        process = self.process
+        if process is None:
+            return
+
+        self.send("stop")
+        process.join(self.supervisor.config.heartbeat_timeout)
+        if process.is_alive():
+            self.supervisor.logger.warning(
+                f"[{self.path}]: worker did not stop, killing")
+        self.kill()
+
+
+class Supervisor:
+    """
+    Runs every camera pipeline in its own worker process, restarts workers
+    which crashed or stopped sending heartbeats and accounts their resources
+    """
+
+    def __init__(self, config: SupervisorConfig):
+        self.config = config
+        self.logger = create_logger("Supervisor")
+        self.processes: List[CameraProcess] = []
+        self.lock = threading.Lock()
+
+        self.thread = threading.Thread(target=self.run, name="supervisor",
+                                       daemon=True)
+        self.thread.start()
+
+    def spawn(self, camera_class, path: str, kwargs: dict) -> CameraProcess:
+        camera = CameraProcess(self, camera_class, path, kwargs)
+        camera.start()
+
+        # Wait before registering, the supervisor thread is the only reader
+        # of the connection afterwards
+        if not camera.wait_live(self.config.start_timeout):
+            self.logger.warning(
+                f"[{camera.path}]: worker not live after"
+                f" {self.config.start_timeout} s")
+
+        with self.lock:
+            self.processes.append(camera)
+
+        return camera
+
+    def unregister(self, camera: CameraProcess):
+        with self.lock:
+            if camera in self.processes:
+                self.processes.remove(camera)
+
+    def get_stats(self) -> Dict[str, dict]:
+        with self.lock:
+            return {camera.name: dict(camera.stats)
+                    for camera in self.processes}
+
+    def run(self):
+        last_report = time.monotonic()
+
+        while True:
+            time.sleep(self.config.heartbeat_interval)
+
+            with self.lock:
+                processes = list(self.processes)
+
+            for camera in processes:
+                if camera.stopping:
+                    continue
+
+                try:
+                    self.check(camera)
+                except Exception as e:
+                    self.logger.exception(
+                        f"[{camera.path}]: supervision failed: {e}")
+
+            if time.monotonic() - last_report >= self.config.report_interval:
+                last_report = time.monotonic()
+                for name, stats in self.get_stats().items():
+                    self.logger.info(
+                        f"[{name}]: pid={stats.get('pid')}"
+                        f" cpu={stats.get('cpu', 0.0):.1f}%"
+                        f" rss={stats.get('rss', 0) / 1024 / 1024:.1f} MB"
+                        f" restarts={stats.get('restarts', 0)}")
+
+    def check(self, camera: CameraProcess):
+        now = time.monotonic()
+
+        if camera.process is None:
+            if camera.restart_at is not None and now >= camera.restart_at:
+                self.logger.info(f"[{camera.path}]: restarting worker")
+                camera.start()
+            return
+
+        camera.receive()
+
+        if not camera.process.is_alive():
+            reason = f"worker exited with code {camera.process.exitcode}"
+        elif now - camera.last_heartbeat > self.config.heartbeat_timeout:
+            reason = "worker stopped sending heartbeats"
+        else:
+            self.account(camera)
+
+            # Reset backoff once the worker has been stable for a while
+            if now - camera.started_at > self.config.restart_backoff_max:
+                camera.failures = 0
+            return
+
+        camera.kill()
+
+        delay = min(self.config.restart_backoff * 2 ** camera.failures,
+                    self.config.restart_backoff_max)
+        camera.failures += 1
+        camera.restart_at = now + delay
+        camera.stats["restarts"] = camera.stats.get("restarts", 0) + 1
+
+        self.logger.warning(
+            f"[{camera.path}]: {reason}, restarting in {delay:.1f} s")
+
+    def account(self, camera: CameraProcess):
+        pid = camera.process.pid
+
+        try:
+            if camera.handle is None or camera.handle.pid != pid:
+                camera.handle = psutil.Process(pid)
+                camera.stats["pid"] = pid
+
+            camera.stats["cpu"] = camera.handle.cpu_percent(interval=None)
+            camera.stats["rss"] = camera.handle.memory_info().rss
+        except psutil.Error:
+            pass
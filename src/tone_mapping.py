@@ -0,0 +1,115 @@
+from typing import Optional, Tuple
+
+import cv2
+import numpy as np
+
+
+Frame = np.ndarray
+
+# 16-bit values are binned by their top 12 bits
+HISTOGRAM_SHIFT = 4
+HISTOGRAM_BINS = 65536 >> HISTOGRAM_SHIFT
+
+
+def get_colormap(name: Optional[str]) -> Optional[int]:
+    """OpenCV colormap by name, e.g. "inferno", None for grayscale"""
+    if name is None:
+        return None
+
+    colormap = getattr(cv2, f"COLORMAP_{name.upper()}", None)
+    if colormap is None:
+        raise ValueError(f"Unknown colormap {name}")
+
+    return colormap
+
+
+class ToneMapper:
+    """
+    Maps 16-bit frames to 8-bit gray or BGR frames. The range between the
+    low and high percentiles of a running histogram is stretched over the
+    output, values outside of it are clipped.
+
+    The gain is applied with two saturating OpenCV passes, which are several
+    times faster than a lookup in a 65536 entry table, the colormap is a
+    256 entry lookup on the result.
+    """
+
+    def __init__(self, low_percentile: float = 1.0,
+                 high_percentile: float = 99.0, smoothing: float = 0.1,
+                 min_range: int = 256, colormap: Optional[int] = None,
+                 sample_step: int = 4):
+        self._low_percentile = low_percentile / 100
+        self._high_percentile = high_percentile / 100
+        self._smoothing = smoothing
+        self._min_range = min_range
+        self._sample_step = sample_step
+
+        self._histogram = None
+        self._bins = np.empty(HISTOGRAM_BINS, dtype=np.float32)
+        self._cumulative = np.empty(HISTOGRAM_BINS, dtype=np.float32)
+        self._range: Optional[Tuple[int, int]] = None
+
+        self._shifted = None
+        self._gray = None
+
+        # Built once, applyColorMap rebuilds a named colormap on every call
+        self._colors = None
+        if colormap is not None:
+            gray = np.arange(256, dtype=np.uint8).reshape(-1, 1)
+            self._colors = cv2.applyColorMap(gray, colormap)
+
+    @property
+    def channels(self) -> int:
+        return 1 if self._colors is None else 3
+
+    @property
+    def range(self) -> Optional[Tuple[int, int]]:
+        return self._range
+
+    def update(self, frame: Frame) -> Tuple[int, int]:
+        """Adds a subsampled frame to the running histogram"""
+        sample = frame[::self._sample_step, ::self._sample_step]
+        counts = np.bincount((sample >> HISTOGRAM_SHIFT).ravel(),
+                             minlength=HISTOGRAM_BINS)
+        np.divide(counts, sample.size, out=self._bins, casting="unsafe")
+
+        if self._histogram is None:
+            self._histogram = self._bins.copy()
+        else:
+            self._histogram *= 1 - self._smoothing
+            self._histogram += self._smoothing * self._bins
+
+        np.cumsum(self._histogram, out=self._cumulative)
+        total = self._cumulative[-1]
+
+        low = int(np.searchsorted(self._cumulative, total * self._low_percentile))
+        high = int(np.searchsorted(self._cumulative, total * self._high_percentile))
+        low, high = low << HISTOGRAM_SHIFT, (high + 1) << HISTOGRAM_SHIFT
+
+        # Flat scenes would otherwise stretch sensor noise over the output
+        if high - low < self._min_range:
+            center = (low + high) // 2
+            low = max(0, center - self._min_range // 2)
+            high = min(65536, low + self._min_range)
+
+        self._range = (low, high)
+        return self._range
+
+    def apply(self, frame: Frame, dst: Frame) -> Frame:
+        """Writes the mapped frame into dst, (h, w) or (h, w, 3) uint8"""
+        low, high = self.update(frame)
+
+        if self._shifted is None or self._shifted.shape != frame.shape:
+            self._shifted = np.empty(frame.shape, dtype=np.uint16)
+            self._gray = np.empty(frame.shape, dtype=np.uint8)
+
+        gray = dst if self._colors is None else self._gray
+
+        # Saturates below the range at 0 and above it at 255
+        cv2.subtract(frame, low, dst=self._shifted)
+        cv2.convertScaleAbs(self._shifted, gray, 255.0 / (high - low))
+
+        if self._colors is not None:
+            cv2.applyColorMap(gray, self._colors, dst=dst)
+
+        return dst
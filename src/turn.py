@@ -0,0 +1,191 @@
+import json
+import os
+import threading
+import time
+from logging import Logger
+from typing import Callable, Optional
+
+import httpx
+
+from config import TurnConfig
+
+
+def request_turn_credentials(config: TurnConfig,
+                             logger: Logger) -> Optional[dict]:
+    logger.debug("Requesting TURN credentials")
+
+    headers = {
+        "Authorization": f"Bearer {config.apiToken}",
+        "Content-Type": "application/json"
+    }
+    payload = {"ttl": config.ttl}
+
+    try:
+        with httpx.Client(timeout=config.timeout) as client:
+            response = client.post(
+                config.url.format(
+                    TURN_TOKEN=config.turnToken
+                ),
+                headers=headers,
+                json=payload
+            )
+            response.raise_for_status()
+            return response.json()
+    except httpx.HTTPStatusError as e:
+        logger.warning("Cannot get TURN credentials: " + str(e))
+        return None
+    except httpx.RequestError as e:
+        logger.warning("Cannot get TURN credentials: " + str(e))
+        return None
+
+
+def get_lifetime(response: dict, requested_at: float, ttl: float) -> float:
+    """
+    Seconds the credentials are valid from the request, as returned by the
+    server if it does, otherwise the requested TTL
+    """
+    ice_servers = response.get("iceServers")
+    sources = [response, ice_servers if isinstance(ice_servers, dict) else {}]
+
+    for source in sources:
+        for key in ("expiresAt", "expires_at", "expires"):
+            if isinstance(source.get(key), (int, float)):
+                return source[key] - requested_at
+        if isinstance(source.get("ttl"), (int, float)):
+            return float(source["ttl"])
+
+    return float(ttl)
+
+
+def parse_turn_settings(settings, logger: Logger):
+    servers = []
+
+    if settings is None:
+        return None
+
+    username = settings.get("username", "")
+    credential = settings.get("credential", "")
+
+    for url in settings.get("urls", []):
+        if not url.startswith("turn:") and not url.startswith("turns:"):
+            continue
+
+        protocol = url[:url.index(":")]
+        host = url[url.index(":") + 1:]
+
+        servers.append(f"{protocol}://{username}:{credential}@{host}")
+
+    logger.debug(f"Parsed TURN settings. Available servers: {servers}")
+    return servers
+
+
+class TurnCredentials:
+    """
+    TURN credentials cached on disk together with their expiry. Cached
+    credentials are available immediately, fresh ones are requested in the
+    background well before the current ones expire.
+    """
+
+    def __init__(self, config: TurnConfig, logger: Logger):
+        self.config = config
+        self.logger = logger
+
+        self.credentials: Optional[dict] = None
+        self.expires_at = 0.0
+        # Lifetime of the current credentials, refreshes are scheduled by it
+        self.ttl = float(config.ttl)
+        self.lock = threading.Lock()
+
+        self.load_cache()
+
+    def get_settings(self) -> Optional[list]:
+        with self.lock:
+            if self.credentials is None or time.time() >= self.expires_at:
+                return None
+            return parse_turn_settings(self.credentials, self.logger)
+
+    def load_cache(self):
+        try:
+            with open(self.config.cachePath, "r") as handle:
+                data = json.load(handle)
+
+            credentials = data["iceServers"]
+            expires_at = float(data["expiresAt"])
+            ttl = float(data.get("ttl", self.config.ttl))
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            self.logger.debug(f"No cached TURN credentials: {e}")
+            return
+
+        if expires_at <= time.time():
+            self.logger.debug("Cached TURN credentials expired")
+            return
+
+        with self.lock:
+            self.credentials = credentials
+            self.expires_at = expires_at
+            self.ttl = ttl
+
+        self.logger.debug("Loaded cached TURN credentials")
+
+    def save_cache(self):
+        with self.lock:
+            data = {"iceServers": self.credentials, "expiresAt": self.expires_at,
+                    "ttl": self.ttl}
+
+        try:
+            # Only readable by us, the file holds the TURN credential
+            fd = os.open(self.config.cachePath,
+                         os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            os.fchmod(fd, 0o600)
+            with os.fdopen(fd, "w") as handle:
+                json.dump(data, handle)
+        except OSError as e:
+            self.logger.warning(f"Cannot cache TURN credentials: {e}")
+
+    def refresh(self) -> bool:
+        requested_at = time.time()
+        response = request_turn_credentials(self.config, self.logger)
+
+        if response is None:
+            return False
+
+        ttl = get_lifetime(response, requested_at, self.config.ttl)
+        if ttl <= 0:
+            self.logger.warning("TURN credentials returned already expired")
+            return False
+
+        with self.lock:
+            self.credentials = response.get("iceServers", {})
+            self.expires_at = requested_at + ttl
+            self.ttl = ttl
+
+        self.save_cache()
+        return True
+
+    def get_refresh_delay(self) -> float:
+        with self.lock:
+            remaining = self.expires_at - time.time()
+            ttl = self.ttl
+
+        return max(0.0, remaining - ttl * (1 - self.config.refreshRatio))
+
+    def start(self, on_update: Callable[[Optional[list]], None]):
+        thread = threading.Thread(target=self.run, args=(on_update,),
+                                  name="turn-refresh", daemon=True)
+        thread.start()
+
+    def run(self, on_update: Callable[[Optional[list]], None]):
+        retry_delay = self.config.retryDelay
+
+        while True:
+            time.sleep(self.get_refresh_delay())
+
+            if self.refresh():
+                self.logger.info("TURN credentials refreshed")
+                retry_delay = self.config.retryDelay
+                on_update(self.get_settings())
+            else:
+                self.logger.warning(
+                    f"Retrying TURN credentials in {retry_delay:.0f} s")
+                time.sleep(retry_delay)
+                retry_delay = min(retry_delay * 2, self.config.retryDelayMax)
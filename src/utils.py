@@ -1,19 +1,146 @@
+import atexit
 import logging
+import logging.handlers
+import queue
+import threading
+import time
+from collections import deque
+from typing import Dict, Hashable, Optional, Tuple
 
 
-def create_logger(name: str) -> logging.Logger:
+LOG_MAX_BYTES = 5 * 1024 * 1024
+LOG_BACKUP_COUNT = 3
+LOG_RING_SIZE = 500
+
+_ring_buffers: Dict[str, 'RingBufferHandler'] = {}
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Limits records carrying a `rate_limit_key` extra attribute to `burst`
+    records per `interval` seconds for every key. The number of suppressed
+    records is reported with the first record let through afterwards.
+    """
+
+    def __init__(self, burst: int = 5, interval: float = 10.0):
+        super().__init__()
+        self.burst = burst
+        self.interval = interval
+        self.windows: Dict[Hashable, Tuple[float, int, int]] = {}
+        self.lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        key = getattr(record, "rate_limit_key", None)
+        if key is None:
+            return True
+
+        now = time.monotonic()
+        with self.lock:
+            started, count, suppressed = self.windows.get(key, (now, 0, 0))
+            if now - started >= self.interval:
+                started, count = now, 0
+
+            if count >= self.burst:
+                self.windows[key] = (started, count, suppressed + 1)
+                return False
+
+            self.windows[key] = (started, count + 1, 0)
+
+        if suppressed > 0:
+            record.msg = f"{record.msg} (suppressed {suppressed} similar messages)"
+
+        return True
+
+
+class RingBufferHandler(logging.Handler):
+    """
+    Keeps the most recent records in memory and dumps them to a file
+    whenever a record of `dump_level` or above is handled
+    """
+
+    def __init__(self, filename: str, capacity: int = LOG_RING_SIZE,
+                 dump_level: int = logging.ERROR):
+        super().__init__()
+        self.filename = filename
+        self.records = deque(maxlen=capacity)
+        self.dump_level = dump_level
+
+    def emit(self, record: logging.LogRecord):
+        self.records.append(record)
+
+        if record.levelno >= self.dump_level:
+            self.dump()
+
+    def dump(self):
+        with self.lock:
+            self.write(list(self.records))
+
+    def write(self, records):
+        try:
+            with open(self.filename, "w") as handle:
+                for record in records:
+                    handle.write(self.format(record) + "\n")
+        except OSError:
+            if records:
+                self.handleError(records[-1])
+
+
+def create_logger(name: str, console: bool = True,
+                  file_name: Optional[str] = None) -> logging.Logger:
+    """
+    Creates a logger whose records are written by a background thread, so
+    that logging never blocks the caller on disk or console I/O.
+
+    Log files are named after `file_name`, the logger name by default. A
+    file must only be written and rotated by a single process.
+    """
+    logger = logging.getLogger(name)
+    if logger.handlers:
+        return logger
+
     log_format = logging.Formatter(
         "%(asctime)s [%(levelname)s]: %(message)s")
 
-    logger = logging.getLogger(name)
     logger.setLevel(logging.DEBUG)
 
-    console_handler = logging.StreamHandler()
-    console_handler.setFormatter(log_format)
-    logger.addHandler(console_handler)
+    handlers = []
+
+    if console:
+        console_handler = logging.StreamHandler()
+        console_handler.setFormatter(log_format)
+        handlers.append(console_handler)
 
-    file_handler = logging.FileHandler(f"{name}.log")
+    if file_name is None:
+        file_name = name
+
+    file_handler = logging.handlers.RotatingFileHandler(
+        f"{file_name}.log", maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT)
     file_handler.setFormatter(log_format)
-    logger.addHandler(file_handler)
+    handlers.append(file_handler)
+
+    ring_handler = RingBufferHandler(f"{file_name}.recent.log")
+    ring_handler.setFormatter(log_format)
+    handlers.append(ring_handler)
+    _ring_buffers[name] = ring_handler
+
+    records = queue.SimpleQueue()
+    queue_handler = logging.handlers.QueueHandler(records)
+    queue_handler.addFilter(RateLimitFilter())
+    logger.addHandler(queue_handler)
+    logger.propagate = False
+
+    listener = logging.handlers.QueueListener(records, *handlers)
+    listener.start()
+    atexit.register(listener.stop)
+
+    return logger
+
+
+def dump_recent_events(name: str) -> Optional[str]:
+    """Writes recent records of a logger to disk, returns the file name"""
+    ring_handler = _ring_buffers.get(name)
+    if ring_handler is None:
+        return None
 
-    return logger
\ No newline at end of file
+    ring_handler.dump()
+    return ring_handler.filename
@@ -0,0 +1,162 @@
+import json
+import logging
+import math
+
+import pytest
+
+from admission import ADMITTED, DEGRADED, REJECTED, AdmissionController, \
+    count_fitting, decide_admission, min_limit
+from config import AdmissionConfig, AdmissionPolicy, CameraAdmissionConfig
+
+
+class FakeCamera:
+    """The attributes and methods AdmissionController uses"""
+
+    def __init__(self, name, width=1280, height=720, framerate=25,
+                 passthrough=False):
+        self.name = name
+        self.width = width
+        self.height = height
+        self.framerate = framerate
+        self.passthrough = passthrough
+        self.on_consumers_changed = None
+        self.limits = None
+
+    def set_admission_limits(self, max_full, max_total, divisor):
+        self.limits = (max_full, max_total, divisor)
+
+
+def make_controller(**config):
+    return AdmissionController(AdmissionConfig(**config), logging.getLogger("test"))
+
+
+# 1280x720 at 25 fps
+COST = 23.04
+
+
+def test_count_fitting():
+    assert count_fitting(math.inf, COST) is None
+    assert count_fitting(100.0, 0.0) is None
+    assert count_fitting(100.0, COST) == 4
+    assert count_fitting(-5.0, COST) == 0
+
+
+def test_min_limit():
+    assert min_limit(None, None) is None
+    assert min_limit(3, None) == 3
+    assert min_limit(None, 2) == 2
+    assert min_limit(3, 2) == 2
+
+
+@pytest.mark.parametrize("limits, consumers, degraded, expected", [
+    (None, 100, 0, ADMITTED),
+    ((None, None, 2), 100, 0, ADMITTED),
+    ((2, 4, 2), 1, 0, ADMITTED),
+    ((2, 4, 2), 2, 0, DEGRADED),
+    ((2, 4, 2), 3, 1, DEGRADED),
+    ((2, 4, 2), 4, 2, REJECTED),
+    ((0, 0, 2), 0, 0, REJECTED),
+])
+def test_decide_admission(limits, consumers, degraded, expected):
+    assert decide_admission(limits, consumers, degraded) == expected
+
+
+def test_unlimited_without_budget():
+    controller = make_controller()
+    camera = FakeCamera("front")
+    controller.register(camera)
+
+    assert camera.limits == (None, None, 2)
+    assert camera.on_consumers_changed == controller.on_consumers_changed
+
+
+def test_encode_rate_budget_degrades_then_rejects():
+    controller = make_controller(max_encode_rate=COST * 2.6)
+    camera = FakeCamera("front")
+    controller.register(camera)
+
+    # Two full quality consumers fit, then one more at half the frames
+    assert camera.limits == (2, 5, 2)
+
+    controller.on_consumers_changed(camera, 2, 0, 0)
+    assert camera.limits == (2, 3, 2)
+
+    controller.on_consumers_changed(camera, 2, 1, 0)
+    assert camera.limits == (2, 3, 2)
+    assert decide_admission(camera.limits, 3, 1) == REJECTED
+
+
+def test_reject_policy_has_no_degraded_consumers():
+    controller = make_controller(max_encode_rate=COST * 2.6,
+                                 policy=AdmissionPolicy.Reject)
+    camera = FakeCamera("front")
+    controller.register(camera)
+
+    assert camera.limits == (2, 2, 2)
+
+
+def test_budget_is_shared_between_cameras():
+    controller = make_controller(max_encode_rate=COST * 3)
+    front, back = FakeCamera("front"), FakeCamera("back")
+    controller.register(front)
+    controller.register(back)
+
+    controller.on_consumers_changed(front, 2, 0, 0)
+    assert back.limits[0] == 1
+
+    controller.unregister(front)
+    assert back.limits[0] == 3
+    assert front.on_consumers_changed is None
+
+
+def test_camera_consumer_limit():
+    controller = make_controller(
+        max_consumers=5, cameras={"front": CameraAdmissionConfig(max_consumers=1)})
+    front, back = FakeCamera("front"), FakeCamera("back")
+    controller.register(front)
+    controller.register(back)
+
+    assert front.limits == (1, 1, 2)
+    assert back.limits == (5, 5, 2)
+
+
+def test_cpu_overload_admits_only_degraded():
+    controller = make_controller(max_encode_rate=COST * 4, max_cpu=80)
+    camera = FakeCamera("front")
+    controller.register(camera)
+
+    controller.cpu = 95.0
+    controller.update()
+    assert camera.limits == (0, 8, 2)
+
+
+def test_passthrough_costs_nothing():
+    controller = make_controller(max_encode_rate=1.0)
+    camera = FakeCamera("front", passthrough=True)
+    controller.register(camera)
+
+    assert camera.limits == (None, None, 2)
+
+
+def test_utilization():
+    controller = make_controller(max_encode_rate=COST * 4)
+    camera = FakeCamera("front")
+    controller.register(camera)
+    controller.on_consumers_changed(camera, 1, 2, 3)
+
+    utilization = controller.get_utilization()
+    assert utilization["encode_rate"] == pytest.approx(COST * 2)
+    assert utilization["utilization"] == pytest.approx(0.5)
+    assert utilization["cameras"]["front"]["rejected"] == 3
+
+
+def test_status_has_event_latency(tmp_path):
+    status_path = tmp_path / "status.json"
+    controller = make_controller(status_path=str(status_path))
+    assert controller.get_utilization()["event_latency"] is None
+
+    controller.get_event_latency = lambda: {"usb-1": {"median": 0.2}}
+    controller.report()
+
+    status = json.loads(status_path.read_text())
+    assert status["event_latency"] == {"usb-1": {"median": 0.2}}
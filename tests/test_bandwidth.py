@@ -0,0 +1,97 @@
+import pytest
+
+from bandwidth import BandwidthRequest, estimate_bandwidth, get_controller, \
+    plan_bandwidth
+
+
+@pytest.mark.parametrize("id_path, controller", [
+    ("pci-0000:04:00.4-usb-0:1.3:1.0", "pci-0000:04:00.4"),
+    ("pci-0000:04:00.4-usbv2-0:1.3:1.0", "pci-0000:04:00.4"),
+    ("pci-0000:00:14.0-usbv3-0:2:1.0", "pci-0000:00:14.0"),
+    ("platform-fe801000.csi", None),
+    (None, None),
+])
+def test_get_controller(id_path, controller):
+    assert get_controller(id_path) == controller
+
+
+def test_estimate_bandwidth():
+    assert estimate_bandwidth("raw", (640, 480, 30)) == pytest.approx(18.432)
+    assert estimate_bandwidth("mjpeg", (1280, 720, 30)) == pytest.approx(13.824)
+
+
+def test_everything_fits():
+    requests = [
+        BandwidthRequest("a", "mjpeg", [(1280, 720, 30), (640, 480, 30)]),
+        BandwidthRequest("b", "mjpeg", [(1280, 720, 30), (640, 480, 30)]),
+    ]
+
+    assert plan_bandwidth(requests, 30.0) == {"a": (1280, 720, 30), "b": (1280, 720, 30)}
+
+
+def test_lowest_priority_is_degraded_first():
+    requests = [
+        BandwidthRequest("high", "mjpeg", [(1280, 720, 30), (640, 480, 30)], priority=1),
+        BandwidthRequest("low", "mjpeg", [(1280, 720, 30), (640, 480, 30), (320, 240, 30)]),
+    ]
+
+    # 13.8 + 13.8 MB/s, the low priority camera is degraded to 4.6 MB/s
+    plan = plan_bandwidth(requests, 20.0)
+
+    assert plan == {"high": (1280, 720, 30), "low": (640, 480, 30)}
+
+
+def test_rejected_when_it_cannot_be_degraded():
+    requests = [
+        BandwidthRequest("high", "raw", [(640, 480, 30)], priority=1),
+        BandwidthRequest("low", "raw", [(640, 480, 30), (320, 240, 30)]),
+    ]
+
+    plan = plan_bandwidth(requests, 20.0)
+
+    assert plan == {"high": (640, 480, 30), "low": None}
+
+
+def test_rejected_cameras_are_admitted_again():
+    requests = [
+        BandwidthRequest("c", "raw", [(640, 480, 30)], priority=2),
+        BandwidthRequest("a", "mjpeg", [(1280, 720, 30)], priority=1),
+        BandwidthRequest("b", "raw", [(320, 240, 30)]),
+    ]
+
+    # b is rejected before a, which does not fit next to c either, b does
+    plan = plan_bandwidth(requests, 30.0)
+
+    assert plan == {"c": (640, 480, 30), "a": None, "b": (320, 240, 30)}
+
+
+def test_admitted_again_at_the_cheapest_mode():
+    requests = [
+        BandwidthRequest("c", "raw", [(640, 480, 30)], priority=2),
+        BandwidthRequest("a", "mjpeg", [(1280, 720, 30)], priority=1),
+        BandwidthRequest("b", "raw", [(320, 240, 30), (160, 120, 30)]),
+    ]
+
+    plan = plan_bandwidth(requests, 30.0)
+
+    assert plan["b"] == (160, 120, 30)
+
+
+def test_measured_bandwidth_scales_the_degraded_modes():
+    request = BandwidthRequest("a", "mjpeg", [(1280, 720, 30), (640, 360, 30)],
+                               bandwidth=20.0)
+
+    assert request.get_bandwidth(0) == pytest.approx(20.0)
+    assert request.get_bandwidth(1) == pytest.approx(5.0)
+
+
+def test_capture_framerate_is_planned():
+    request = BandwidthRequest("a", "mjpeg", [(1280, 720, 10)], capture_framerate=30)
+
+    assert request.get_bandwidth(0) == pytest.approx(13.824)
+
+
+def test_without_budget_nothing_is_rejected():
+    requests = [BandwidthRequest("a", "mjpeg", [(1920, 1080, 30), (1280, 720, 30)])]
+
+    assert plan_bandwidth(requests, None) == {"a": (1920, 1080, 30)}
@@ -0,0 +1,95 @@
+import logging
+import threading
+import time
+
+import pytest
+
+from camera_events import CameraEventQueue, LatencyMetrics, RECONFIGURE
+
+
+DEBOUNCE = 0.05
+
+
+class Recorder:
+    def __init__(self):
+        self.events = []
+        self.condition = threading.Condition()
+
+    def __call__(self, action, device, timestamp):
+        with self.condition:
+            self.events.append((action, device["ID_PATH"], device.get("node")))
+            self.condition.notify_all()
+
+    def wait(self, count, timeout=2.0):
+        with self.condition:
+            self.condition.wait_for(lambda: len(self.events) >= count, timeout)
+        # Nothing else may follow
+        time.sleep(DEBOUNCE * 3)
+        return self.events
+
+
+@pytest.fixture
+def recorder():
+    return Recorder()
+
+
+@pytest.fixture
+def events(recorder):
+    return CameraEventQueue(DEBOUNCE, recorder, logging.getLogger("test"))
+
+
+def device(id_path="usb-1", node="/dev/video0"):
+    return {"ID_PATH": id_path, "node": node}
+
+
+def test_burst_is_coalesced_into_last_event(events, recorder):
+    events.push("add", device(node="/dev/video0"))
+    events.push("remove", device(node="/dev/video0"))
+    events.push("add", device(node="/dev/video2"))
+
+    assert recorder.wait(1) == [("add", "usb-1", "/dev/video2")]
+
+
+@pytest.mark.parametrize("action", ["add", "remove"])
+def test_reconfigure_never_replaces_add_or_remove(events, recorder, action):
+    events.push(action, device())
+    events.push(RECONFIGURE, device(node="/dev/stale"))
+
+    assert recorder.wait(2) == [
+        (action, "usb-1", "/dev/video0"),
+        (RECONFIGURE, "usb-1", "/dev/stale"),
+    ]
+
+
+def test_reconfigure_before_add_is_handled_after_it(events, recorder):
+    events.push(RECONFIGURE, device(node="/dev/stale"))
+    events.push("add", device())
+
+    assert [event[0] for event in recorder.wait(2)] == ["add", RECONFIGURE]
+
+
+def test_reconfigures_are_coalesced(events, recorder):
+    events.push(RECONFIGURE, device())
+    events.push(RECONFIGURE, device())
+
+    assert recorder.wait(1) == [(RECONFIGURE, "usb-1", "/dev/video0")]
+
+
+def test_cameras_do_not_coalesce_with_each_other(events, recorder):
+    events.push("add", device("usb-1"))
+    events.push("add", device("usb-2"))
+
+    assert sorted(event[1] for event in recorder.wait(2)) == ["usb-1", "usb-2"]
+
+
+def test_latency_summary():
+    metrics = LatencyMetrics(history=3)
+    for latency in [0.4, 0.1, 0.2, 0.3]:
+        metrics.record("usb-1", latency)
+
+    summary = metrics.summary()["usb-1"]
+    assert summary["count"] == 3
+    assert summary["total"] == 4
+    assert summary["last"] == 0.3
+    assert summary["median"] == 0.2
+    assert summary["max"] == 0.3
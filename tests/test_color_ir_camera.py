@@ -0,0 +1,108 @@
+import tracemalloc
+
+import numpy as np
+import pytest
+
+from color_ir_camera import PipelineBuilder, TemporalDenoiseStage
+from radiometric import TEMPERATURE_OFFSET
+
+
+WIDTH, HEIGHT = 160, 120
+BASE = TEMPERATURE_OFFSET + 2000
+
+
+def make_stage(alpha=0.25, motion_threshold=200):
+    stage = TemporalDenoiseStage(alpha, motion_threshold)
+    spec = stage.output(((HEIGHT, WIDTH), np.dtype('<u2')))
+    return stage, np.empty(spec[0], dtype=spec[1])
+
+
+def constant(value):
+    return np.full((HEIGHT, WIDTH), value, dtype=np.uint16)
+
+
+def test_first_frame_passes_through():
+    stage, dst = make_stage()
+    frame = np.random.default_rng(0).integers(BASE, BASE + 100, (HEIGHT, WIDTH), dtype=np.uint16)
+
+    np.testing.assert_array_equal(stage.transform(frame, dst), frame)
+
+
+def test_noise_is_averaged_out():
+    stage, dst = make_stage()
+    random = np.random.default_rng(0)
+
+    for _ in range(50):
+        frame = random.normal(BASE, 20, (HEIGHT, WIDTH)).astype(np.uint16)
+        output = stage.transform(frame, dst)
+
+    assert output.std() < frame.std() / 2
+
+
+def test_weight_grows_with_the_difference():
+    steps = [0, 40, 80, 120, 160, 200, 400]
+    taken = []
+    for step in steps[1:]:
+        stage, dst = make_stage(alpha=0.25, motion_threshold=200)
+        stage.transform(constant(BASE), dst)
+        output = stage.transform(constant(BASE + step), dst)
+        taken.append((int(output[0, 0]) - BASE) / step)
+
+    # alpha for small differences, linear up to the whole step at the threshold
+    assert taken[0] == pytest.approx(0.25 + 0.75 * 40 / 200)
+    assert taken == sorted(taken)
+    assert taken[-2] == taken[-1] == 1.0
+
+
+def test_small_changes_converge_within_the_dead_band():
+    stage, dst = make_stage()
+    stage.transform(constant(BASE), dst)
+
+    for _ in range(100):
+        output = stage.transform(constant(BASE + 10), dst)
+
+    assert np.all(np.abs(output.astype(int) - (BASE + 10)) <= 1)
+
+
+def test_negative_steps_mirror_positive_ones():
+    stage, dst = make_stage()
+    stage.transform(constant(BASE), dst)
+    output = stage.transform(constant(BASE - 40), dst)
+
+    assert np.all(output == BASE - 16)
+
+
+def test_does_not_allocate_per_frame():
+    stage, dst = make_stage()
+    random = np.random.default_rng(0)
+    frames = [random.normal(BASE, 20, (HEIGHT, WIDTH)).astype(np.uint16) for _ in range(10)]
+    stage.transform(frames[0], dst)
+
+    tracemalloc.start()
+    for frame in frames[1:]:
+        stage.transform(frame, dst)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    assert peak < 4096
+
+
+def test_markers_are_found_after_denoising():
+    pipeline = PipelineBuilder(WIDTH, HEIGHT) \
+        .add_temporal_denoise(0.25, 200) \
+        .add_normalization(0, 255) \
+        .add_mark_max_temperature((7, 7, 7)) \
+        .build()
+
+    frame = constant(BASE)
+    frame[10, 10] = BASE + 60
+    for _ in range(20):
+        pipeline.apply(frame)
+
+    # Hotter than the hot spot for a single frame, averaged below it
+    noisy = frame.copy()
+    noisy[50, 50] = BASE + 80
+    output = pipeline.apply(noisy)
+
+    assert output[10, 10] == 7
+    assert output[50, 50] != 7
@@ -0,0 +1,56 @@
+import socket
+import time
+
+import numpy as np
+import pytest
+
+from config import FusionConfig
+from fusion import ThermalReceiver
+
+
+WIDTH, HEIGHT = 160, 120
+
+
+@pytest.fixture
+def sockets():
+    receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    receiver.bind(("127.0.0.1", 0))
+    sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sender.connect(receiver.getsockname())
+    yield receiver, sender
+    sender.close()
+    receiver.close()
+
+
+def make_frame(value):
+    return np.full((HEIGHT, WIDTH, 3), value, dtype=np.uint8)
+
+
+def test_default_thermal_size_matches_runner_output():
+    config = FusionConfig(color="usb", homography=np.eye(3).tolist())
+    assert (config.thermal_width, config.thermal_height) == (WIDTH, HEIGHT)
+
+
+def test_receives_full_frame(sockets):
+    receiver, sender = sockets
+    thermal = ThermalReceiver("127.0.0.1", 0, WIDTH, HEIGHT)
+
+    frame = make_frame(7)
+    frame[-1] = 200
+    sender.send(frame.tobytes())
+
+    assert thermal.receive(receiver)
+    received = thermal.get_nearest(time.monotonic_ns(), 10 ** 9)
+    np.testing.assert_array_equal(received, frame)
+
+
+@pytest.mark.parametrize("rows", [HEIGHT - 2, HEIGHT + 2])
+def test_drops_datagrams_of_another_size(sockets, rows):
+    receiver, sender = sockets
+    thermal = ThermalReceiver("127.0.0.1", 0, WIDTH, HEIGHT)
+
+    sender.send(np.zeros((rows, WIDTH, 3), dtype=np.uint8).tobytes())
+
+    assert not thermal.receive(receiver)
+    assert thermal.dropped == 1
+    assert thermal.get_nearest(0, 10 ** 18) is None
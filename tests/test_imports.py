@@ -0,0 +1,40 @@
+import importlib
+import os
+
+import pytest
+
+
+SRC = os.path.join(os.path.dirname(__file__), "..", "src")
+
+
+def test_no_undefined_names():
+    """A dropped import otherwise only fails when its code runs"""
+    api = pytest.importorskip("pyflakes.api")
+    reporter = pytest.importorskip("pyflakes.reporter")
+
+    class Collector(reporter.Reporter):
+        def __init__(self):
+            self.messages = []
+
+        def unexpectedError(self, filename, message):
+            self.messages.append(f"{filename}: {message}")
+
+        def syntaxError(self, filename, message, lineno, offset, text):
+            self.messages.append(f"{filename}:{lineno}: {message}")
+
+        def flake(self, message):
+            if "undefined name" in str(message):
+                self.messages.append(str(message))
+
+    collector = Collector()
+    api.checkRecursive([SRC], collector)
+
+    assert collector.messages == []
+
+
+@pytest.mark.parametrize("module", ["pipelines", "supervisor", "cameras", "fusion"])
+def test_entry_points_import(module):
+    pytest.importorskip("gi")
+    pytest.importorskip("pyudev")
+
+    importlib.import_module(module)
@@ -0,0 +1,89 @@
+import pytest
+
+pytest.importorskip("gi")
+
+import gi
+
+gi.require_version("Gst", "1.0")
+from gi.repository import Gst
+
+from config import LatencyProfile, PipelineGraph
+from pipeline_graph import DEFAULT_GRAPHS, compile_graph
+
+
+Gst.init(None)
+
+PARAMETERS = {
+    "device": "/dev/video0",
+    "width": 640,
+    "height": 480,
+    "framerate": 15,
+    "capture_width": 1280,
+    "capture_height": 960,
+    "capture_framerate": 30,
+    "lowres": 1,
+    "output_format": "GRAY8",
+    "format": "I420",
+    "host": "127.0.0.1",
+    "port": 5000,
+}
+
+
+def graph(*elements):
+    return PipelineGraph(source=list(elements))
+
+
+@pytest.mark.parametrize("name", sorted(DEFAULT_GRAPHS))
+@pytest.mark.parametrize("profile", list(LatencyProfile))
+def test_default_graphs_compile(name, profile):
+    plan = compile_graph(DEFAULT_GRAPHS[name], PARAMETERS, profile)
+    instance = plan.instantiate()
+
+    assert instance.chain[0].get_name() in ("camera-source", "udp-source", "tone-mapped-source")
+
+
+def test_plans_are_cached():
+    first = compile_graph(DEFAULT_GRAPHS["mjpeg"], PARAMETERS)
+
+    assert compile_graph(DEFAULT_GRAPHS["mjpeg"], dict(PARAMETERS)) is first
+    assert compile_graph(DEFAULT_GRAPHS["mjpeg"], dict(PARAMETERS, width=320)) is not first
+    assert compile_graph(DEFAULT_GRAPHS["mjpeg"], PARAMETERS, LatencyProfile.Low) is not first
+
+
+def test_parameters_are_substituted_and_parsed():
+    plan = compile_graph(DEFAULT_GRAPHS["mjpeg_scaled"], PARAMETERS)
+    elements = plan.instantiate().elements
+
+    assert elements["camera-source"].get_property("device") == "/dev/video0"
+    structure = elements["filter"].get_property("caps").get_structure(0)
+    assert structure.get_value("width") == 1280
+    assert structure.get_value("height") == 960
+    assert elements["decode"].get_property("lowres") == 1
+
+
+def test_profile_only_elements():
+    default = compile_graph(DEFAULT_GRAPHS["mjpeg"], PARAMETERS, LatencyProfile.Default)
+    low = compile_graph(DEFAULT_GRAPHS["mjpeg"], PARAMETERS, LatencyProfile.Low)
+
+    assert "queue" not in default.instantiate().elements
+    queue = low.instantiate().elements["queue"]
+    assert queue.get_property("max-size-buffers") == 1
+
+
+@pytest.mark.parametrize("elements, message", [
+    ([{"factory": "videotestsrc", "properties": {"pattern": "${missing}"}}],
+     "Unknown graph parameter"),
+    ([{"factory": "no-such-element"}], "not available"),
+    ([{"factory": "videotestsrc", "properties": {"no-such-property": 1}}],
+     "has no property"),
+    ([{"factory": "videotestsrc", "name": "same"}, {"factory": "queue", "name": "same"}],
+     "Duplicate element names same"),
+    ([{"factory": "videotestsrc"},
+      {"factory": "capsfilter", "properties": {"caps": "audio/x-raw"}},
+      {"factory": "videoconvert"}],
+     "cannot be linked"),
+    ([{"factory": "appsrc", "properties": {"caps": "video/x-raw"}}], "not fixed"),
+])
+def test_invalid_graphs(elements, message):
+    with pytest.raises(ValueError, match=message):
+        compile_graph(graph(*elements), PARAMETERS)
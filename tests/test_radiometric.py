@@ -0,0 +1,93 @@
+import os
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+
+from radiometric import RadiometricDecoder, RadiometricEncoder, \
+    TEMPERATURE_OFFSET, to_temperature
+
+
+WIDTH, HEIGHT = 160, 120
+
+
+def make_frames(count, seed=0):
+    """Noisy frames around room temperature with a moving hot spot"""
+    random = np.random.default_rng(seed)
+    base = TEMPERATURE_OFFSET + 2000
+    frames = []
+    for index in range(count):
+        frame = random.normal(base, 20, (HEIGHT, WIDTH)).astype(np.uint16)
+        frame[40:60, index:index + 20] = 40000
+        frames.append(frame)
+    return frames
+
+
+def test_round_trip_is_lossless():
+    encoder = RadiometricEncoder(WIDTH, HEIGHT, keyframe_interval=4)
+    decoder = RadiometricDecoder()
+
+    keyframes = []
+    for frame in make_frames(10):
+        message, keyframe = encoder.encode(frame, timestamp=1.0)
+        keyframes.append(keyframe)
+
+        decoded, header = decoder.decode(message)
+        np.testing.assert_array_equal(decoded, frame)
+        assert header["keyframe"] == keyframe
+
+    assert keyframes == [True, False, False, False] * 2 + [True, False]
+
+
+def test_round_trip_of_extreme_values():
+    encoder = RadiometricEncoder(WIDTH, HEIGHT)
+    decoder = RadiometricDecoder()
+
+    frames = [np.zeros((HEIGHT, WIDTH), np.uint16),
+              np.full((HEIGHT, WIDTH), 65535, np.uint16)]
+    frames.append(np.tile(np.array([0, 65535], np.uint16), (HEIGHT, WIDTH // 2)))
+
+    for frame in frames:
+        decoded, _ = decoder.decode(encoder.encode(frame)[0])
+        np.testing.assert_array_equal(decoded, frame)
+
+
+def test_compresses_noisy_frames():
+    encoder = RadiometricEncoder(WIDTH, HEIGHT)
+    sizes = [len(encoder.encode(frame)[0]) for frame in make_frames(5)]
+
+    assert max(sizes) < WIDTH * HEIGHT * 2 * 0.6
+
+
+def test_decoder_waits_for_keyframe_after_gap():
+    encoder = RadiometricEncoder(WIDTH, HEIGHT, keyframe_interval=100)
+    decoder = RadiometricDecoder()
+    messages = [encoder.encode(frame)[0] for frame in make_frames(4)]
+
+    assert decoder.decode(messages[0]) is not None
+    # A lost delta cannot be applied to the frame before it
+    assert decoder.decode(messages[2]) is None
+    assert decoder.decode(messages[3]) is None
+
+    encoder.force_keyframe()
+    frame = make_frames(1, seed=1)[0]
+    decoded, header = decoder.decode(encoder.encode(frame)[0])
+    assert header["keyframe"]
+    np.testing.assert_array_equal(decoded, frame)
+
+
+def test_rejects_other_messages():
+    with pytest.raises(ValueError):
+        RadiometricDecoder().decode(b"\0" * 64)
+
+
+def test_temperature():
+    frame = np.array([[TEMPERATURE_OFFSET, TEMPERATURE_OFFSET + 3650]], np.uint16)
+    np.testing.assert_allclose(to_temperature(frame), [[0.0, 36.5]])
+
+
+def test_pipeline_does_not_need_websockets():
+    src = os.path.join(os.path.dirname(__file__), "..", "src")
+    code = "import sys; sys.modules['websockets'] = None; import color_ir_camera"
+    subprocess.run([sys.executable, "-c", code], cwd=src, check=True)
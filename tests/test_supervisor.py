@@ -0,0 +1,160 @@
+import logging
+import os
+import re
+import time
+
+import pytest
+
+pytest.importorskip("gi")
+
+from config import SupervisorConfig
+from supervisor import Supervisor
+
+
+class StubCamera:
+    """Stands in for a camera class in the worker, commands misbehave on purpose"""
+
+    def __init__(self, logger, name, **kwargs):
+        self.logger = logger
+        self.name = name
+        self.on_consumers_changed = None
+
+    def report_consumers(self, full, degraded, rejected):
+        self.on_consumers_changed(self, full, degraded, rejected)
+
+    def set_admission_limits(self, max_full, max_total, divisor):
+        # Echoed back, so that the test sees the worker got them
+        self.on_consumers_changed(self, max_full, max_total, divisor)
+
+    def crash(self):
+        os._exit(3)
+
+    def hang(self):
+        time.sleep(60)
+
+    def stop_pipeline(self):
+        pass
+
+
+KWARGS = {"name": "stub", "width": 640, "height": 480, "framerate": 10}
+
+
+class Messages(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+    def delays(self):
+        return [float(match.group(1)) for match in
+                (re.search(r"restarting in ([\d.]+) s", message) for message in self.messages)
+                if match is not None]
+
+
+def wait_for(condition, timeout=20.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return
+        time.sleep(0.02)
+    raise AssertionError("condition not met in time")
+
+
+@pytest.fixture
+def supervise(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    cameras = []
+    messages = Messages()
+
+    def supervise(**config):
+        config = dict(dict(heartbeat_interval=0.05, heartbeat_timeout=1.0,
+                           restart_backoff=0.2, restart_backoff_max=1.5,
+                           report_interval=60.0), **config)
+        supervisor = Supervisor(SupervisorConfig(**config))
+        supervisor.logger.addHandler(messages)
+        camera = supervisor.spawn(StubCamera, "/dev/stub", dict(KWARGS))
+        cameras.append(camera)
+        return supervisor, camera, messages
+
+    yield supervise
+
+    for camera in cameras:
+        camera.stop_pipeline()
+    logging.getLogger("Supervisor").removeHandler(messages)
+
+
+def crash_and_wait_restart(camera):
+    pid = camera.process.pid
+    camera.send("crash")
+    wait_for(lambda: camera.process is not None and camera.process.pid != pid)
+
+
+def test_commands_are_routed_to_the_camera(supervise):
+    _, camera, _ = supervise()
+    counts = []
+    camera.on_consumers_changed = lambda camera, *arguments: counts.append(arguments)
+
+    camera.send("report_consumers", 2, 1, 0)
+
+    wait_for(lambda: (2, 1, 0) in counts)
+
+
+def test_crashed_worker_is_restarted_with_growing_backoff(supervise):
+    _, camera, messages = supervise()
+
+    for _ in range(3):
+        crash_and_wait_restart(camera)
+
+    assert all("worker exited with code 3" in message
+               for message in messages.messages if "restarting in" in message)
+    assert messages.delays() == [0.2, 0.4, 0.8]
+    assert camera.stats["restarts"] == 3
+
+
+def test_backoff_is_capped(supervise):
+    _, camera, messages = supervise(restart_backoff=0.4, restart_backoff_max=0.6)
+
+    for _ in range(2):
+        crash_and_wait_restart(camera)
+
+    assert messages.delays() == [0.4, 0.6]
+
+
+def test_backoff_resets_once_stable(supervise):
+    _, camera, messages = supervise(restart_backoff_max=1.0)
+
+    crash_and_wait_restart(camera)
+    crash_and_wait_restart(camera)
+    assert camera.failures == 2
+
+    # Stable for longer than restart_backoff_max
+    wait_for(lambda: camera.failures == 0)
+    crash_and_wait_restart(camera)
+
+    assert messages.delays() == [0.2, 0.4, 0.2]
+
+
+def test_missed_heartbeats_restart_the_worker(supervise):
+    _, camera, messages = supervise(heartbeat_timeout=0.5)
+    pid = camera.process.pid
+
+    camera.send("hang")
+
+    wait_for(lambda: camera.process is not None and camera.process.pid != pid)
+    assert any("stopped sending heartbeats" in message for message in messages.messages)
+    assert camera.stats["restarts"] == 1
+
+
+def test_restarted_worker_gets_its_admission_limits(supervise):
+    _, camera, _ = supervise()
+    counts = []
+    camera.set_admission_limits(1, 2, 3)
+    camera.on_consumers_changed = lambda camera, *arguments: counts.append(arguments)
+
+    crash_and_wait_restart(camera)
+
+    # Consumers of the old worker are gone, the new one is limited again
+    wait_for(lambda: (0, 0, 0) in counts)
+    wait_for(lambda: counts[-1] == (1, 2, 3))
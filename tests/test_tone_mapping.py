@@ -0,0 +1,83 @@
+import cv2
+import numpy as np
+import pytest
+
+from tone_mapping import HISTOGRAM_SHIFT, ToneMapper, get_colormap
+
+
+WIDTH, HEIGHT = 160, 120
+BIN = 1 << HISTOGRAM_SHIFT
+
+
+def gradient(low, high):
+    """Every row spans low to high evenly"""
+    row = np.linspace(low, high, WIDTH, endpoint=False).astype(np.uint16)
+    return np.tile(row, (HEIGHT, 1))
+
+
+def test_get_colormap():
+    assert get_colormap(None) is None
+    assert get_colormap("inferno") == cv2.COLORMAP_INFERNO
+    assert get_colormap("Jet") == cv2.COLORMAP_JET
+
+    with pytest.raises(ValueError, match="Unknown colormap"):
+        get_colormap("no-such-colormap")
+
+
+def test_range_follows_the_percentiles():
+    mapper = ToneMapper(low_percentile=5, high_percentile=95, sample_step=1)
+
+    low, high = mapper.update(gradient(20000, 30000))
+
+    assert low == pytest.approx(20500, abs=2 * BIN)
+    assert high == pytest.approx(29500, abs=2 * BIN)
+    assert mapper.range == (low, high)
+
+
+def test_range_is_smoothed():
+    mapper = ToneMapper(smoothing=0.1, sample_step=1)
+    mapper.update(gradient(20000, 30000))
+
+    # A hotter scene only has a tenth of the histogram at first
+    low, high = mapper.update(gradient(40000, 50000))
+    assert low < 30000 and high > 40000
+
+    for _ in range(100):
+        low, high = mapper.update(gradient(40000, 50000))
+    assert low > 40000 and high <= 50000 + BIN
+
+
+def test_flat_scene_keeps_min_range():
+    mapper = ToneMapper(min_range=256, sample_step=1)
+
+    low, high = mapper.update(np.full((HEIGHT, WIDTH), 25000, dtype=np.uint16))
+
+    assert high - low == 256
+    assert low <= 25000 < high
+
+
+def test_gray_output():
+    mapper = ToneMapper(low_percentile=5, high_percentile=95, sample_step=1)
+    frame = gradient(20000, 30000)
+    dst = np.empty((HEIGHT, WIDTH), dtype=np.uint8)
+
+    output = mapper.apply(frame, dst)
+
+    assert mapper.channels == 1
+    assert output is dst
+    # Clipped outside of the range and increasing within it
+    assert output[0, 0] == 0
+    assert output[0, -1] == 255
+    assert np.all(np.diff(output[0].astype(int)) >= 0)
+
+
+def test_colormap_output():
+    gray_mapper = ToneMapper(sample_step=1)
+    color_mapper = ToneMapper(colormap=cv2.COLORMAP_INFERNO, sample_step=1)
+    frame = gradient(20000, 30000)
+
+    gray = gray_mapper.apply(frame, np.empty((HEIGHT, WIDTH), dtype=np.uint8))
+    color = color_mapper.apply(frame, np.empty((HEIGHT, WIDTH, 3), dtype=np.uint8))
+
+    assert color_mapper.channels == 3
+    np.testing.assert_array_equal(color, cv2.applyColorMap(gray, cv2.COLORMAP_INFERNO))
@@ -0,0 +1,92 @@
+import logging
+
+import pytest
+
+import utils
+from utils import RateLimitFilter, RingBufferHandler
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(utils.time, "monotonic", clock)
+    return clock
+
+
+def make_record(message, key=None, level=logging.INFO):
+    record = logging.LogRecord("test", level, __file__, 1, message, None, None)
+    if key is not None:
+        record.rate_limit_key = key
+    return record
+
+
+def test_burst_then_suppressed_then_summary(clock):
+    rate_limit = RateLimitFilter(burst=3, interval=10.0)
+
+    passed = [rate_limit.filter(make_record(f"failed {index}", "usb-1"))
+              for index in range(7)]
+    assert passed == [True] * 3 + [False] * 4
+    assert rate_limit.windows["usb-1"][2] == 4
+
+    # The first record of the next window reports the suppressed ones
+    clock.now += 10.0
+    record = make_record("failed again", "usb-1")
+    assert rate_limit.filter(record)
+    assert record.getMessage() == "failed again (suppressed 4 similar messages)"
+
+    record = make_record("failed once more", "usb-1")
+    assert rate_limit.filter(record)
+    assert record.getMessage() == "failed once more"
+
+
+def test_keys_are_limited_separately(clock):
+    rate_limit = RateLimitFilter(burst=1, interval=10.0)
+
+    assert rate_limit.filter(make_record("a", "usb-1"))
+    assert not rate_limit.filter(make_record("a", "usb-1"))
+    assert rate_limit.filter(make_record("b", "usb-2"))
+
+
+def test_records_without_key_are_not_limited(clock):
+    rate_limit = RateLimitFilter(burst=1, interval=10.0)
+
+    assert all(rate_limit.filter(make_record("plain")) for _ in range(10))
+
+
+def test_ring_buffer_dumps_on_error(tmp_path):
+    path = tmp_path / "recent.log"
+    handler = RingBufferHandler(str(path), capacity=3)
+    handler.setFormatter(logging.Formatter("%(levelname)s %(message)s"))
+
+    for index in range(5):
+        handler.handle(make_record(f"message {index}"))
+    assert not path.exists()
+
+    handler.handle(make_record("broken", level=logging.ERROR))
+
+    # Oldest first, only the last `capacity` records
+    assert path.read_text().splitlines() == [
+        "INFO message 3",
+        "INFO message 4",
+        "ERROR broken",
+    ]
+
+
+def test_ring_buffer_dump_replaces_the_file(tmp_path):
+    path = tmp_path / "recent.log"
+    handler = RingBufferHandler(str(path), capacity=2)
+    handler.setFormatter(logging.Formatter("%(message)s"))
+
+    handler.handle(make_record("first", level=logging.ERROR))
+    handler.handle(make_record("second"))
+    handler.handle(make_record("third", level=logging.CRITICAL))
+
+    assert path.read_text().splitlines() == ["second", "third"]